@@ -43,6 +43,9 @@ function build_dist {
     poetry build -f wheel
     echo '' >'src/res/ini.events'
     echo '' >'src/res/object-graph.pkl'
+    rm -f 'src/res/resume-token.json' 'src/res/trend-sequences.json' \
+        'src/res/backfill-state.json' 'src/res/rtt-estimates.json' src/res/spool.sqlite3*
+    rm -rf 'src/res/Diagnostics'
     cp -r src/res/ dist/
 
     zip -r "$package" dist/
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from functools import partial
+from bacpypes3.apdu import (
+    SimpleAckPDU,
+    ConfirmedRequestPDU,
+    AbortPDU,
+    AbortReason,
+    ErrorRejectAbortNack,
+)
+from bacpypes3.ipv4.app import NormalApplication
+from .Networks import NetworkService, activity
+from .Timeouts import TimeoutService
+from .Metrics import registry, Histogram
+
+requests = registry.counter(
+    "bacnet_requests_total", "Confirmed requests sent", ("device", "activity")
+)
+request_errors = registry.counter(
+    "bacnet_request_errors_total",
+    "Confirmed requests answered with an error, reject or abort",
+    ("device", "activity"),
+)
+request_timeouts = registry.counter(
+    "bacnet_request_timeouts_total",
+    "Confirmed requests left unanswered after all retries",
+    ("device", "activity"),
+)
+request_seconds = registry.histogram(
+    "bacnet_request_seconds", "Confirmed request round trip", ("activity",), Histogram.latency
+)
+requests_in_flight = registry.gauge("bacnet_requests_in_flight", "Confirmed requests in flight")
+
+
+class TransactionList(list):
+    """
+    The stack's list of client transactions. Each transaction is configured with the
+    adaptive timeout and retries of its device as it is added, before its first send.
+    """
+
+    def __init__(self, timeouts: TimeoutService) -> None:
+        super().__init__()
+        self.timeouts = timeouts
+
+    def append(self, transaction):
+        self.timeouts.configure(transaction)
+        super().append(transaction)
+
+
+class ClientApplication(NormalApplication):
+    """
+    The gateway's bacpypes3 application. Services subscribe to the unsolicited requests they
+    care about by APDU class name, and every handler gets the request once the stack is done
+    with it. Confirmed requests are acknowledged before the handlers run, so a slow database
+    write never makes the device retry its notification.
+
+    When the network service is enabled, every confirmed request waits for a slot on its
+    destination network before it is sent. With adaptive timeouts enabled, its round trip is
+    measured once it is admitted, and with metrics enabled it is counted and timed.
+    """
+
+    def __init__(self, device_object, local_address) -> None:
+        super().__init__(device_object, local_address)
+        self.handlers = defaultdict(list)
+        self.networks = NetworkService()
+        self.timeouts = TimeoutService()
+        self.asap.clientTransactions = TransactionList(self.timeouts)
+        self.logger = logging.getLogger("ClientLog")
+
+    def request(self, apdu):
+        if not isinstance(apdu, ConfirmedRequestPDU) or (
+            self.networks.enabled is not True
+            and self.timeouts.enabled is not True  # noqa: W503
+            and registry.enabled is not True  # noqa: W503
+        ):
+            return super().request(apdu)
+        return asyncio.ensure_future(self.confirmed_request(apdu))
+
+    async def confirmed_request(self, apdu):
+        request = partial(super().request, apdu)
+        if registry.enabled is True:
+            request = partial(self.instrumented, apdu.pduDestination, request)
+        if self.timeouts.enabled is True:
+            request = partial(self.timeouts.measure, apdu.pduDestination, request)
+        if self.networks.enabled is True:
+            return await self.networks.submit(apdu.pduDestination, request)
+        return await request()
+
+    async def instrumented(self, address, request):
+        labels = {"device": str(address), "activity": activity.get()}
+        requests.inc(**labels)
+        requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            return await request()
+        except AbortPDU as e:
+            if e.apduAbortRejectReason == AbortReason.noResponse:
+                request_timeouts.inc(**labels)
+            else:
+                request_errors.inc(**labels)
+            raise
+        except (Exception, ErrorRejectAbortNack):
+            request_errors.inc(**labels)
+            raise
+        finally:
+            requests_in_flight.dec()
+            request_seconds.observe(time.perf_counter() - start, activity=labels["activity"])
+
+    def register(self, apduType: str, handler):
+        if handler not in self.handlers[apduType]:
+            self.handlers[apduType].append(handler)
+
+    async def dispatch(self, apdu):
+        for handler in self.handlers.get(type(apdu).__name__, []):
+            try:
+                await handler(apdu)
+            except Exception as e:
+                self.logger.error(f"{type(apdu).__name__} handler failed: {e}")
+
+    async def do_IAmRequest(self, apdu) -> None:
+        await super().do_IAmRequest(apdu)
+        await self.dispatch(apdu)
+
+    async def do_ConfirmedEventNotificationRequest(self, apdu) -> None:
+        await self.response(SimpleAckPDU(context=apdu))
+        await self.dispatch(apdu)
+
+    async def do_UnconfirmedEventNotificationRequest(self, apdu) -> None:
+        await self.dispatch(apdu)
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import datetime as dt
+from collections import deque
+from .Device import LocalBacnetDevice
+from .Trend import TrendLog
+from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
+from bacpypes3.ipv4.app import NormalApplication
+
+
+class GapTracker:
+    """
+    Remembers when each polled point last produced a sample, and reports the window between
+    two samples as a gap when it is longer than the threshold. The per-device time of the
+    last successful poll is what gets persisted, so a gateway restart shows up as a gap for
+    every point of the device on its first poll afterwards.
+    """
+
+    def __init__(self, threshold: float) -> None:
+        self.threshold = threshold
+        self.points: dict = {}
+        self.devices: dict = {}
+
+    def observe(self, deviceId, points, timestamp: float) -> list:
+        """
+        Record a poll of the given points at timestamp, returning the (device, point, begin,
+        end) windows that have no samples.
+        """
+        gaps = []
+        deviceId = str(deviceId)
+        previous = self.devices.get(deviceId)
+        for point in points:
+            key = (deviceId, str(point))
+            last = self.points.get(key, previous)
+            if last is not None and timestamp - last > self.threshold:
+                gaps.append((deviceId, str(point), last, timestamp))
+            self.points[key] = timestamp
+        if len(points) > 0:
+            self.devices[deviceId] = timestamp
+        return gaps
+
+
+class BackfillService(Subscriber):
+    """
+    Bacnet Gap Backfill Service: fills the holes left in the History collection by outages
+    with the samples the devices kept in their own trend logs. Gaps are reported by the
+    polling service; for each one, the trend-log monitoring the point (if any) is read by
+    time over the missing window only, and the samples are written to History in bulk.
+    Requests to the field bus are throttled to a fixed rate so a recovery does not flood
+    the network right after an outage. The trend log maps are read again after an hour, so
+    logs added (or failing) since are picked up.
+    """
+
+    __instance = None
+    __collection = "History"
+    __map_ttl = 3600
+
+    def __init__(self) -> None:
+        self.app: NormalApplication = None
+        self.localMgr: LocalManager = LocalManager()
+        self.mongo = None
+        self.scheduler: ServiceScheduler = ServiceScheduler()
+        self.localDevice = LocalBacnetDevice()
+        self.tracker: GapTracker = None
+        self.gaps: deque = deque()
+        self.trendMaps: dict = {}
+        self.nextRequest = 0
+        self.bf_fp = None
+        self.initialized = False
+        self.settings: dict = {
+            "section": "backfill",
+            "enable": None,
+            "interval": None,
+            "threshold": 3,
+            "rate": 2,
+            "chunk": 100,
+            "maxwindow": 604800,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if BackfillService.__instance is None:
+            BackfillService.__instance = object.__new__(cls)
+        return BackfillService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.localMgr.read_setting(
+            self.settings.get("section"), "enable", fallback=False
+        ) is True
+
+    def read_settings(self):
+        section = self.settings.get("section")
+        for option in ("threshold", "rate", "chunk", "maxwindow"):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+
+    def initialize(self):
+        if self.initialized is True:
+            return
+        self.read_settings()
+        self.bf_fp = f"{self.localMgr.respath}backfill-state.json"
+        self.tracker = GapTracker(0)
+        self.load_state()
+        self.initialized = True
+
+    def record(self, deviceId, specs: dict, interval: float):
+        """
+        Called by the polling service after each device poll with the point specs it read.
+        Points whose update failed carry no "last synced" stamp and count as missing. A gap
+        is a silence longer than threshold poll intervals.
+        """
+        self.initialize()
+        self.tracker.threshold = self.settings.get("threshold") * interval
+        polled = [point for point, spec in specs.items() if "last synced" in spec]
+        for gap in self.tracker.observe(deviceId, polled, time.time()):
+            self.gaps.append(gap)
+
+    async def run(self, bacapp):
+        if self.app is None:
+            self.app = bacapp.app
+        if self.mongo is None:
+            self.mongo = bacapp.clients.get("mongodb")
+
+        if bacapp.localMgr.initialized is True:
+            if self.subscribed is False:
+                bacapp.localMgr.subscribe(self.__instance)
+                self.subscribed = True
+
+            section = self.settings.get("section")
+            self.settings["enable"] = self.localMgr.read_setting(section, "enable")
+            self.settings["interval"] = self.localMgr.read_setting(section, "interval")
+            self.initialize()
+            self.read_settings()
+
+            if self.scheduler.check_ticket(section, interval=self.settings.get("interval")):
+                await self.mongo.createTimeSeries(
+                    self.mongo.getDb(), BackfillService.__collection, "timestamp", "meta"
+                )
+                await self.backfill()
+
+    async def throttle(self):
+        rate = self.settings.get("rate")
+        if not rate or rate <= 0:
+            return  # unthrottled
+        now = time.monotonic()
+        if self.nextRequest > now:
+            await asyncio.sleep(self.nextRequest - now)
+        self.nextRequest = max(now, self.nextRequest) + 1 / rate
+
+    async def backfill(self):
+        """
+        Work through the pending gaps once. A gap that cannot be filled because its device is
+        unreachable goes back to the end of the queue for the next cycle, until it ends more
+        than maxwindow seconds ago: by then the device's trend log no longer holds it.
+        """
+        if len(self.gaps) == 0:
+            return
+        self.logger.info(f"backfill started, {len(self.gaps)} gaps pending...")
+        filled = 0
+        samples = 0
+        expired = 0
+        unreachable = set()
+        now = time.time()
+        for _ in range(len(self.gaps)):
+            gap = self.gaps.popleft()
+            deviceId, point, begin, end = gap
+            if now - end > self.settings.get("maxwindow"):
+                expired += 1
+                continue
+            if deviceId in unreachable:
+                self.gaps.append(gap)
+                continue
+            try:
+                trendLog = await self.find_trend_log(deviceId, point)
+                if trendLog is None:
+                    continue
+                begin = max(begin, end - self.settings.get("maxwindow"))
+                records = await trendLog.fetch_between(
+                    dt.datetime.fromtimestamp(begin, tz=dt.timezone.utc),
+                    dt.datetime.fromtimestamp(end, tz=dt.timezone.utc),
+                    self.settings.get("chunk"),
+                )
+            except Exception as e:
+                self.logger.warning(f"backfill of {deviceId} deferred: {e}")
+                unreachable.add(deviceId)
+                self.gaps.append(gap)
+                continue
+            history = [
+                {
+                    "timestamp": record["timestamp"],
+                    "meta": {"device": deviceId, "point": point},
+                    "value": record["value"],
+                    "source": "backfill",
+                }
+                for record in records
+            ]
+            if len(history) > 0:
+                await self.mongo.writeDocuments(
+                    history, self.mongo.getDb(), BackfillService.__collection
+                )
+            filled += 1
+            samples += len(history)
+        self.save_state()
+        if expired > 0:
+            self.logger.warning(f"backfill dropped {expired} gaps older than the max window")
+        self.logger.info(f"backfill completed, {samples} samples in {filled} gaps...")
+
+    async def find_trend_log(self, deviceId: str, point: str):
+        """
+        The trend-log monitoring the given point on the device, if any. Each device's trend
+        logs are mapped to the objects they monitor and cached for an hour. A trend log whose
+        reference cannot be read is left out of the map, the device's other logs still count.
+        """
+        cached = self.trendMaps.get(deviceId)
+        if cached is None or cached[0] <= time.monotonic():
+            device = await self.mongo.findDocument(
+                self.mongo.getDb(), "Devices", {"id": deviceId}
+            )
+            if device is None:
+                return None
+            edge = {
+                "id": deviceId,
+                "name": device["properties"]["device-name"]["value"],
+                "address": device["address"],
+            }
+            trendMap = {}
+            answered, error = 0, None
+            for obj in device["properties"]["object-list"]["value"]:
+                if not str(obj).startswith("trend-log,"):
+                    continue
+                trendLog = TrendLog(self.app, self.localDevice, edge, obj)
+                trendLog.throttle = self.throttle
+                try:
+                    reference = await trendLog.read("logDeviceObjectProperty")
+                except Exception as e:
+                    self.logger.warning(f"backfill: skipping {deviceId} {obj}: {e}")
+                    error = e
+                    continue
+                answered += 1
+                if reference.deviceIdentifier is None or str(
+                    reference.deviceIdentifier
+                ) == deviceId:
+                    trendMap[str(reference.objectIdentifier)] = trendLog
+            if answered == 0 and error is not None:
+                raise error  # none of its logs answered, the device is unreachable
+            self.trendMaps[deviceId] = (time.monotonic() + BackfillService.__map_ttl, trendMap)
+        return self.trendMaps[deviceId][1].get(point)
+
+    def load_state(self):
+        try:
+            with open(self.bf_fp) as state:
+                state = json.load(state)
+            self.tracker.devices = state.get("devices", {})
+            self.gaps = deque(tuple(gap) for gap in state.get("gaps", []))
+        except Exception:
+            pass
+
+    def save_state(self):
+        try:
+            tmp_fp = f"{self.bf_fp}.tmp"
+            with open(tmp_fp, "w") as state:
+                json.dump({"devices": self.tracker.devices, "gaps": list(self.gaps)}, state)
+            os.replace(tmp_fp, self.bf_fp)
+        except Exception as e:
+            self.logger.error(f"unable to persist backfill state: {e}")
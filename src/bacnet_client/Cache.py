@@ -0,0 +1,112 @@
+import time
+from bisect import bisect_left, insort
+
+
+class ValueCache:
+    """
+    The latest value of every polled point, kept in memory by the polling service. Entries
+    are keyed by (device, object) and indexed by device, by object type and by point name,
+    so bulk lookups never scan the whole cache: the device and type indexes are sets, and
+    names are kept sorted for prefix searches. Point names come from the point discovery
+    service, or from the Points collection at startup, since polling does not read them.
+    """
+
+    def __init__(self) -> None:
+        self.entries: dict = {}
+        self.byDevice: dict = {}
+        self.byType: dict = {}
+        self.names: list = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, deviceId, obj) -> dict:
+        key = (str(deviceId), str(obj))
+        if key not in self.entries:
+            self.entries[key] = {
+                "device": key[0],
+                "object": key[1],
+                "name": None,
+                "value": None,
+                "status": None,
+                "reliability": None,
+                "last synced": None,
+                "timestamp": None,
+            }
+            self.byDevice.setdefault(key[0], set()).add(key)
+            self.byType.setdefault(key[1].split(",")[0], set()).add(key)
+        return self.entries[key]
+
+    def rename(self, entry: dict, name):
+        key = (entry["device"], entry["object"])
+        if entry["name"] is not None:
+            i = bisect_left(self.names, (entry["name"], key))
+            if i < len(self.names) and self.names[i] == (entry["name"], key):
+                del self.names[i]
+        entry["name"] = None if name is None else str(name)
+        if entry["name"] is not None:
+            insort(self.names, (entry["name"], key))
+
+    def describe(self, deviceId, specs: dict):
+        """Record the names of a device's points, from their discovery specs."""
+        for obj, spec in specs.items():
+            entry = self.entry(deviceId, obj)
+            if spec.get("name") is not None and str(spec.get("name")) != entry["name"]:
+                self.rename(entry, spec.get("name"))
+
+    def update(self, deviceId, specs: dict, timestamp: float = None):
+        """
+        Record a poll of the device. Points that failed to update keep their last value,
+        and their staleness keeps growing.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        for obj, spec in specs.items():
+            if "last synced" not in spec:
+                continue
+            entry = self.entry(deviceId, obj)
+            entry["value"] = spec.get("value")
+            entry["status"] = spec.get("status", entry["status"])
+            entry["reliability"] = spec.get("reliability", entry["reliability"])
+            entry["last synced"] = spec.get("last synced")
+            entry["timestamp"] = timestamp
+
+    def remove(self, deviceId):
+        for key in self.byDevice.pop(str(deviceId), set()):
+            entry = self.entries.pop(key)
+            self.rename(entry, None)
+            self.byType.get(key[1].split(",")[0], set()).discard(key)
+
+    def prefixed(self, prefix: str) -> set:
+        keys = set()
+        i = bisect_left(self.names, (prefix,))
+        while i < len(self.names) and self.names[i][0].startswith(prefix):
+            keys.add(self.names[i][1])
+            i += 1
+        return keys
+
+    def query(self, devices=None, types=None, prefixes=None, now: float = None) -> list:
+        """
+        The points matching any of the given devices, and any of the given object types,
+        and any of the given name prefixes; a criterion left out matches everything. Each
+        point carries its staleness, the seconds since it was last read.
+        """
+        now = time.time() if now is None else now
+        selections = []
+        if devices:
+            selections.append(set().union(*(self.byDevice.get(d, set()) for d in devices)))
+        if types:
+            selections.append(set().union(*(self.byType.get(t, set()) for t in types)))
+        if prefixes:
+            selections.append(set().union(*(self.prefixed(p) for p in prefixes)))
+        if len(selections) == 0:
+            keys = self.entries.keys()
+        else:
+            keys = set.intersection(*sorted(selections, key=len))
+        points = []
+        for key in sorted(keys):
+            entry = dict(self.entries[key])
+            entry["staleness"] = (
+                None if entry["timestamp"] is None else round(now - entry["timestamp"], 3)
+            )
+            points.append(entry)
+        return points
@@ -1,10 +1,26 @@
+import time
+import asyncio
 import logging
 import datetime as dt
+from collections import Counter
 from .Device import LocalBacnetDevice, BacnetDevice
 from bacpypes3.pdu import Address
 from bacpypes3.primitivedata import ObjectIdentifier
 from bacpypes3.apdu import AbortPDU, AbortReason
 from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
+from .Partitioning import LeaseManager
+from .Networks import NetworkService, activity, network_of
+from .Offload import Offloader
+from .Metrics import registry, Histogram
+
+discovery_seconds = registry.histogram(
+    "bacnet_device_discovery_cycle_seconds",
+    "Device discovery and commit cycle duration",
+    buckets=Histogram.cycle,
+)
+devices_discovered = registry.gauge(
+    "bacnet_devices_discovered", "Devices read in the last device discovery cycle"
+)
 
 
 class DeviceManager(Subscriber):
@@ -13,6 +29,11 @@ class DeviceManager(Subscriber):
     broadcast messages gathering a list of bacnet devices currently live
     on the network along with all the properties they support and a list
     of bacnet objects the device is a parent to.
+
+    In passive mode there is no full-range broadcast: a registry of live devices is kept
+    from the I-Am traffic the gateway hears, known devices that went quiet are confirmed
+    with a unicast who-is, and new devices are found by sweeping one window of the
+    instance range per cycle.
     """
 
     __ISO8601 = "%Y-%m-%dT%H:%M:%S%z"
@@ -26,14 +47,27 @@ class DeviceManager(Subscriber):
         self.mongo = None
         self.localMgr: LocalManager = None
         self.scheduler: ServiceScheduler = ServiceScheduler()
+        self.leases: LeaseManager = LeaseManager()
+        self.leaseGeneration = 0
+        self.leasedBuckets: set = set()
+        self.networks: NetworkService = NetworkService()
+        self.offload: Offloader = Offloader()
         self.lowLimit = 0
         self.highLimit = 4194303
         self.address = Address("*")
+        self.registry: dict = {}
+        self.pending: set = set()
+        self.sweepCursor = 0
+        self.lastCycle = 0
+        self.seedGeneration = None
         self.settings = {
             "section": "device-discovery",
             "enable": None,
             "interval": None,
             "timeout": None,
+            "mode": "broadcast",
+            "window": 4096,
+            "confirmations": 32,
         }
         self.subscribed = False
         self.logger = logging.getLogger("ClientLog")
@@ -55,6 +89,7 @@ class DeviceManager(Subscriber):
     async def run(self, bacapp):
         if self.app is None:
             self.app = bacapp.app
+            self.app.register("IAmRequest", self.i_am)
         if self.mongo is None:
             self.mongo = bacapp.clients.get("mongodb")
 
@@ -74,72 +109,267 @@ class DeviceManager(Subscriber):
             self.settings["timeout"] = self.localMgr.read_setting(
                 self.settings.get("section"), "timeout"
             )
+            for option in ("mode", "window", "confirmations"):
+                self.settings[option] = self.localMgr.read_setting(
+                    self.settings.get("section"), option, fallback=self.settings.get(option)
+                )
 
-            if (
+            scheduled = (
                 self.scheduler.check_ticket(
                     self.settings.get("section"), interval=self.settings.get("interval")
                 )
-                or self.__isBootup
-            ):
-                await self.discover()
-                await self.commit()
+                or self.__isBootup  # noqa: W503
+            )
+            if scheduled or self.leaseGeneration != self.leases.generation:
+                self.leaseGeneration = self.leases.generation
+                # after a rebalance only the buckets gained since the last cycle are looked
+                # for, the devices of the others are already known
+                gained = None if scheduled else self.leases.owned - self.leasedBuckets
+                self.leasedBuckets = self.leases.owned
+                if gained is None or len(gained) > 0:
+                    start = time.perf_counter()
+                    await self.discover(gained)
+                    devices_discovered.set(len(self.devices))
+                    await self.commit()
+                    discovery_seconds.observe(time.perf_counter() - start)
                 self.__isBootup = False
 
-    async def discover(self):
+    async def warm_start(self, bacapp):
+        """
+        Seed the device registry from the Devices collection, so the devices known before the
+        restart are live right away while discovery reconciles in the background. They count
+        as just heard from: in passive mode the ones that stay quiet are confirmed on the
+        following cycle, not all at once on the first.
+        """
+        if self.mongo is None:
+            self.mongo = bacapp.clients.get("mongodb")
+        self.seedGeneration = self.leases.generation
+        self.lastCycle = time.time()
+        await self.seed_registry(lastSeen=time.time())
+        devices_discovered.set(len(self.registry))
+        self.logger.info(
+            f"warm start: device registry seeded with {len(self.registry)} device(s)..."
+        )
+
+    async def discover(self, buckets=None):
         """Sends a who-is broadcast to the subnet and stores a list of responses. It parses
         through the responses and creates a set of bacnet device definition objects with the
-        corresponding response information.
+        corresponding response information. With partitioning on, the who-is is ranged to the
+        instances of this gateway's buckets (or of the given ones only).
         """
         self.logger.info("device discovery started...")
+        activity.set("discovery")
 
-        iams = await self.app.who_is(
-            self.lowLimit, self.highLimit, self.address, self.settings.get("timeout")
-        )
-        self.logger.info(f"{len(iams)} BACnet IP devices found...")
-        iamDict = {iam.iAmDeviceIdentifier: iam.pduSource for iam in iams}
-        for id in iamDict:
-            deviceName = await self.app.read_property(iamDict[id], id, "objectName")
-            propList = await self.app.read_property(iamDict[id], id, "propertyList")
-            propDict = {"device-name": deviceName}
-            for prop in propList:
+        if self.settings.get("mode") == "passive":
+            iamDict = await self.passive_discovery(buckets)
+        else:
+            timeout = self.settings.get("timeout")
+            addresses = await self.broadcast_addresses()
+            results = await asyncio.gather(
+                *(
+                    self.app.who_is(low, high, address, timeout)
+                    for low, high in self.leases.ranges(buckets)
+                    for address in addresses
+                )
+            )
+            iams = {iam.iAmDeviceIdentifier: iam for result in results for iam in result}
+            iams = list(iams.values())
+            self.logger.info(f"{len(iams)} BACnet IP devices found...")
+            if self.leases.enabled is True:
+                # a device may still answer a who-is outside its range
+                iams = [iam for iam in iams if self.leases.owns(iam.iAmDeviceIdentifier)]
+                self.logger.info(
+                    f"{len(iams)} devices in the buckets leased by this gateway..."
+                )
+            iamDict = {iam.iAmDeviceIdentifier: iam.pduSource for iam in iams}
+        if self.networks.enabled is True:
+            # each network admits its own share of the reads, so a slow trunk is read
+            # alongside the fast ones instead of ahead of them
+            results = await asyncio.gather(
+                *(self.read_device(id, iamDict[id]) for id in iamDict), return_exceptions=True
+            )
+            self.networks.report(
+                "discovery", Counter(network_of(address) for address in iamDict.values())
+            )
+        else:
+            results = []
+            for id in iamDict:
                 try:
-                    property = await self.app.read_property(iamDict[id], id, str(prop))
-                    propDict[str(prop)] = property
-                except AbortPDU as e:
-                    self.logger.debug(f"{id} - {prop} - {e}")
-                    if e.apduAbortRejectReason == AbortReason.segmentationNotSupported:
-                        try:
-                            if str(prop) == "object-list":
-                                object_list = []
-                                list_length = await self.app.read_property(
-                                    iamDict[id], id, "object-list", array_index=0
-                                )
-                                for i in range(list_length):
-                                    object_id: ObjectIdentifier = (
-                                        await self.app.read_property(
-                                            iamDict[id],
-                                            id,
-                                            "object-list",
-                                            array_index=i + 1,
-                                        )
+                    results.append(await self.read_device(id, iamDict[id]))
+                except Exception as e:
+                    results.append(e)
+        for id, result in zip(iamDict, results):
+            if isinstance(result, BaseException):
+                self.logger.error(f"unable to read device {id}: {result}")
+            else:
+                # a device that failed stays pending, and is read again next cycle
+                self.pending.discard(id)
+        self.logger.info("device discovery completed...")
+
+    async def read_device(self, id, address):
+        deviceName = await self.app.read_property(address, id, "objectName")
+        propList = await self.app.read_property(address, id, "propertyList")
+        propDict = {"device-name": deviceName}
+        for prop in propList:
+            try:
+                property = await self.app.read_property(address, id, str(prop))
+                propDict[str(prop)] = property
+            except AbortPDU as e:
+                self.logger.debug(f"{id} - {prop} - {e}")
+                if e.apduAbortRejectReason == AbortReason.segmentationNotSupported:
+                    try:
+                        if str(prop) == "object-list":
+                            object_list = []
+                            list_length = await self.app.read_property(
+                                address, id, "object-list", array_index=0
+                            )
+                            for i in range(list_length):
+                                object_id: ObjectIdentifier = (
+                                    await self.app.read_property(
+                                        address,
+                                        id,
+                                        "object-list",
+                                        array_index=i + 1,
                                     )
-                                    object_list.append(object_id)
+                                )
+                                object_list.append(object_id)
+
+                            propDict["object-list"] = object_list
+                    except:
+                        self.logger.error("Error inside the AbortPDU exception handler...")
+            except:
+                self.logger.error("Device discovery error...!")
+
+        # normalizing a long object-list is the bulk of the work
+        device: BacnetDevice = await self.offload.call(
+            len(propDict.get("object-list", ())),
+            "objects",
+            BacnetDevice,
+            id,
+            str(address),
+            propDict,
+        )
+
+        endTime = dt.datetime.now(tz=self.localDevice.settings.get("tz")).strftime(
+            DeviceManager.__ISO8601
+        )
+
+        device.spec["last synced"] = endTime
+        self.devices.add(device)
 
-                                propDict["object-list"] = object_list
-                        except:
-                            self.logger.error("Error inside the AbortPDU exception handler...")
-                except:
-                    self.logger.error("Device discovery error...!")
+    async def broadcast_addresses(self) -> list:
+        """
+        The local broadcast, plus a directed broadcast to every network behind a router when
+        the network service is enabled.
+        """
+        if self.networks.enabled is not True:
+            return [self.address]
+        await self.networks.refresh_routers(self.app)
+        return self.networks.broadcast_addresses()
+
+    async def i_am(self, apdu):
+        """
+        Every I-Am the gateway hears, solicited or not, refreshes the registry. Devices heard
+        for the first time, or from a new address, are read on the next passive cycle.
+        """
+        id = apdu.iAmDeviceIdentifier
+        if self.leases.owns(id) is not True:
+            return
+        address = str(apdu.pduSource)
+        entry = self.registry.get(id)
+        if entry is None or entry["address"] != address:
+            self.pending.add(id)
+        self.registry[id] = {"address": address, "lastSeen": time.time()}
+
+    async def passive_discovery(self, buckets=None) -> dict:
+        """
+        Confirm the registered devices that have not been heard from since the last cycle
+        with a unicast who-is, at most confirmations of them at a time, forgetting the ones
+        that do not answer, then sweep the next window of the instance range, limited to the
+        ranges of the leased buckets. After a rebalance the whole range of the gained buckets
+        is swept instead. Returns the devices that need to be read; they stay pending until
+        discovery has read them.
+        """
+        if self.seedGeneration != self.leases.generation:
+            self.seedGeneration = self.leases.generation
+            await self.seed_registry()
+
+        timeout = self.settings.get("timeout")
+        quiet = [id for id, entry in self.registry.items() if entry["lastSeen"] < self.lastCycle]
+        self.lastCycle = time.time()
+        for id in quiet:
+            if self.leases.owns(id) is not True:
+                del self.registry[id]
+        quiet = [id for id in quiet if id in self.registry]
+        slots = asyncio.Semaphore(max(1, self.settings.get("confirmations")))
+
+        async def confirm(id) -> bool:
+            async with slots:
+                iams = await self.app.who_is(
+                    id[1], id[1], Address(self.registry[id]["address"]), timeout
+                )
+            return len(iams) > 0
 
-            device: BacnetDevice = BacnetDevice(id, str(iamDict[id]), propDict)
+        lost = 0
+        for id, answered in zip(quiet, await asyncio.gather(*(confirm(id) for id in quiet))):
+            # a device heard from while it was being confirmed is live after all
+            if answered is not True and self.registry[id]["lastSeen"] < self.lastCycle:
+                del self.registry[id]
+                self.pending.discard(id)
+                lost += 1
 
-            endTime = dt.datetime.now(tz=self.localDevice.settings.get("tz")).strftime(
-                DeviceManager.__ISO8601
+        if buckets is None:
+            low = self.sweepCursor
+            high = min(low + self.settings.get("window") - 1, self.highLimit)
+            ranges = [
+                (max(low, first), min(high, last))
+                for first, last in self.leases.ranges()
+                if first <= high and last >= low
+            ]
+            self.sweepCursor = 0 if high >= self.highLimit else high + 1
+        else:
+            ranges = self.leases.ranges(buckets)
+            low, high = ranges[0][0], ranges[-1][1]
+        addresses = await self.broadcast_addresses()
+        await asyncio.gather(
+            *(
+                self.app.who_is(first, last, address, timeout)
+                for first, last in ranges
+                for address in addresses
             )
+        )
 
-            device.spec["last synced"] = endTime
-            self.devices.add(device)
-        self.logger.info("device discovery completed...")
+        self.logger.info(
+            f"{len(self.registry)} devices registered, {len(quiet) - lost} confirmed, "
+            f"{lost} lost, instances {low}-{high} swept..."
+        )
+        iamDict = {
+            id: Address(self.registry[id]["address"])
+            for id in self.pending
+            if id in self.registry
+        }
+        self.pending.intersection_update(iamDict)
+        return iamDict
+
+    async def seed_registry(self, lastSeen: float = 0):
+        """
+        Start the registry from the devices already on the database, they get confirmed by
+        unicast instead of waiting for the sweep to come around to them.
+        """
+        try:
+            dbPayload = await self.mongo.findDocuments(
+                self.mongo.getDb(),
+                "Devices",
+                query={},
+                projection={"id": 1, "address": 1, "_id": 0},
+            )
+        except Exception as e:
+            self.logger.error(f"unable to seed the device registry: {e}")
+            return
+        for device in dbPayload:
+            id = ObjectIdentifier(device["id"])
+            if self.leases.owns(id) is True and id not in self.registry:
+                self.registry[id] = {"address": device["address"], "lastSeen": lastSeen}
 
     async def commit(self):
         """Check to see if the database collection is empty or has less devices than the in-memory device list.
@@ -150,9 +380,25 @@ class DeviceManager(Subscriber):
               3.1 find the highest device id number in the database
               3.2 replace all devices with a device id smaller than the id found in step 3.1
               3.3 write all devices with a device id larger than the id found in step 3.1
+        With partitioning on, or in passive mode, every device is upserted instead.
         """
         self.logger.info("device commit to database has started...")
         devices = sorted(list(self.devices))
+        if self.leases.enabled is True or self.settings.get("mode") == "passive":
+            # Document counts say nothing about the devices in memory when other gateways
+            # share the collection, or when a passive cycle only read the devices newly heard
+            # or moved; every device is upserted on its own.
+            async with self.mongo.writer() as writer:
+                for device in devices:
+                    await writer.submit(
+                        self.mongo.replaceDocument(
+                            device.spec, self.mongo.getDb(), "Devices", upsert=True
+                        ),
+                        key=device.deviceId,
+                    )
+            self.devices.clear()
+            self.logger.info("device commit to database completed...")
+            return
         try:
             docCount = await self.mongo.getDocumentCount(self.mongo.getDb(), "Devices")
         except:
@@ -167,10 +413,12 @@ class DeviceManager(Subscriber):
                     [device.spec for device in devices], self.mongo.getDb(), "Devices"
                 )
             elif docCount == len(devices):
-                for device in devices:
-                    await self.mongo.replaceDocument(
-                        device.spec, self.mongo.getDb(), "Devices"
-                    )
+                async with self.mongo.writer() as writer:
+                    for device in devices:
+                        await writer.submit(
+                            self.mongo.replaceDocument(device.spec, self.mongo.getDb(), "Devices"),
+                            key=device.deviceId,
+                        )
 
             elif docCount < len(devices):
                 dbPayload = await self.mongo.findDocuments(
@@ -195,8 +443,12 @@ class DeviceManager(Subscriber):
                         sorted(list(self.devices)),
                     )
                 )
+                writer = self.mongo.writer()
                 for nd in newDevices:
-                    await self.mongo.writeDocument(nd.spec, self.mongo.getDb(), "Devices")
+                    await writer.submit(
+                        self.mongo.writeDocument(nd.spec, self.mongo.getDb(), "Devices"),
+                        key=nd.deviceId,
+                    )
 
                 foundDevices = list(
                     filter(
@@ -206,7 +458,11 @@ class DeviceManager(Subscriber):
                     )
                 )
                 for fd in foundDevices:
-                    await self.mongo.replaceDocument(fd.spec, self.mongo.getDb(), "Devices")
+                    await writer.submit(
+                        self.mongo.replaceDocument(fd.spec, self.mongo.getDb(), "Devices"),
+                        key=fd.deviceId,
+                    )
+                await writer.drain()
 
             elif docCount > len(devices):
                 dbPayload = await self.mongo.findDocuments(
@@ -226,8 +482,12 @@ class DeviceManager(Subscriber):
                         sorted(list(self.devices)),
                     )
                 )
-                for fd in foundDevices:
-                    await self.mongo.replaceDocument(fd.spec, self.mongo.getDb(), "Devices")
+                async with self.mongo.writer() as writer:
+                    for fd in foundDevices:
+                        await writer.submit(
+                            self.mongo.replaceDocument(fd.spec, self.mongo.getDb(), "Devices"),
+                            key=fd.deviceId,
+                        )
             else:
                 self.logger.error(
                     "could not commit devices to the database...!", stack_info=True
@@ -0,0 +1,241 @@
+import io
+import os
+import json
+import math
+import time
+import pstats
+import asyncio
+import logging
+import cProfile
+import tracemalloc
+from collections import deque
+from .MongoClient import Mongodb
+from .SelfManagement import LocalManager, Subscriber
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+
+class DiagnosticsService(Subscriber):
+    """
+    Runtime diagnostics for gateways in the field, switched on and off from the diagnostics
+    section without a redeploy. Every interval it can capture a profile of the whole process
+    for profile seconds (cProfile, or yappi when installed and selected, which also samples
+    the worker threads), and a tracemalloc snapshot of the top allocations and of what grew
+    since the last one. With spans on, the application loop times every service cycle.
+    Reports go to the Diagnostics folder of the resource path, or to the Diagnostics
+    collection. Nothing is profiled, traced or timed while a mode is off.
+    """
+
+    __instance = None
+    __maxspans = 10000
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.mongo: Mongodb = Mongodb()
+        self.spans = deque(maxlen=DiagnosticsService.__maxspans)
+        self.lastCapture = -math.inf  # the first capture is not held back by an interval
+        self.snapshot = None
+        self.flushing = None
+        self.settings = {
+            "section": "diagnostics",
+            "enable": False,
+            "output": "file",
+            "interval": 3600,
+            "profile": 0,
+            "profiler": "cprofile",
+            "tracemalloc": 0,
+            "top": 25,
+            "spans": False,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if DiagnosticsService.__instance is None:
+            DiagnosticsService.__instance = object.__new__(cls)
+        return DiagnosticsService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            if option in ("enable", "tracemalloc"):
+                self.trace_allocations()
+            if option in ("enable", "spans") and self.tracing is not True:
+                # the application loop stops calling run() once diagnostics are off
+                self.flush_later()
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    @property
+    def tracing(self) -> bool:
+        return self.settings.get("enable") is True and self.settings.get("spans") is True
+
+    async def run(self, bacapp):
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            self.subscribed = True
+
+        section = self.settings.get("section")
+        for option in (
+            "enable",
+            "output",
+            "interval",
+            "profile",
+            "profiler",
+            "tracemalloc",
+            "top",
+            "spans",
+        ):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+        self.trace_allocations()
+
+        await self.flush_spans()
+        if time.monotonic() - self.lastCapture < self.settings.get("interval"):
+            return
+        if self.settings.get("profile") == 0 and tracemalloc.is_tracing() is not True:
+            return
+        self.lastCapture = time.monotonic()
+        if tracemalloc.is_tracing() is True:
+            await self.report("tracemalloc", self.allocations())
+        if self.settings.get("profile") > 0:
+            await self.report("profile", await self.profile(self.settings.get("profile")))
+
+    async def span(self, service: str, coroutine):
+        """Run a service cycle, recording when it started, how long it took and how it ended."""
+        start = time.time()
+        clock = time.perf_counter()
+        error = None
+        try:
+            return await coroutine
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            self.spans.append(
+                {
+                    "service": service,
+                    "start": start,
+                    "seconds": round(time.perf_counter() - clock, 6),
+                    "error": error,
+                }
+            )
+
+    def flush_later(self):
+        """Flush the buffered spans from a synchronous caller, on the running loop if any."""
+        if len(self.spans) == 0:
+            return
+        try:
+            self.flushing = asyncio.get_running_loop().create_task(self.flush_spans())
+        except RuntimeError:
+            pass  # no loop, the spans are flushed on the next run
+
+    async def flush_spans(self):
+        if len(self.spans) == 0:
+            return
+        spans = list(self.spans)
+        self.spans.clear()
+        if self.settings.get("output") == "mongodb":
+            for span in spans:
+                span["kind"] = "span"
+            await self.mongo.writeDocuments(spans, self.mongo.getDb(), "Diagnostics")
+        else:
+            with open(self.path(f"spans-{time.strftime('%Y%m%d')}.jsonl"), "a") as spanFile:
+                spanFile.writelines(json.dumps(span) + "\n" for span in spans)
+
+    async def profile(self, seconds: int) -> dict:
+        """
+        Profile everything the process does for the given seconds. The event loop keeps
+        running in the meantime, so the profile covers all the services.
+        """
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        if self.settings.get("profiler") == "yappi" and yappi is not None:
+            yappi.set_clock_type("wall")
+            yappi.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                yappi.stop()
+            stats = yappi.convert2pstats(yappi.get_func_stats())
+            yappi.clear_stats()
+        else:
+            if self.settings.get("profiler") == "yappi":
+                self.logger.warning("yappi is not installed, profiling with cProfile")
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profiler.disable()
+            stats = pstats.Stats(profiler)
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.sort_stats("cumulative").print_stats(self.settings.get("top"))
+        report = {"seconds": seconds, "stats": summary.getvalue()}
+        if self.settings.get("output") != "mongodb":
+            report["pstats"] = self.path(f"profile-{stamp}.prof")
+            stats.dump_stats(report["pstats"])
+        return report
+
+    def trace_allocations(self):
+        """Start or stop tracing allocations as the tracemalloc setting (frames) changes."""
+        frames = self.settings.get("tracemalloc") if self.settings.get("enable") is True else 0
+        if frames > 0 and tracemalloc.is_tracing() is not True:
+            tracemalloc.start(frames)
+            self.snapshot = None
+            self.logger.info(f"tracing allocations, {frames} frame(s) deep")
+        elif frames == 0 and tracemalloc.is_tracing() is True:
+            tracemalloc.stop()
+            self.snapshot = None
+            self.logger.info("stopped tracing allocations")
+
+    def allocations(self) -> dict:
+        """The top allocations by line (or by traceback), and the top growth since last time."""
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            )
+        )
+        key = "traceback" if self.settings.get("tracemalloc") > 1 else "lineno"
+        top = self.settings.get("top")
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "current": current,
+            "peak": peak,
+            "top": [self.describe(stat) for stat in snapshot.statistics(key)[:top]],
+            "growth": [],
+        }
+        if self.snapshot is not None:
+            report["growth"] = [
+                self.describe(stat) for stat in snapshot.compare_to(self.snapshot, key)[:top]
+            ]
+        self.snapshot = snapshot
+        return report
+
+    def describe(self, stat) -> str:
+        if len(stat.traceback) > 1:
+            return "\n".join([str(stat)] + stat.traceback.format(most_recent_first=True))
+        return str(stat)
+
+    async def report(self, kind: str, report: dict):
+        report["kind"] = kind
+        report["timestamp"] = time.time()
+        if self.settings.get("output") == "mongodb":
+            await self.mongo.writeDocument(report, self.mongo.getDb(), "Diagnostics")
+        else:
+            stamp = time.strftime("%Y%m%dT%H%M%S")
+            with open(self.path(f"{kind}-{stamp}.json"), "w") as reportFile:
+                json.dump(report, reportFile, indent=2)
+        self.logger.info(f"{kind} diagnostics captured")
+
+    def path(self, name: str) -> str:
+        folder = f"{self.localMgr.respath}Diagnostics"
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
@@ -0,0 +1,293 @@
+import logging
+import datetime as dt
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier, Date, Time
+from bacpypes3.constructeddata import ListOf
+from bacpypes3.apdu import (
+    AddListElementRequest,
+    AcknowledgeAlarmRequest,
+    GetAlarmSummaryRequest,
+    GetEventInformationRequest,
+    GetEventInformationACK,
+    GetAlarmSummaryACK,
+    ErrorRejectAbortNack,
+)
+from bacpypes3.basetypes import (
+    DateTime,
+    Destination,
+    EventTransitionBits,
+    PropertyIdentifier,
+    Recipient,
+    TimeStamp,
+)
+from .Device import LocalBacnetDevice
+from .Timestamps import to_timestamp
+from .Partitioning import LeaseManager
+from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
+
+
+class EventService(Subscriber):
+    """
+    Bacnet Event Notification Service: registers this gateway as a recipient in the
+    notification classes of the devices on the database, and records every event
+    notification they send into the Events collection as it arrives. Alarms that require an
+    acknowledgment are acknowledged when configured to. At bootup and then on every interval
+    the current alarm state of each device is pulled in bulk with GetEventInformation (or
+    GetAlarmSummary for devices that do not support it), so transitions missed while the
+    gateway was down are not lost.
+    """
+
+    __instance = None
+    __isBootup = True
+    __collection = "Events"
+    __every_day = [1, 1, 1, 1, 1, 1, 1]
+
+    def __init__(self) -> None:
+        self.app = None
+        self.localMgr: LocalManager = None
+        self.mongo = None
+        self.scheduler: ServiceScheduler = ServiceScheduler()
+        self.leases: LeaseManager = LeaseManager()
+        self.localDevice = LocalBacnetDevice()
+        self.registered: set = set()
+        self.settings: dict = {
+            "section": "event-notification",
+            "enable": None,
+            "interval": None,
+            "processid": 1,
+            "confirmed": True,
+            "acknowledge": False,
+            "register": True,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if EventService.__instance is None:
+            EventService.__instance = object.__new__(cls)
+        return EventService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    async def run(self, bacapp):
+        if self.app is None:
+            self.app = bacapp.app
+            self.app.register("ConfirmedEventNotificationRequest", self.notification)
+            self.app.register("UnconfirmedEventNotificationRequest", self.notification)
+        if self.mongo is None:
+            self.mongo = bacapp.clients.get("mongodb")
+
+        if bacapp.localMgr.initialized is True:
+            if self.localMgr is None:
+                self.localMgr = bacapp.localMgr
+            if self.subscribed is False:
+                bacapp.localMgr.subscribe(self.__instance)
+                self.subscribed = True
+
+            section = self.settings.get("section")
+            self.settings["enable"] = self.localMgr.read_setting(section, "enable")
+            self.settings["interval"] = self.localMgr.read_setting(section, "interval")
+            for option in ("processid", "confirmed", "acknowledge", "register"):
+                self.settings[option] = self.localMgr.read_setting(
+                    section, option, fallback=self.settings.get(option)
+                )
+
+            if (
+                self.scheduler.check_ticket(section, interval=self.settings.get("interval"))
+                or self.__isBootup
+            ):
+                self.__isBootup = False
+                await self.resync()
+
+    async def notification(self, apdu):
+        """
+        Record a Confirmed/UnconfirmedEventNotification, then acknowledge it if it asks for it.
+        """
+        tz = self.localDevice.settings.get("tz")
+        event = {
+            "timestamp": dt.datetime.now(tz=dt.timezone.utc),
+            "source": "notification",
+            "device": str(apdu.initiatingDeviceIdentifier),
+            "object": str(apdu.eventObjectIdentifier),
+            "eventTimestamp": to_timestamp(apdu.timeStamp, tz),
+            "processId": apdu.processIdentifier,
+            "notificationClass": apdu.notificationClass,
+            "priority": apdu.priority,
+            "eventType": str(apdu.eventType),
+            "messageText": None if apdu.messageText is None else str(apdu.messageText),
+            "notifyType": str(apdu.notifyType),
+            "ackRequired": bool(apdu.ackRequired),
+            "fromState": None if apdu.fromState is None else str(apdu.fromState),
+            "toState": str(apdu.toState),
+        }
+        await self.mongo.writeDocument(event, self.mongo.getDb(), EventService.__collection)
+
+        if apdu.ackRequired and self.settings.get("acknowledge") is True:
+            await self.acknowledge(
+                apdu.pduSource, apdu.eventObjectIdentifier, apdu.toState, apdu.timeStamp
+            )
+
+    async def acknowledge(self, address, obj, state, timeStamp):
+        now = dt.datetime.now(tz=self.localDevice.settings.get("tz"))
+        request = AcknowledgeAlarmRequest(
+            acknowledgingProcessIdentifier=self.settings.get("processid"),
+            eventObjectIdentifier=obj,
+            eventStateAcknowledged=state,
+            timeStamp=timeStamp,
+            acknowledgmentSource=f"bacnet-client {self.localDevice.settings.get('objectName')}",
+            timeOfAcknowledgment=TimeStamp(
+                dateTime=DateTime(
+                    date=Date(now.strftime("%Y-%m-%d")), time=Time(now.strftime("%H:%M:%S"))
+                )
+            ),
+            destination=address,
+        )
+        try:
+            await self.app.request(request)
+        except ErrorRejectAbortNack as e:
+            self.logger.warning(f"acknowledging {obj} {state} failed: {e}")
+
+    async def resync(self):
+        """
+        Register with each device's notification classes once, then record the current
+        alarm state of every device in bulk.
+        """
+        self.logger.info("event resync started...")
+        try:
+            dbPayload = await self.mongo.findDocuments(
+                self.mongo.getDb(),
+                "Devices",
+                query={},
+                projection={"id": 1, "address": 1, "properties": 1, "_id": 0},
+            )
+        except Exception as e:
+            self.logger.error(f"event resync: unable to list devices: {e}")
+            return
+
+        events = []
+        for device in dbPayload:
+            if self.leases.owns(device["id"]) is not True:
+                continue
+            address = Address(device["address"])
+            try:
+                if self.settings.get("register") is True and device["id"] not in self.registered:
+                    objList = device["properties"]["object-list"]["value"]
+                    await self.register(address, objList)
+                    self.registered.add(device["id"])
+                events.extend(await self.event_information(device["id"], address))
+            except Exception as e:
+                self.logger.error(f"event resync: {device['id']} {e}")
+
+        if len(events) > 0:
+            await self.mongo.writeDocuments(
+                events, self.mongo.getDb(), EventService.__collection
+            )
+        self.logger.info(f"event resync completed, {len(events)} active events...")
+
+    async def register(self, address, objList: list):
+        """
+        Add this gateway to the recipient list of every notification class on the device,
+        unless it is already listed.
+        """
+        localId = ObjectIdentifier(("device", self.localDevice.settings.get("objectIdentifier")))
+        for obj in objList:
+            if not str(obj).startswith("notification-class"):
+                continue
+            recipients = await self.app.read_property(
+                address, ObjectIdentifier(obj), "recipientList"
+            )
+            if any(d.recipient.device == localId for d in recipients or []):
+                continue
+            destination = Destination(
+                validDays=EventService.__every_day,
+                fromTime=Time("00:00:00"),
+                toTime=Time("23:59:59.99"),
+                recipient=Recipient(device=localId),
+                processIdentifier=self.settings.get("processid"),
+                issueConfirmedNotifications=self.settings.get("confirmed"),
+                transitions=EventTransitionBits([1, 1, 1]),
+            )
+            request = AddListElementRequest(
+                objectIdentifier=ObjectIdentifier(obj),
+                propertyIdentifier=PropertyIdentifier.recipientList,
+                listOfElements=ListOf(Destination)([destination]),
+                destination=address,
+            )
+            try:
+                await self.app.request(request)
+                self.logger.info(f"registered as a recipient of {obj}")
+            except ErrorRejectAbortNack as e:
+                self.logger.warning(f"unable to register with {obj}: {e}")
+
+    async def event_information(self, deviceId: str, address) -> list:
+        """
+        The active events of a device, paging through GetEventInformation. Devices that
+        reject it are asked for their GetAlarmSummary instead. When a later page fails, the
+        events of the pages already read are kept.
+        """
+        tz = self.localDevice.settings.get("tz")
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        events = []
+        last = None
+        while True:
+            request = GetEventInformationRequest(destination=address)
+            if last is not None:
+                request.lastReceivedObjectIdentifier = last
+            try:
+                response = await self.app.request(request)
+            except ErrorRejectAbortNack:
+                response = None
+            if not isinstance(response, GetEventInformationACK):
+                if last is None:
+                    return await self.alarm_summary(deviceId, address)
+                self.logger.warning(
+                    f"{deviceId} event information after {last} failed, "
+                    f"keeping the {len(events)} events read"
+                )
+                return events
+            for summary in response.listOfEventSummaries or []:
+                events.append(
+                    {
+                        "timestamp": now,
+                        "source": "event-information",
+                        "device": deviceId,
+                        "object": str(summary.objectIdentifier),
+                        "eventState": str(summary.eventState),
+                        "acknowledgedTransitions": list(summary.acknowledgedTransitions),
+                        "eventTimestamps": [
+                            to_timestamp(ts, tz)
+                            for ts in summary.eventTimeStamps or []
+                        ],
+                        "notifyType": str(summary.notifyType),
+                    }
+                )
+                last = summary.objectIdentifier
+            if not response.moreEvents or last is None:
+                return events
+
+    async def alarm_summary(self, deviceId: str, address) -> list:
+        try:
+            response = await self.app.request(GetAlarmSummaryRequest(destination=address))
+        except ErrorRejectAbortNack:
+            response = None
+        if not isinstance(response, GetAlarmSummaryACK):
+            self.logger.debug(f"{deviceId} supports no alarm summary service")
+            return []
+        now = dt.datetime.now(tz=dt.timezone.utc)
+        return [
+            {
+                "timestamp": now,
+                "source": "alarm-summary",
+                "device": deviceId,
+                "object": str(summary.objectIdentifier),
+                "eventState": str(summary.alarmState),
+                "acknowledgedTransitions": list(summary.acknowledgedTransitions),
+            }
+            for summary in response.listOfAlarmSummaries or []
+        ]
@@ -0,0 +1,151 @@
+import logging
+import pymongo
+from .MongoClient import Mongodb
+from .PointStore import PointStore
+from .SelfManagement import LocalManager, Subscriber
+
+# (collection, keys, options) of every index the client's lookups rely on
+indexes = (
+    ("Devices", [("id", 1)], {}),
+    ("Points", [("id", 1)], {}),
+    ("Configuration", [("device.nukid", 1)], {}),
+    ("Events", [("device", 1), ("timestamp", -1)], {}),
+    ("Leases", [("bucket", 1)], {}),
+    ("Gateways", [("nukid", 1)], {}),
+    ("Gateways", [("expires", 1)], {}),
+)
+# time-series collections are created before they are indexed, or indexing would create
+# them as regular collections
+timeseries = (
+    ("Trends", [("meta.device", 1), ("meta.log", 1), ("timestamp", 1)]),
+    ("History", [("meta.device", 1), ("meta.point", 1), ("timestamp", 1)]),
+    ("Rollups", [("meta.device", 1), ("meta.window", 1), ("timestamp", 1)]),
+)
+# the filters the services run most, as (collection, filter) pairs
+hot_queries = (
+    ("Devices", {"id": ""}),
+    ("Points", {"id": ""}),
+    ("Configuration", {"device.nukid": ""}),
+    ("Leases", {"bucket": 0, "owner": ""}),
+    ("Gateways", {"nukid": ""}),
+)
+
+
+def stages(plan) -> set:
+    """Every stage of a query plan, however deeply nested."""
+    found = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            found.add(plan["stage"])
+        for value in plan.values():
+            found |= stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            found |= stages(value)
+    return found
+
+
+class IndexManager(Subscriber):
+    """
+    Creates the indexes every lookup of the client relies on when the application starts:
+    the id of devices and point lists, the nukid of the remote configuration, leases and
+    gateways, and the device and time of events, trends and history. Logs expire logttl
+    days after they were written through a TTL index. Index creation is idempotent, so the
+    bootstrap runs on every start. Once it is done, the hot queries are explained and the
+    ones the server would still answer with a collection scan are logged as warnings.
+    """
+
+    __instance = None
+    __ini_section = "indexes"
+    __conflicts = (85, 86)  # IndexOptionsConflict, IndexKeySpecsConflict
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.mongo: Mongodb = Mongodb()
+        self.store: PointStore = PointStore()
+        self.settings = {
+            "section": IndexManager.__ini_section,
+            "enable": self.localMgr.read_setting(
+                IndexManager.__ini_section, "enable", fallback=True
+            ),
+            "logttl": self.localMgr.read_setting(
+                IndexManager.__ini_section, "logttl", fallback=30
+            ),
+            "explain": self.localMgr.read_setting(
+                IndexManager.__ini_section, "explain", fallback=True
+            ),
+        }
+        self.logger = logging.getLogger("ClientLog")
+
+        if self.localMgr.initialized is True:
+            self.localMgr.subscribe(self.__instance)
+
+    def __new__(cls):
+        if IndexManager.__instance is None:
+            IndexManager.__instance = object.__new__(cls)
+        return IndexManager.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(f"{section}: {oldvalue} > {self.settings.get(option)}")
+
+    async def run(self, bacapp):
+        if self.settings.get("enable") is not True:
+            return
+        try:
+            await self.bootstrap()
+            if self.settings.get("explain") is True:
+                await self.check_plans()
+        except Exception as e:
+            self.logger.error(f"index bootstrap failed: {e}")
+
+    async def bootstrap(self):
+        db = self.mongo.getDb()
+        for collectionName, keys, options in indexes:
+            await self.mongo.createIndex(db, collectionName, keys, **options)
+        for collectionName, keys in timeseries:
+            await self.mongo.createTimeSeries(db, collectionName, "timestamp", "meta")
+            await self.mongo.createIndex(db, collectionName, keys)
+        await self.store.ensure_indexes()
+        await self.expire_logs(db)
+        self.logger.info("database indexes are in place")
+
+    async def expire_logs(self, db):
+        """
+        Create the Logs TTL index, or change its expiry when logttl changed since it was made.
+        """
+        ttl = int(self.settings.get("logttl") * 86400)
+        if ttl <= 0:
+            return
+        try:
+            await db["Logs"].create_index(
+                [("createdAt", 1)], name="createdAt_ttl", expireAfterSeconds=ttl
+            )
+        except pymongo.errors.OperationFailure as e:
+            if e.code not in IndexManager.__conflicts:
+                raise
+            await db.command(
+                "collMod",
+                "Logs",
+                index={"name": "createdAt_ttl", "expireAfterSeconds": ttl},
+            )
+
+    async def check_plans(self) -> list:
+        """Explain the hot queries, warning about the ones answered with a collection scan."""
+        db = self.mongo.getDb()
+        queries = list(hot_queries)
+        if self.store.schema == "point":
+            queries.append((self.store.collection, {"id": "", "point": ""}))
+        elif self.store.schema == "bucket":
+            queries.append((self.store.collection, {"id": "", "bucket": 0}))
+        scans = []
+        for collectionName, query in queries:
+            plan = await db[collectionName].find(query).explain()
+            if "COLLSCAN" in stages(plan.get("queryPlanner", {}).get("winningPlan", {})):
+                scans.append(collectionName)
+                self.logger.warning(
+                    f"query {query} on {collectionName} is answered with a collection scan"
+                )
+        return scans
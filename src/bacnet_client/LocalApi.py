@@ -0,0 +1,163 @@
+import json
+import asyncio
+import inspect
+import logging
+from urllib.parse import urlsplit, parse_qs
+from .SelfManagement import LocalManager, Subscriber
+
+
+class LocalApiService(Subscriber):
+    """
+    A small read-only HTTP API for local dashboards and integrations, served on a TCP port
+    of the loopback interface, or on a Unix socket when one is configured. Services publish
+    their data by registering a route: a handler that receives the query string parameters
+    as lists and returns a JSON-serializable payload (or a (content type, text) pair); a
+    coroutine handler is awaited, so a costly route can hand its work off the event loop.
+    Requests are answered from memory and never reach the database or the field bus. A
+    request must send its head within timeout seconds, in at most maxheaders header lines of
+    at most linelimit bytes each, so a slow or oversized client cannot hold a connection.
+    """
+
+    __instance = None
+    __reasons = {
+        200: "OK",
+        400: "Bad Request",
+        404: "Not Found",
+        405: "Method Not Allowed",
+        408: "Request Timeout",
+        431: "Request Header Fields Too Large",
+        500: "Internal Server Error",
+    }
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.server = None
+        self.routes: dict = {}
+        self.settings = {
+            "section": "local-api",
+            "enable": False,
+            "host": "127.0.0.1",
+            "port": 8047,
+            "socket": "",
+            "timeout": 5,
+            "maxheaders": 100,
+            "linelimit": 8192,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if LocalApiService.__instance is None:
+            LocalApiService.__instance = object.__new__(cls)
+        return LocalApiService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            if option in ("host", "port", "socket", "enable"):
+                self.close()
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    def register(self, path: str, handler):
+        self.routes[path] = handler
+
+    async def run(self, bacapp):
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            self.subscribed = True
+
+        section = self.settings.get("section")
+        for option in ("enable", "host", "port", "socket", "timeout", "maxheaders", "linelimit"):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+        if self.server is None and self.settings.get("enable") is True:
+            await self.start()
+
+    async def start(self):
+        socket = self.settings.get("socket")
+        if socket:
+            self.server = await asyncio.start_unix_server(
+                self.handle, path=socket, limit=self.settings.get("linelimit")
+            )
+            self.logger.info(f"local api listening on {socket}")
+        else:
+            self.server = await asyncio.start_server(
+                self.handle,
+                self.settings.get("host"),
+                self.settings.get("port"),
+                limit=self.settings.get("linelimit"),
+            )
+            self.logger.info(
+                f"local api listening on {self.settings.get('host')}:{self.settings.get('port')}"
+            )
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                requestLine = await asyncio.wait_for(
+                    self.read_head(reader), self.settings.get("timeout")
+                )
+            except asyncio.TimeoutError:
+                status, contentType, body = 408, "text/plain", b"request timeout"
+            except ValueError:  # a line over the limit
+                status, contentType, body = 431, "text/plain", b"header line too long"
+            else:
+                if requestLine is None:
+                    status, contentType, body = 431, "text/plain", b"too many headers"
+                else:
+                    status, contentType, body = await self.respond(requestLine)
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {LocalApiService.__reasons.get(status, '')}\r\n"
+                    f"Content-Type: {contentType}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + body
+            )
+            await asyncio.wait_for(writer.drain(), self.settings.get("timeout"))
+        except Exception as e:
+            self.logger.debug(f"local api request failed: {e}")
+        finally:
+            writer.close()
+
+    async def read_head(self, reader: asyncio.StreamReader):
+        """The request line, split, after reading the headers; None when there are too many."""
+        requestLine = (await reader.readline()).decode("latin-1").split()
+        for _ in range(self.settings.get("maxheaders") + 1):
+            if (await reader.readline()) in (b"\r\n", b"\n", b""):
+                return requestLine
+        return None
+
+    async def respond(self, requestLine: list):
+        if len(requestLine) < 2:
+            return 400, "text/plain", b"bad request"
+        method, target = requestLine[0], requestLine[1]
+        if method != "GET":
+            return 405, "text/plain", b"only GET is supported"
+        url = urlsplit(target)
+        handler = self.routes.get(url.path.rstrip("/") or "/")
+        if handler is None:
+            return 404, "text/plain", b"not found"
+        try:
+            payload = handler(parse_qs(url.query))
+            if inspect.isawaitable(payload):
+                payload = await payload
+        except (KeyError, ValueError) as e:
+            return 400, "text/plain", str(e).encode()
+        except Exception as e:
+            self.logger.error(f"local api route {url.path} failed: {e}")
+            return 500, "text/plain", b"internal server error"
+        if isinstance(payload, tuple):
+            contentType, text = payload
+            return 200, contentType, text.encode()
+        return 200, "application/json", json.dumps(payload, default=str).encode()
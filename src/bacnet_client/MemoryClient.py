@@ -0,0 +1,303 @@
+import datetime as dt
+import bson
+import pymongo
+from bson import ObjectId
+
+
+class MemoryCursor:
+    """
+    Async iterator over the documents matched by MemoryCollection.find.
+    """
+
+    def __init__(self, documents: list, stage: str = "COLLSCAN") -> None:
+        self.documents = documents
+        self.stage = stage
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": self.stage}}}
+
+    def __aiter__(self):
+        self.index = 0
+        return self
+
+    async def __anext__(self):
+        if self.index >= len(self.documents):
+            raise StopAsyncIteration
+        document = self.documents[self.index]
+        self.index += 1
+        return document
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id) -> None:
+        self.inserted_id = inserted_id
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids: list) -> None:
+        self.inserted_ids = inserted_ids
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int) -> None:
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+
+
+class BulkWriteResult:
+    def __init__(self, matched_count: int, upserted_count: int, deleted_count: int) -> None:
+        self.matched_count = matched_count
+        self.upserted_count = upserted_count
+        self.deleted_count = deleted_count
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int) -> None:
+        self.deleted_count = deleted_count
+
+
+class MemoryCollection:
+    """
+    In-process stand-in for a Motor collection, limited to the calls the Mongodb client makes.
+    Documents are stored BSON encoded, so writes and reads pay the same serialization cost and
+    reject the same non-encodable values as a real server would. Filters support equality and
+    the basic comparison operators on (dotted) field paths, plus $or/$and; updates support
+    $set, $setOnInsert, $inc and $currentDate, which reads the clock of the database. Indexes
+    are recorded, and only show in explained plans.
+    """
+
+    def __init__(self, name: str, clock=None) -> None:
+        self.name = name
+        self.clock = clock or (lambda: dt.datetime.now(dt.timezone.utc))
+        self.documents = {}
+        self.indexes = {}
+        self.writes = 0
+
+    @classmethod
+    def get_path(cls, document: dict, path: str):
+        value = document
+        for key in path.split("."):
+            if not isinstance(value, dict) or key not in value:
+                return None
+            value = value[key]
+        return value
+
+    @classmethod
+    def set_path(cls, document: dict, path: str, value):
+        keys = path.split(".")
+        for key in keys[:-1]:
+            document = document.setdefault(key, {})
+        document[keys[-1]] = value
+
+    @classmethod
+    def project(cls, document: dict, projection=None):
+        if not projection:
+            return document
+        included = [k for k, v in projection.items() if v and k != "_id"]
+        if len(included) > 0:
+            output = {}
+            for k in included:
+                value = cls.get_path(document, k)
+                if value is not None or k in document:
+                    cls.set_path(output, k, value)
+            if projection.get("_id", 1) and "_id" in document:
+                output["_id"] = document["_id"]
+            return output
+        return {k: v for k, v in document.items() if projection.get(k, 1)}
+
+    @classmethod
+    def compare(cls, value, condition) -> bool:
+        if not isinstance(condition, dict) or not any(k.startswith("$") for k in condition):
+            return value == condition
+        for op, operand in condition.items():
+            if op == "$eq" and not value == operand:
+                return False
+            elif op == "$ne" and not value != operand:
+                return False
+            elif op == "$in" and value not in operand:
+                return False
+            elif op == "$nin" and value in operand:
+                return False
+            elif op in ("$lt", "$lte", "$gt", "$gte"):
+                if value is None:
+                    return False
+                if op == "$lt" and not value < operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+                if op == "$gt" and not value > operand:
+                    return False
+                if op == "$gte" and not value >= operand:
+                    return False
+            elif op == "$exists" and (value is not None) != bool(operand):
+                return False
+        return True
+
+    def matches(self, document: dict, query=None):
+        if not query:
+            return True
+        for k, v in query.items():
+            if k == "$or":
+                if not any(self.matches(document, q) for q in v):
+                    return False
+            elif k == "$and":
+                if not all(self.matches(document, q) for q in v):
+                    return False
+            elif not self.compare(self.get_path(document, k), v):
+                return False
+        return True
+
+    def apply(self, document: dict, update: dict, inserting=False):
+        for k, v in update.get("$set", {}).items():
+            self.set_path(document, k, v)
+        if inserting:
+            for k, v in update.get("$setOnInsert", {}).items():
+                self.set_path(document, k, v)
+        for k, v in update.get("$inc", {}).items():
+            self.set_path(document, k, (self.get_path(document, k) or 0) + v)
+        for k in update.get("$currentDate", {}):
+            self.set_path(document, k, self.clock())
+        return document
+
+    def seed(self, query=None):
+        """
+        Start an upserted document from the equality fields of the query, like the server.
+        """
+        document = {}
+        for k, v in (query or {}).items():
+            if not k.startswith("$") and not isinstance(v, dict):
+                self.set_path(document, k, v)
+        return document
+
+    def scan(self, query=None):
+        for _id, data in self.documents.items():
+            document = bson.decode(data)
+            if self.matches(document, query):
+                yield _id, document
+
+    def store(self, document: dict):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        self.documents[document["_id"]] = bson.encode(document)
+        self.writes += 1
+        return document["_id"]
+
+    async def count_documents(self, query=None):
+        if not query:
+            return len(self.documents)
+        return sum(1 for _ in self.scan(query))
+
+    async def insert_one(self, document: dict):
+        return InsertOneResult(self.store(document))
+
+    async def insert_many(self, documents: list, ordered=True):
+        return InsertManyResult([self.store(document) for document in documents])
+
+    async def find_one(self, query=None, projection=None):
+        for _id, document in self.scan(query):
+            return self.project(document, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        indexed = any(index["key"][0][0] in (query or {}) for index in self.indexes.values())
+        return MemoryCursor(
+            [self.project(document, projection) for _, document in self.scan(query)],
+            "IXSCAN" if indexed else "COLLSCAN",
+        )
+
+    async def find_one_and_replace(self, query, replacement: dict, upsert=False):
+        for _id, document in self.scan(query):
+            replacement = dict(replacement)
+            replacement["_id"] = _id
+            self.store(replacement)
+            return document
+        if upsert:
+            self.store(dict(replacement))
+        return None
+
+    async def find_one_and_update(
+        self, query, update: dict, upsert=False, return_document=pymongo.ReturnDocument.BEFORE
+    ):
+        for _id, document in self.scan(query):
+            updated = self.apply(bson.decode(self.documents[_id]), update)
+            self.store(updated)
+            return bson.decode(bson.encode(updated)) if return_document else document
+        if upsert:
+            inserted = self.apply(self.seed(query), update, inserting=True)
+            self.store(inserted)
+            if return_document:
+                return bson.decode(bson.encode(inserted))
+        return None
+
+    async def update_one(self, query, update: dict, upsert=False):
+        for _id, document in self.scan(query):
+            self.store(self.apply(document, update))
+            return UpdateResult(1, 1)
+        if upsert:
+            self.store(self.apply(self.seed(query), update, inserting=True))
+        return UpdateResult(0, 0)
+
+    async def delete_many(self, query=None):
+        matched = [_id for _id, _ in self.scan(query)]
+        for _id in matched:
+            del self.documents[_id]
+        self.writes += len(matched)
+        return DeleteResult(len(matched))
+
+    async def bulk_write(self, requests: list, ordered=True):
+        """
+        Apply pymongo UpdateOne, ReplaceOne and DeleteMany requests, one after the other.
+        """
+        matched = upserted = deleted = 0
+        for request in requests:
+            if isinstance(request, pymongo.DeleteMany):
+                deleted += (await self.delete_many(request._filter)).deleted_count
+                continue
+            found = await self.find_one(request._filter, {"_id": 1})
+            if isinstance(request, pymongo.ReplaceOne):
+                await self.find_one_and_replace(request._filter, request._doc, request._upsert)
+            else:
+                await self.update_one(request._filter, request._doc, request._upsert)
+            matched += found is not None
+            upserted += found is None and bool(request._upsert)
+        return BulkWriteResult(matched, upserted, deleted)
+
+    async def create_index(self, keys, **kwargs):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = kwargs.get("name", "_".join(f"{k}_{d}" for k, d in keys))
+        self.indexes[name] = {"key": keys, **kwargs}
+        return name
+
+
+class MemoryDatabase:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.collections = {}
+        self.clock = lambda: dt.datetime.now(dt.timezone.utc)
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name, lambda: self.clock())
+        return self.collections[name]
+
+    async def create_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    @property
+    def writes(self):
+        return sum(c.writes for c in self.collections.values())
+
+
+class MemoryClient:
+    """
+    Drop-in replacement for the AsyncIOMotorClient held by the Mongodb singleton, for
+    benchmarks and local testing without a database server.
+    """
+
+    def __init__(self) -> None:
+        self.databases = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self.databases:
+            self.databases[name] = MemoryDatabase(name)
+        return self.databases[name]
@@ -0,0 +1,128 @@
+from bisect import bisect_left
+
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values, rendered in the
+    Prometheus text exposition format.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: dict = {}
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if len(pairs) == 0:
+            return ""
+        escaped = (
+            (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def samples(self) -> list:
+        return [(self.name, self.labels(key), value) for key, value in self.values.items()]
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+    latency = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    cycle = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+    size = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=latency) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        if key not in self.values:
+            self.values[key] = [[0] * (len(self.buckets) + 1), 0, 0]
+        counts, _, _ = entry = self.values[key]
+        counts[bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> list:
+        samples = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                labels = self.labels(key, {"le": bound})
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            samples.append((f"{self.name}_sum", self.labels(key), total))
+            samples.append((f"{self.name}_count", self.labels(key), count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Every metric of the process. Metrics are declared once, at import time, by the modules
+    they instrument; declaring one again returns the existing metric. Per-request
+    instrumentation of the BACnet stack is only switched on when enabled.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: dict = {}
+        self.enabled = False
+
+    def declare(self, kind, name: str, documentation: str, labelnames=(), **kwargs):
+        if name not in self.metrics:
+            self.metrics[name] = kind(name, documentation, labelnames, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.declare(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.declare(Gauge, name, documentation, labelnames)
+
+    def histogram(
+        self, name: str, documentation: str, labelnames=(), buckets=Histogram.latency
+    ) -> Histogram:
+        return self.declare(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
@@ -1,9 +1,88 @@
 import sys
+import time
+import asyncio
 import logging
 import pymongo
 from pymongo.server_api import ServerApi
 from motor.motor_asyncio import AsyncIOMotorClient
 from .SelfManagement import LocalManager, Subscriber
+from .MemoryClient import MemoryClient
+from .Spool import WriteSpool
+from .Metrics import registry, Histogram
+
+write_seconds = registry.histogram(
+    "mongo_write_seconds", "MongoDB write latency", ("operation", "collection"), Histogram.latency
+)
+write_batch_size = registry.histogram(
+    "mongo_write_batch_size", "Documents per MongoDB write", ("collection",), Histogram.size
+)
+
+writes_in_flight = registry.gauge("mongo_writes_in_flight", "Writes running in write executors")
+
+
+class WriteExecutor:
+    """
+    Runs many writes over the driver's connection pool, at most concurrency of them in
+    flight, so their latencies overlap instead of adding up. Submitting waits while every
+    slot is taken, which holds producers back to the pace of the database. Writes given the
+    same key (usually the document id) run in the order they were submitted. A failed write
+    does not stop the others: failures are collected, and logged together once the executor
+    is drained.
+    """
+
+    def __init__(self, concurrency: int, logger: logging.Logger) -> None:
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.tails: dict = {}
+        self.tasks: set = set()
+        self.errors: list = []
+        self.count = 0
+        self.logger = logger
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_details):
+        await self.drain()
+
+    async def submit(self, write, key=None):
+        """Schedule the write coroutine, once a slot is free."""
+        try:
+            await self.slots.acquire()
+        except asyncio.CancelledError:
+            write.close()
+            raise
+        previous = self.tails.get(key) if key is not None else None
+        task = asyncio.ensure_future(self.run(write, key, previous))
+        if key is not None:
+            self.tails[key] = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, write, key, previous):
+        writes_in_flight.inc()
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            return await write
+        except Exception as e:
+            self.errors.append((key, e))
+        finally:
+            writes_in_flight.dec()
+            self.slots.release()
+            self.count += 1
+            if key is not None and self.tails.get(key) is asyncio.current_task():
+                self.tails.pop(key)
+
+    async def drain(self) -> list:
+        """Wait for every submitted write, returning the (key, error) of those that failed."""
+        while len(self.tasks) > 0:
+            await asyncio.wait(set(self.tasks))
+        if len(self.errors) > 0:
+            self.logger.error(
+                f"{len(self.errors)} of {self.count} writes failed: "
+                + "; ".join(f"{key}: {e}" for key, e in self.errors[:5])
+            )
+        return self.errors
 
 
 class Mongodb(Subscriber):
@@ -13,6 +92,14 @@ class Mongodb(Subscriber):
 
     __instance = None
     __ini_section = "mongodb"
+    __memory_uri = "memory://"
+    __watch_backoff = (1, 60)  # seconds (initial, max)
+    # InvalidResumeToken, ChangeStreamFatalError, ChangeStreamHistoryLost
+    __unresumable_codes = (260, 280, 286)
+    # covers server selection timeouts, network errors and lost primaries
+    __unreachable = (pymongo.errors.ConnectionFailure,)
+    # kept when the singleton is constructed again, or its documents would be lost
+    memory: MemoryClient = None
 
     def __init__(self) -> None:
         self.localMgr: LocalManager = LocalManager()
@@ -23,13 +110,43 @@ class Mongodb(Subscriber):
             ),
             "certpath": self.localMgr.read_setting(Mongodb.__ini_section, "certpath"),
             "dbname": self.localMgr.read_setting(Mongodb.__ini_section, "dbname"),
+            "spool": self.localMgr.read_setting(
+                Mongodb.__ini_section, "spool", fallback=True
+            ),
+            "spoolmaxmb": self.localMgr.read_setting(
+                Mongodb.__ini_section, "spoolmaxmb", fallback=256
+            ),
+            "spoolbatch": self.localMgr.read_setting(
+                Mongodb.__ini_section, "spoolbatch", fallback=500
+            ),
+            "spoolinterval": self.localMgr.read_setting(
+                Mongodb.__ini_section, "spoolinterval", fallback=10
+            ),
+            "writeconcurrency": self.localMgr.read_setting(
+                Mongodb.__ini_section, "writeconcurrency", fallback=8
+            ),
         }
-        self.client: AsyncIOMotorClient = AsyncIOMotorClient(
-            self.settings.get("connectionString"),
-            tls=True,
-            tlsCertificateKeyFile=self.settings.get("certpath"),
-            server_api=ServerApi("1"),
-        )
+        self.spool: WriteSpool = None
+        if self.settings.get("spool") is True:
+            self.spool = WriteSpool(
+                f"{self.localMgr.respath}spool.sqlite3",
+                self.settings.get("spoolmaxmb") * 1024 * 1024,
+                self.settings.get("spoolbatch"),
+            )
+            # writes left over from the last run are replayed by run_spool
+            self.spool.open()
+        if self.settings.get("connectionString") == Mongodb.__memory_uri:
+            # in-process stand-in for benchmarks and local testing without a server
+            if Mongodb.memory is None:
+                Mongodb.memory = MemoryClient()
+            self.client = Mongodb.memory
+        else:
+            self.client: AsyncIOMotorClient = AsyncIOMotorClient(
+                self.settings.get("connectionString"),
+                tls=True,
+                tlsCertificateKeyFile=self.settings.get("certpath"),
+                server_api=ServerApi("1"),
+            )
         self.logger = logging.getLogger("ClientLog")
 
         if self.localMgr.initialized is True:
@@ -46,6 +163,10 @@ class Mongodb(Subscriber):
             self.settings[option] = value
             self.logger.debug(f"{section}: {oldvalue} > {self.settings.get(option)}")
 
+    def writer(self) -> WriteExecutor:
+        """A write executor bounded by the writeconcurrency setting."""
+        return WriteExecutor(self.settings.get("writeconcurrency"), self.logger)
+
     async def pingServer(self):
         try:
             await self.client.admin.command("ping")
@@ -69,32 +190,72 @@ class Mongodb(Subscriber):
     def getCollection(self, colName: str):
         return self.client[colName]
 
+    async def createTimeSeries(
+        self, db, collectionName: str, timeField: str, metaField: str, granularity="minutes"
+    ):
+        try:
+            await db.create_collection(
+                collectionName,
+                timeseries={
+                    "timeField": timeField,
+                    "metaField": metaField,
+                    "granularity": granularity,
+                },
+            )
+            self.logger.info(f"created time-series collection {collectionName}")
+        except pymongo.errors.CollectionInvalid:
+            pass  # already exists
+        except Exception as e:
+            self.logger.error(f"unable to create time-series collection {collectionName}: {e}")
+
     async def getDocumentCount(self, db, collectionName: str):
         n = await db[collectionName].count_documents({})
         return n
 
     async def writeDocument(self, document: dict, db, collectionName: str):
+        if await self.spooled(db, collectionName, "insert", {"documents": [document]}):
+            return
         try:
+            start = time.perf_counter()
             await db[collectionName].insert_one(document)
+            self.observe_write("insert", collectionName, start)
+        except Mongodb.__unreachable as e:
+            await self.spooled(db, collectionName, "insert", {"documents": [document]}, e)
         except Exception as e:
             self.logger.error(f"{e}")
         except:
             self.logger.error("error...")
 
     async def writeDocuments(self, documents: list, db, collectionName: str):
+        if await self.spooled(db, collectionName, "insert", {"documents": documents}):
+            return
         result_set = None
         try:
+            start = time.perf_counter()
             result_set = await db[collectionName].insert_many(documents)
+            self.observe_write("insert", collectionName, start, len(documents))
             self.logger.debug(
                 f"Number of documentss added: {len(result_set.inserted_ids)}"
             )
+        except Mongodb.__unreachable as e:
+            await self.spooled(db, collectionName, "insert", {"documents": documents}, e)
         except Exception as e:
             self.logger.error(f"{e}")
         except:
             self.logger.error("error...")
 
-    async def replaceDocument(self, document: dict, db, collectionName: str):
-        await db[collectionName].find_one_and_replace({"id": document["id"]}, document)
+    async def replaceDocument(self, document: dict, db, collectionName: str, upsert=False):
+        args = {"document": document, "upsert": upsert}
+        if await self.spooled(db, collectionName, "replace", args):
+            return
+        try:
+            start = time.perf_counter()
+            await db[collectionName].find_one_and_replace(
+                {"id": document["id"]}, document, upsert=upsert
+            )
+            self.observe_write("replace", collectionName, start)
+        except Mongodb.__unreachable as e:
+            await self.spooled(db, collectionName, "replace", args, e)
 
     async def findDocument(self, db, collectionName: str, query=None):
         return await db[collectionName].find_one(query)
@@ -105,35 +266,210 @@ class Mongodb(Subscriber):
             documents.append(doc)
         return documents
 
+    async def streamDocuments(self, db, collectionName: str, query=None, projection=None):
+        """Like findDocuments, one document at a time as the cursor returns them."""
+        async for doc in db[collectionName].find(query, projection=projection):
+            yield doc
+
     async def updateFields(self, db, collectionName: str, query=None, update=None):
-        return await db[collectionName].update_one(query, {"$set": update})
+        args = {"query": query, "update": {"$set": update}}
+        if await self.spooled(db, collectionName, "update", args):
+            return None
+        try:
+            start = time.perf_counter()
+            result = await db[collectionName].update_one(query, {"$set": update})
+            self.observe_write("update", collectionName, start)
+            return result
+        except Mongodb.__unreachable as e:
+            await self.spooled(db, collectionName, "update", args, e)
+            return None
 
-    async def watch_collection(self, db, collectionName, pipeline, target):
-        resume_token = None
+    async def bulkWrite(self, db, collectionName: str, operations: list):
+        """
+        Apply a batch of writes in one round trip. Operations are plain dicts so they can be
+        spooled: {"op": "update", "filter", "update", "upsert"}, {"op": "replace", "filter",
+        "document", "upsert"} or {"op": "delete", "filter"}, which deletes every match.
+        """
+        if len(operations) == 0:
+            return None
+        args = {"operations": operations}
+        if await self.spooled(db, collectionName, "bulk", args):
+            return None
         try:
-            async with db[collectionName].watch(pipeline) as stream:
-                async for change_event in stream:
-                    self.logger.debug(f"config-event: {change_event}")
-                    await target.ingest(change_event)
-                    resume_token = stream.resume_token
-        except pymongo.errors.PyMongoError:
-            # The ChangeStream encountered an unrecoverable error or the
-            # resume attempt failed to recreate the cursor.
-            if resume_token is None:
-                self.logger.error(
-                    "There is no usable resume token because there was a"
-                    " failure during ChangeStream initialization."
+            start = time.perf_counter()
+            result = await db[collectionName].bulk_write(
+                Mongodb.requests(operations), ordered=False
+            )
+            self.observe_write("bulk", collectionName, start, len(operations))
+            return result
+        except Mongodb.__unreachable as e:
+            await self.spooled(db, collectionName, "bulk", args, e)
+            return None
+
+    @classmethod
+    def requests(cls, operations: list) -> list:
+        requests = []
+        for operation in operations:
+            if operation["op"] == "update":
+                requests.append(
+                    pymongo.UpdateOne(
+                        operation["filter"],
+                        operation["update"],
+                        upsert=operation.get("upsert", False),
+                    )
+                )
+            elif operation["op"] == "replace":
+                requests.append(
+                    pymongo.ReplaceOne(
+                        operation["filter"],
+                        operation["document"],
+                        upsert=operation.get("upsert", False),
+                    )
                 )
-            else:
-                # Use the interrupted ChangeStream's resume token to
-                # create a new ChangeStream. The new stream will
-                # continue from the last seen insert change without
-                # missing any events.
+            elif operation["op"] == "delete":
+                requests.append(pymongo.DeleteMany(operation["filter"]))
+        return requests
+
+    async def createIndex(self, db, collectionName: str, keys: list, **kwargs):
+        try:
+            return await db[collectionName].create_index(keys, **kwargs)
+        except Exception as e:
+            self.logger.error(f"unable to create index {keys} on {collectionName}: {e}")
+            return None
+
+    def observe_write(self, operation: str, collectionName: str, start: float, size=1):
+        write_seconds.observe(
+            time.perf_counter() - start, operation=operation, collection=collectionName
+        )
+        write_batch_size.observe(size, collection=collectionName)
+
+    async def spooled(
+        self, db, collectionName: str, op: str, args: dict, error=None
+    ) -> bool:
+        """
+        Store-and-forward: while the spool holds writes, new ones queue behind them so they are
+        applied in order; otherwise a write only lands in the spool once it failed because the
+        server is unreachable. Returns True when the spool took the write.
+        """
+        if self.spool is None:
+            return False
+        if error is None and self.spool.pending is not True:
+            return False
+        if error is not None and self.spool.pending is not True:
+            self.logger.warning(f"database unreachable, spooling writes to disk: {error}")
+        try:
+            await self.spool.append(db.name, collectionName, op, args)
+        except Exception as e:
+            self.logger.error(f"unable to spool {op} on {collectionName}: {e}")
+            return False
+        return True
+
+    async def run_spool(self):
+        while True:
+            await asyncio.sleep(self.settings.get("spoolinterval"))
+            if self.spool is not None and self.spool.pending is True:
+                await self.replay_spool()
+
+    async def replay_spool(self):
+        """
+        Replay the spooled writes in order, oldest batch first. Consecutive inserts into the
+        same collection go out as one insert_many. Replay stops at the first write that finds
+        the server still unreachable and resumes from there on the next attempt; a write the
+        server rejects is logged and dropped so it cannot block the spool forever.
+        """
+        replayed = 0
+        while self.spool.pending is True:
+            groups = []
+            for seq, dbname, collectionName, op, args in await self.spool.peek():
+                last = groups[-1] if len(groups) > 0 else None
+                if (
+                    op == "insert"
+                    and last is not None
+                    and last[3] == "insert"
+                    and last[1:3] == [dbname, collectionName]
+                ):
+                    last[0] = seq
+                    last[4]["documents"].extend(args["documents"])
+                else:
+                    groups.append([seq, dbname, collectionName, op, args])
+
+            for seq, dbname, collectionName, op, args in groups:
+                try:
+                    await self.replay(self.client[dbname][collectionName], op, args)
+                except Mongodb.__unreachable as e:
+                    self.logger.info(
+                        f"database still unreachable, {replayed} batches replayed: {e}"
+                    )
+                    return
+                except Exception as e:
+                    self.logger.error(f"dropping spooled {op} on {collectionName}: {e}")
+                await self.spool.remove(seq)
+                replayed += 1
+        self.logger.info(f"write spool drained, {replayed} batches replayed...")
+
+    async def replay(self, collection, op: str, args: dict):
+        if op == "insert":
+            try:
+                await collection.insert_many(args["documents"], ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                # documents whose first attempt reached the server before it went away
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != 11000 for error in errors):
+                    raise
+        elif op == "replace":
+            document = args["document"]
+            await collection.find_one_and_replace(
+                {"id": document["id"]}, document, upsert=args.get("upsert", False)
+            )
+        elif op == "update":
+            await collection.update_one(args["query"], args["update"])
+        elif op == "bulk":
+            await collection.bulk_write(Mongodb.requests(args["operations"]), ordered=False)
+
+    async def watch_collection(
+        self, db, collectionName, pipeline, target, resume_token=None
+    ):
+        """
+        Watch a collection for as long as the application runs, handing every change event to
+        the target's ingest method. The stream starts after the given resume token, and any
+        failure reconnects with an exponential backoff from the last token seen instead of
+        giving up. When the server can no longer resume from the token, the stream restarts
+        from the current point in time, the target is told to drop its persisted token, and
+        it resyncs the whole collection once the new stream is open, so the changes made
+        while the stream was down are not lost.
+        """
+        delay = Mongodb.__watch_backoff[0]
+        resync = False
+        while True:
+            try:
                 async with db[collectionName].watch(
                     pipeline, resume_after=resume_token
                 ) as stream:
+                    if resync is True:
+                        # the stream is open, so nothing changed after the resync is missed
+                        await target.resync(self)
+                        resync = False
                     async for change_event in stream:
                         self.logger.debug(f"config-event: {change_event}")
                         await target.ingest(change_event)
-        except:
-            self.logger.error("error...")
+                        resume_token = stream.resume_token
+                        delay = Mongodb.__watch_backoff[0]
+            except asyncio.CancelledError:
+                raise
+            except pymongo.errors.OperationFailure as e:
+                if e.code in Mongodb.__unresumable_codes:
+                    self.logger.warning(
+                        f"change stream on {collectionName} cannot resume ({e.code}), "
+                        "restarting from the current point in time"
+                    )
+                    resume_token = None
+                    target.clear_resume_token()
+                    resync = True
+                else:
+                    self.logger.error(f"change stream on {collectionName}: {e}")
+            except Exception as e:
+                self.logger.error(f"change stream on {collectionName}: {e}")
+
+            self.logger.info(f"reconnecting change stream on {collectionName} in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, Mongodb.__watch_backoff[1])
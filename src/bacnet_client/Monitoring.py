@@ -0,0 +1,214 @@
+import sys
+import time
+import heapq
+import asyncio
+import logging
+import threading
+import traceback
+from .Metrics import registry, Histogram
+from .LocalApi import LocalApiService
+from .SelfManagement import LocalManager, Subscriber
+
+loop_lag = registry.gauge(
+    "event_loop_lag_seconds", "How late the event loop woke up a metrics sampler sleep"
+)
+loop_stalls = registry.histogram(
+    "event_loop_stall_seconds",
+    "Event loop stalls longer than the loop monitor threshold",
+    buckets=Histogram.latency,
+)
+
+
+class MetricsService(Subscriber):
+    """
+    Publishes the metrics registry on the /metrics route of the local api, and samples the
+    event loop lag every interval. While enabled, every confirmed BACnet request is counted,
+    timed and tracked in flight as well.
+    """
+
+    __instance = None
+    __sample = 0.5  # seconds
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.settings = {
+            "section": "metrics",
+            "enable": False,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if MetricsService.__instance is None:
+            MetricsService.__instance = object.__new__(cls)
+        return MetricsService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            if option == "enable":
+                registry.enabled = value is True
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    async def run(self, bacapp):
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            LocalApiService().register("/metrics", self.exposition)
+            self.subscribed = True
+
+        self.settings["enable"] = self.localMgr.read_setting(
+            self.settings.get("section"), "enable", fallback=False
+        )
+        registry.enabled = self.settings.get("enable") is True
+
+        start = time.monotonic()
+        await asyncio.sleep(MetricsService.__sample)
+        loop_lag.set(round(max(0, time.monotonic() - start - MetricsService.__sample), 6))
+
+    def exposition(self, params: dict):
+        return "text/plain; version=0.0.4", registry.render()
+
+
+class LoopMonitor(Subscriber):
+    """
+    Finds the blocking calls that stall the event loop. A heartbeat task wakes up every half
+    threshold, and a watchdog thread that sees it overdue by more than the threshold samples
+    the stack of the loop's thread, which is stuck in the call that blocks it. Once the loop
+    wakes up, the stall is recorded with its length and that stack. The worst stalls are
+    logged every interval and served on the /stalls route of the local api.
+    """
+
+    __instance = None
+    __depth = 20  # innermost stack frames kept per stall
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.watchdog = None
+        self.loopThread = None
+        self.beat = (0, time.monotonic(), 0)
+        self.sampled = (0, None)
+        self.stalls = []
+        self.worst = []
+        self.reported = time.monotonic()
+        self.settings = {
+            "section": "loop-monitor",
+            "enable": False,
+            "threshold": 100,
+            "interval": 300,
+            "top": 10,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if LoopMonitor.__instance is None:
+            LoopMonitor.__instance = object.__new__(cls)
+        return LoopMonitor.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    async def run(self, bacapp):
+        """
+        Beat until the monitor is disabled; the application loop only schedules the next
+        run once this one returns.
+        """
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            LocalApiService().register("/stalls", self.query_stalls)
+            self.subscribed = True
+
+        section = self.settings.get("section")
+        for option in ("enable", "threshold", "interval", "top"):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+
+        self.loopThread = threading.get_ident()
+        stopped = threading.Event()
+        self.watchdog = threading.Thread(
+            target=self.watch, args=(stopped,), name="loop-monitor", daemon=True
+        )
+        self.watchdog.start()
+        try:
+            while self.settings.get("enable") is True:
+                await self.heartbeat()
+                if time.monotonic() - self.reported >= self.settings.get("interval"):
+                    self.report()
+                    self.settings["enable"] = self.localMgr.read_setting(
+                        section, "enable", fallback=False
+                    )
+        finally:
+            stopped.set()
+            self.watchdog = None
+
+    async def heartbeat(self):
+        period = self.settings.get("threshold") / 2000
+        generation = self.beat[0] + 1
+        self.beat = (generation, time.monotonic(), period)
+        await asyncio.sleep(period)
+        stall = time.monotonic() - self.beat[1] - period
+        if stall * 1000 >= self.settings.get("threshold"):
+            sampled, stack = self.sampled
+            self.record(stall, stack if sampled == generation else None)
+
+    def watch(self, stopped: threading.Event):
+        """
+        Watchdog thread: sample the loop thread's stack once per overdue heartbeat. The
+        threshold is read on every check, so a change applies without restarting the thread.
+        """
+        while stopped.wait(self.settings.get("threshold") / 4000) is not True:
+            generation, beat, period = self.beat
+            if self.sampled[0] == generation:
+                continue
+            if time.monotonic() - beat - period < self.settings.get("threshold") / 1000:
+                continue
+            frame = sys._current_frames().get(self.loopThread)
+            if frame is not None:
+                stack = traceback.format_stack(frame, limit=LoopMonitor.__depth)
+                self.sampled = (generation, "".join(stack))
+
+    def record(self, seconds: float, stack: str = None):
+        loop_stalls.observe(seconds)
+        stall = (round(seconds, 4), time.time(), stack or "not sampled")
+        if len(self.worst) < self.settings.get("top"):
+            heapq.heappush(self.worst, stall)
+        else:
+            heapq.heappushpop(self.worst, stall)
+
+    def report(self):
+        self.stalls = sorted(self.worst, reverse=True)
+        self.worst = []
+        self.reported = time.monotonic()
+        for seconds, _, stack in self.stalls:
+            self.logger.warning(f"event loop stalled for {seconds}s in:\n{stack}")
+
+    def query_stalls(self, params: dict):
+        return [
+            {"seconds": seconds, "timestamp": timestamp, "stack": stack}
+            for seconds, timestamp, stack in sorted(self.worst + self.stalls, reverse=True)
+        ]
+
+
+def install_event_loop(eventloop: str = None):
+    """
+    Select the event loop with the eventloop setting of the device section: asyncio (the
+    default), or uvloop, which has a lower per-packet overhead, when it is installed.
+    """
+    if eventloop is None:
+        eventloop = LocalManager().read_setting("device", "eventloop", fallback="asyncio")
+    if eventloop == "uvloop":
+        try:
+            import uvloop
+
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError:
+            print("uvloop is not installed, running on the asyncio event loop")
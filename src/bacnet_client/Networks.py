@@ -0,0 +1,188 @@
+import time
+import asyncio
+import logging
+import contextvars
+from bacpypes3.pdu import Address
+from bacpypes3.apdu import ErrorRejectAbortNack
+from .SelfManagement import LocalManager, Subscriber
+
+# the service a request is made for, so the stats can be reported per activity
+activity = contextvars.ContextVar("activity", default="other")
+
+
+def network_of(address) -> int:
+    """
+    The network number of a BACnet address, 0 for the gateway's own network.
+    """
+    if address is None:
+        return 0
+    if not isinstance(address, Address):
+        address = Address(address)
+    return address.addrNet or 0
+
+
+class NetworkLimiter:
+    """
+    Admission control for the requests sent to one network: at most concurrency requests
+    in flight, started no faster than rate requests per second (0 for no rate limit).
+    """
+
+    def __init__(self, concurrency: int, rate: float) -> None:
+        self.semaphore = asyncio.Semaphore(max(1, concurrency))
+        self.interval = 1 / rate if rate > 0 else 0
+        self.nextRequest = 0
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        if self.interval > 0:
+            now = time.monotonic()
+            if self.nextRequest > now:
+                await asyncio.sleep(self.nextRequest - now)
+            self.nextRequest = max(now, self.nextRequest) + self.interval
+        return self
+
+    async def __aexit__(self, *exc_details):
+        self.semaphore.release()
+
+
+class NetworkService(Subscriber):
+    """
+    Multi-network awareness for the gateway. Routers are found with Who-Is-Router-To-Network
+    and the network number -> router table is cached for routerttl seconds, so discovery can
+    send a directed broadcast to every network behind them. When enabled, each network gets
+    its own concurrency and rate limits for confirmed requests, so a slow MS/TP trunk only
+    ever holds back its own devices. Request counts, errors and latency are kept per network
+    and per activity (discovery, polling...) and reported at the end of each cycle.
+
+    Limits default to the concurrency and rate settings, and are set for one network by
+    suffixing the option with its number, e.g. concurrency.2 = 1 and rate.2 = 5.
+    """
+
+    __instance = None
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.limiters: dict = {}
+        self.routers: dict = {}
+        self.routersUpdated = 0
+        self.stats: dict = {}
+        self.settings = {
+            "section": "networks",
+            "enable": False,
+            "concurrency": 16,
+            "rate": 0,
+            "routerttl": 3600,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if NetworkService.__instance is None:
+            NetworkService.__instance = object.__new__(cls)
+        return NetworkService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.limiters.clear()
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.get("enable") is True
+
+    async def run(self, bacapp):
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            self.subscribed = True
+        self.read_settings()
+
+    def read_settings(self):
+        section = self.settings.get("section")
+        self.settings["enable"] = self.localMgr.read_setting(section, "enable", fallback=False)
+        for option in ("concurrency", "rate", "routerttl"):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+        if self.localMgr.config.has_section(section):
+            for option in self.localMgr.config.options(section):
+                if "." not in option:
+                    continue
+                value = self.localMgr.read_setting(section, option)
+                if self.settings.get(option) != value:
+                    self.settings[option] = value
+                    self.limiters.clear()
+
+    def limiter(self, network: int) -> NetworkLimiter:
+        if network not in self.limiters:
+            self.limiters[network] = NetworkLimiter(
+                self.settings.get(f"concurrency.{network}", self.settings.get("concurrency")),
+                self.settings.get(f"rate.{network}", self.settings.get("rate")),
+            )
+        return self.limiters[network]
+
+    async def submit(self, address, request):
+        """
+        Run the request coroutine function once the destination network admits it, and
+        account for it in that network's stats.
+        """
+        network = network_of(address)
+        stats = self.stats.setdefault((activity.get(), network), [0, 0, 0.0])
+        async with self.limiter(network):
+            start = time.perf_counter()
+            try:
+                return await request()
+            except (Exception, ErrorRejectAbortNack):
+                stats[1] += 1
+                raise
+            finally:
+                stats[0] += 1
+                stats[2] += time.perf_counter() - start
+
+    async def refresh_routers(self, app):
+        """
+        Ask the routers on the local network which networks they reach, unless the cached
+        table is younger than routerttl.
+        """
+        if time.time() - self.routersUpdated < self.settings.get("routerttl"):
+            return self.routers
+        try:
+            responses = await app.nse.who_is_router_to_network()
+        except Exception as e:
+            self.logger.warning(f"router discovery failed: {e}")
+            return self.routers
+        routers = {}
+        for _, npdu in responses:
+            for network in npdu.iartnNetworkList:
+                routers[network] = str(npdu.pduSource)
+        self.routers = routers
+        self.routersUpdated = time.time()
+        self.logger.info(f"{len(routers)} remote networks found: {routers}")
+        return self.routers
+
+    def broadcast_addresses(self) -> list:
+        """
+        A local broadcast and a directed broadcast to every known remote network.
+        """
+        return [Address("*")] + [Address(f"{network}:*") for network in sorted(self.routers)]
+
+    def report(self, name: str, devices: dict = None) -> dict:
+        """
+        Log and reset the stats gathered for the activity since its last report.
+        """
+        report = {}
+        for key in [key for key in self.stats if key[0] == name]:
+            requests, errors, seconds = self.stats.pop(key)
+            report[key[1]] = {
+                "requests": requests,
+                "errors": errors,
+                "latency": round(seconds / requests, 4) if requests > 0 else None,
+            }
+        for network, count in (devices or {}).items():
+            report.setdefault(network, {})["devices"] = count
+        for network in sorted(report):
+            self.logger.info(f"{name} network {network}: {report[network]}")
+        return report
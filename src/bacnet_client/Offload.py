@@ -0,0 +1,100 @@
+import os
+import pickle
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from .SelfManagement import LocalManager, Subscriber
+
+
+class Offloader(Subscriber):
+    """
+    Runs the blocking file and CPU work of the services (object graph pickles, configuration
+    writes, property normalization) on a managed thread pool, so the event loop keeps serving
+    BACnet transactions meanwhile. Handing work to a thread has a cost of its own, so small
+    jobs still run inline: work is only offloaded once its size reaches the threshold for
+    its kind, bytes for files and objects for normalization.
+    """
+
+    __instance = None
+    __ini_section = "offload"
+    # created on first use, and kept when the singleton is constructed again
+    executor: ThreadPoolExecutor = None
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.settings = {
+            "section": Offloader.__ini_section,
+            "workers": self.localMgr.read_setting(
+                Offloader.__ini_section, "workers", fallback=2
+            ),
+            "bytes": self.localMgr.read_setting(
+                Offloader.__ini_section, "bytes", fallback=262144
+            ),
+            "objects": self.localMgr.read_setting(
+                Offloader.__ini_section, "objects", fallback=1000
+            ),
+        }
+        self.logger = logging.getLogger("ClientLog")
+
+        if self.localMgr.initialized is True:
+            self.localMgr.subscribe(self.__instance)
+
+    def __new__(cls):
+        if Offloader.__instance is None:
+            Offloader.__instance = object.__new__(cls)
+        return Offloader.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            if option == "workers" and self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+            self.logger.debug(f"{section}: {oldvalue} > {self.settings.get(option)}")
+
+    async def call(self, size: int, threshold: str, func, *args):
+        """
+        Run func(*args) inline when size is under the threshold setting, on the thread pool
+        otherwise.
+        """
+        if size < self.settings.get(threshold):
+            return func(*args)
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.settings.get("workers"), thread_name_prefix="offload"
+            )
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(func, *args)
+        )
+
+    async def load_pickle(self, path: str):
+        return await self.call(os.path.getsize(path), "bytes", load_pickle, path)
+
+    async def dump_pickle(self, obj, path: str):
+        """
+        Replace the pickle atomically. Its current size is the estimate of the new one.
+        """
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        await self.call(size, "bytes", dump_pickle, obj, path)
+
+    async def write_text(self, text: str, path: str):
+        await self.call(len(text), "bytes", write_text, text, path)
+
+
+def load_pickle(path: str):
+    with open(path, "rb") as pickleFile:
+        return pickle.load(pickleFile)
+
+
+def dump_pickle(obj, path: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as pickleFile:
+        pickle.dump(obj, pickleFile)
+    os.replace(tmp_path, path)
+
+
+def write_text(text: str, path: str):
+    with open(path, "w") as textFile:
+        textFile.write(text)
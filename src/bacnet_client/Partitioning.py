@@ -0,0 +1,295 @@
+import math
+import asyncio
+import logging
+import datetime as dt
+from pymongo import ReturnDocument
+from .SelfManagement import LocalManager, Subscriber
+
+# the range of BACnet device instances
+INSTANCES = (0, 4194303)
+
+
+def server_seconds(timestamp: dt.datetime) -> float:
+    """A server date as epoch seconds; the driver returns naive dates in UTC."""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=dt.timezone.utc)
+    return timestamp.timestamp()
+
+
+class LeaseTable:
+    """
+    Cooperative bucket leases shared by every gateway writing to the same database. The
+    device instance range is cut into a fixed number of contiguous buckets, so the devices of
+    a bucket can be found with a ranged who-is, each bucket is one document in the Leases
+    collection, and a gateway owns the devices of the buckets it holds an unexpired lease on.
+    Instances below or above the partitioned range fall into the first or last bucket.
+    Gateways register a heartbeat in the Gateways collection, and on every renewal each one
+    sizes its fair share from the live gateway count: surplus leases are released for
+    newcomers, and free or expired ones are claimed with an atomic compare-and-set, so two
+    gateways can never hold the same bucket. A gateway that dies stops renewing and its
+    buckets are picked up by the others once the lease time-to-live has passed. Heartbeats
+    are stamped with the server's clock and leases expire by it, so clock skew between the
+    gateways cannot hand one bucket to two of them.
+    """
+
+    def __init__(
+        self, db, nukid: str, buckets: int = 64, ttl: float = 30, low: int = None, high=None
+    ) -> None:
+        self.db = db
+        self.nukid = nukid
+        self.buckets = buckets
+        self.ttl = ttl
+        self.low = INSTANCES[0] if low is None else max(INSTANCES[0], low)
+        self.high = INSTANCES[1] if high is None else min(INSTANCES[1], max(self.low, high))
+        self.owned: set = set()
+        self.initialized = False
+
+    @classmethod
+    def instance_of(cls, deviceId) -> int:
+        return int(str(deviceId).split(",")[-1].strip())
+
+    def bucket_of(self, deviceId) -> int:
+        instance = min(max(LeaseTable.instance_of(deviceId), self.low), self.high)
+        return (instance - self.low) * self.buckets // (self.high - self.low + 1)
+
+    def first_instance(self, bucket: int) -> int:
+        if bucket <= 0:
+            return INSTANCES[0]
+        if bucket >= self.buckets:
+            return INSTANCES[1] + 1
+        return self.low - (-bucket * (self.high - self.low + 1) // self.buckets)
+
+    def ranges(self, buckets=None) -> list:
+        """The (low, high) instance ranges of the owned (or given) buckets, merged."""
+        ranges = []
+        for bucket in sorted(self.owned if buckets is None else buckets):
+            low, high = self.first_instance(bucket), self.first_instance(bucket + 1) - 1
+            if low > high:
+                continue
+            if len(ranges) > 0 and ranges[-1][1] + 1 == low:
+                ranges[-1] = (ranges[-1][0], high)
+            else:
+                ranges.append((low, high))
+        return ranges
+
+    def owns(self, deviceId) -> bool:
+        return self.bucket_of(deviceId) in self.owned
+
+    async def initialize(self):
+        for bucket in range(self.buckets):
+            await self.db["Leases"].update_one(
+                {"bucket": bucket},
+                {"$setOnInsert": {"owner": None, "expires": 0}},
+                upsert=True,
+            )
+        self.initialized = True
+
+    async def heartbeat(self) -> float:
+        """Stamp this gateway's heartbeat with the server's clock, and return it."""
+        gateway = await self.db["Gateways"].find_one_and_update(
+            {"nukid": self.nukid},
+            {"$currentDate": {"heartbeat": True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return server_seconds(gateway["heartbeat"])
+
+    async def live_gateways(self, now: float) -> list:
+        gateways = []
+        # naive, like the dates the driver returns: both are read as UTC
+        since = dt.datetime.fromtimestamp(now - self.ttl, tz=dt.timezone.utc).replace(tzinfo=None)
+        async for gateway in self.db["Gateways"].find({"heartbeat": {"$gt": since}}):
+            gateways.append(gateway["nukid"])
+        return sorted(gateways)
+
+    async def renew(self) -> set:
+        """
+        Heartbeat, renew the leases still held, then release or claim buckets until this
+        gateway holds its fair share. Returns the set of owned buckets. Expiry times are
+        counted from the server's clock, read back with the heartbeat.
+        """
+        if self.initialized is not True:
+            await self.initialize()
+
+        now = await self.heartbeat()
+        gateways = await self.live_gateways(now)
+        share = math.ceil(self.buckets / max(1, len(gateways)))
+
+        leases = []
+        async for lease in self.db["Leases"].find({}):
+            leases.append(lease)
+        leases.sort(key=lambda lease: lease["bucket"])
+
+        owned = []
+        for lease in leases:
+            if lease["owner"] != self.nukid or lease["expires"] <= now:
+                continue
+            result = await self.db["Leases"].update_one(
+                {"bucket": lease["bucket"], "owner": self.nukid},
+                {"$set": {"expires": now + self.ttl}},
+            )
+            if result.matched_count > 0:
+                owned.append(lease["bucket"])
+
+        while len(owned) > share:
+            await self.db["Leases"].update_one(
+                {"bucket": owned.pop(), "owner": self.nukid},
+                {"$set": {"owner": None, "expires": 0}},
+            )
+
+        for lease in leases:
+            if len(owned) >= share:
+                break
+            if lease["owner"] is not None and lease["expires"] > now:
+                continue
+            claimed = await self.db["Leases"].find_one_and_update(
+                {
+                    "bucket": lease["bucket"],
+                    "$or": [{"owner": None}, {"expires": {"$lte": now}}],
+                },
+                {"$set": {"owner": self.nukid, "expires": now + self.ttl}},
+            )
+            if claimed is not None:
+                owned.append(lease["bucket"])
+
+        self.owned = set(owned)
+        return self.owned
+
+    async def release(self):
+        for bucket in self.owned:
+            await self.db["Leases"].update_one(
+                {"bucket": bucket, "owner": self.nukid},
+                {"$set": {"owner": None, "expires": 0}},
+            )
+        await self.db["Gateways"].update_one(
+            {"nukid": self.nukid},
+            {"$set": {"heartbeat": dt.datetime.fromtimestamp(0, tz=dt.timezone.utc)}},
+        )
+        self.owned = set()
+
+
+class LeaseManager(Subscriber):
+    """
+    Work partitioning service for sites served by several gateways. When the [partitioning]
+    section is enabled it keeps this gateway's bucket leases renewed, and the discovery and
+    polling services ask it which devices are theirs. Disabled (the default), every device is
+    owned and nothing is written to the database. The generation counter moves whenever the
+    owned set changes, so the services can rebuild their share right after a rebalance.
+    """
+
+    __instance = None
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.mongo = None
+        self.table: LeaseTable = None
+        self.layout = None
+        self.generation = 0
+        self.settings = {
+            "section": "partitioning",
+            "enable": False,
+            "buckets": 64,
+            "ttl": 30,
+            "low": INSTANCES[0],
+            "high": INSTANCES[1],
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if LeaseManager.__instance is None:
+            LeaseManager.__instance = object.__new__(cls)
+        return LeaseManager.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.get("enable") is True
+
+    def owns(self, deviceId) -> bool:
+        if self.enabled is not True:
+            return True
+        return self.table is not None and self.table.owns(deviceId)
+
+    @property
+    def owned(self) -> set:
+        return set() if self.table is None else set(self.table.owned)
+
+    def ranges(self, buckets=None) -> list:
+        """The instance ranges of this gateway's (or the given) buckets, for a ranged who-is."""
+        if self.enabled is not True:
+            return [INSTANCES]
+        return [] if self.table is None else self.table.ranges(buckets)
+
+    def read_settings(self):
+        section = self.settings.get("section")
+        self.settings["enable"] = self.localMgr.read_setting(section, "enable", fallback=False)
+        self.settings["buckets"] = self.localMgr.read_setting(section, "buckets", fallback=64)
+        self.settings["ttl"] = self.localMgr.read_setting(section, "ttl", fallback=30)
+        for option in ("low", "high"):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+
+    async def run(self, bacapp):
+        if self.mongo is None:
+            self.mongo = bacapp.clients.get("mongodb")
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            self.subscribed = True
+
+        while True:
+            self.read_settings()
+            if self.enabled is True:
+                await self.renew()
+            elif self.table is not None:
+                await self.release()
+            await asyncio.sleep(max(1, self.settings.get("ttl") / 3))
+
+    async def renew(self):
+        buckets = self.settings.get("buckets")
+        ttl = self.settings.get("ttl")
+        low, high = self.settings.get("low"), self.settings.get("high")
+        if self.table is None or self.layout != (buckets, low, high):
+            if self.table is not None:
+                await self.release()
+            self.table = LeaseTable(
+                self.mongo.getDb(),
+                str(self.localMgr.read_setting("device", "nukid")),
+                buckets=buckets,
+                ttl=ttl,
+                low=low,
+                high=high,
+            )
+            self.layout = (buckets, low, high)
+        self.table.ttl = ttl
+
+        owned = set(self.table.owned)
+        try:
+            await self.table.renew()
+        except Exception as e:
+            # The leases expire on their own if the database stays unreachable, stop
+            # working on devices another gateway may be taking over.
+            self.logger.error(f"lease renewal failed: {e}")
+            self.table.owned = set()
+        if self.table.owned != owned:
+            self.generation += 1
+            self.logger.info(
+                f"partitioning: {len(self.table.owned)}/{buckets} buckets owned "
+                f"(gained {len(self.table.owned - owned)}, lost {len(owned - self.table.owned)})"
+            )
+
+    async def release(self):
+        try:
+            await self.table.release()
+        except Exception as e:
+            self.logger.error(f"lease release failed: {e}")
+        self.table = None
+        self.generation += 1
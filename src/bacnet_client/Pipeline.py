@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from .Metrics import registry
+
+queued_items = registry.gauge(
+    "pipeline_queued_items", "Items waiting for a pipeline stage", ("pipeline", "stage")
+)
+
+
+class Pipeline:
+    """
+    Streams the items of a source through stages connected by bounded queues. Every stage
+    runs as a task of its own and takes the next item as soon as it has handed the last one
+    on, so reading, normalizing and writing overlap. A stage that falls behind fills its
+    queue, which holds the stages before it (and the source) back: at most maxsize items
+    wait before each stage, whatever the size of the source. A stage returns the item to
+    pass on, or None to drop it. An item a stage fails on is logged and dropped, the others
+    go on.
+    """
+
+    __done = object()
+
+    def __init__(self, name: str, maxsize: int = 4) -> None:
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.stages: list = []
+        self.count = 0
+        self.errors = 0
+        self.logger = logging.getLogger("ClientLog")
+
+    def stage(self, name: str, func):
+        """Append a stage running the coroutine function func on every item."""
+        self.stages.append((name, func))
+        return self
+
+    async def run(self, source) -> int:
+        """Stream every item of the async iterable source, returning how many came out."""
+        names = [name for name, _ in self.stages]
+        queues = [asyncio.Queue(self.maxsize) for _ in self.stages] + [None]
+        tasks = [
+            asyncio.ensure_future(
+                self.work(names[i], func, queues[i], queues[i + 1], (names + [None])[i + 1])
+            )
+            for i, (_, func) in enumerate(self.stages)
+        ]
+        try:
+            async for item in source:
+                await self.put(queues[0], names[0], item)
+            await queues[0].put(Pipeline.__done)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for name in names:
+                queued_items.set(0, pipeline=self.name, stage=name)
+        return self.count
+
+    async def work(
+        self, name: str, func, inbox: asyncio.Queue, outbox: asyncio.Queue, following: str
+    ):
+        while True:
+            item = await inbox.get()
+            queued_items.set(inbox.qsize(), pipeline=self.name, stage=name)
+            if item is Pipeline.__done:
+                if outbox is not None:
+                    await outbox.put(Pipeline.__done)
+                return
+            try:
+                item = await func(item)
+            except Exception as e:
+                self.errors += 1
+                self.logger.error(f"{self.name} pipeline: {name} failed: {e}")
+                continue
+            if item is None:
+                continue
+            if outbox is None:
+                self.count += 1
+            else:
+                await self.put(outbox, following, item)
+
+    async def put(self, queue: asyncio.Queue, stage: str, item):
+        await queue.put(item)
+        queued_items.set(queue.qsize(), pipeline=self.name, stage=stage)
+
@@ -78,7 +78,11 @@ class BacnetPoint:
             self.logger.error(f"failed to build point object {self.obj}")
             raise;
 
-    async def update(self):
+    async def update(self, withStatus=True):
+        """
+        Refresh the present value, and the status flags and reliability unless withStatus is
+        False (alarm state then comes from the event notification service instead).
+        """
         try:
             value = await self.app.read_property(
                 Address(self.device["address"]),
@@ -86,20 +90,21 @@ class BacnetPoint:
                 PropertyIdentifier.presentValue,
             )
 
-            status: StatusFlags = await self.app.read_property(
-                Address(self.device["address"]),
-                ObjectIdentifier(self.obj),
-                PropertyIdentifier.statusFlags,
-            )
-
-            reliability: Reliability = await self.app.read_property(
-                Address(self.device["address"]),
-                ObjectIdentifier(self.obj),
-                PropertyIdentifier.reliability,
-            )
+            if withStatus is True:
+                status: StatusFlags = await self.app.read_property(
+                    Address(self.device["address"]),
+                    ObjectIdentifier(self.obj),
+                    PropertyIdentifier.statusFlags,
+                )
+
+                reliability: Reliability = await self.app.read_property(
+                    Address(self.device["address"]),
+                    ObjectIdentifier(self.obj),
+                    PropertyIdentifier.reliability,
+                )
+                self.spec["status"] = str(status)
+                self.spec["reliability"] = str(reliability)
             self.spec["value"] = value
-            self.spec["status"] = str(status)
-            self.spec["reliability"] = str(reliability)
             self.spec["last synced"] = dt.datetime.now(
                 tz=self.localDevice.settings.get("tz")
             ).strftime(BacnetPoint.__ISO8601)
@@ -1,12 +1,25 @@
-import pickle
+import time
 import logging
+from functools import partial
 from collections import OrderedDict
 from .Device import LocalBacnetDevice
 from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
+from .Partitioning import LeaseManager
+from .Offload import Offloader
+from .PointStore import PointStore
+from .Pipeline import Pipeline
+from .Networks import activity
+from .Metrics import registry, Histogram
 import bacnet_client.Point as pt
 import bacnet_client.PointPolling as pp
 from bacpypes3.ipv4.app import NormalApplication
 
+discovery_seconds = registry.histogram(
+    "bacnet_point_discovery_cycle_seconds",
+    "Point discovery and commit cycle duration",
+    buckets=Histogram.cycle,
+)
+
 
 class PointManager(Subscriber):
     """
@@ -24,7 +37,10 @@ class PointManager(Subscriber):
         self.og_fp = None
         self.mongo = None
         self.scheduler: ServiceScheduler = ServiceScheduler()
-        self.deviceSpecs = []
+        self.leases: LeaseManager = LeaseManager()
+        self.offload: Offloader = Offloader()
+        self.store: PointStore = PointStore()
+        self.leaseGeneration = 0
         self.object_graph = {}
         self.localDevice = LocalBacnetDevice()
         self.lowLimit = 0
@@ -33,6 +49,7 @@ class PointManager(Subscriber):
             "section": "point-discovery",
             "enable": None,
             "interval": None,
+            "queuesize": 4,
         }
         self.subscribed = False
         self.logger = logging.getLogger("ClientLog")
@@ -71,231 +88,256 @@ class PointManager(Subscriber):
             self.settings["interval"] = self.localMgr.read_setting(
                 self.settings.get("section"), "interval"
             )
+            self.settings["queuesize"] = self.localMgr.read_setting(
+                self.settings.get("section"), "queuesize", fallback=4
+            )
 
             if (
                 self.scheduler.check_ticket(
                     self.settings.get("section"), interval=self.settings.get("interval")
                 )
                 or self.__isBootup
+                or self.leaseGeneration != self.leases.generation  # noqa: W503
             ):
+                self.leaseGeneration = self.leases.generation
+                start = time.perf_counter()
                 await self.discover()
                 await self.commit()
+                discovery_seconds.observe(time.perf_counter() - start)
                 self.__isBootup = False
 
+    async def warm_start(self, bacapp):
+        """
+        Seed the object graph from the last persisted snapshot so polling can start right away
+        while point discovery reconciles in the background. The local pickle is preferred, and
+        when it is missing or empty (e.g. right after a deploy) the graph is rebuilt from the
+        point lists already stored in the database.
+        """
+        if self.mongo is None:
+            self.mongo = bacapp.clients.get("mongodb")
+        if self.localMgr is None:
+            self.localMgr = bacapp.localMgr
+        self.og_fp = self.localMgr.respath + "object-graph.pkl"
+
+        object_graph = await self.load_object_graph()
+        if len(object_graph) == 0:
+            try:
+                dbPayload = await self.store.load()
+            except:  # noqa: E722
+                self.logger.error("warm start: unable to read the stored point lists...")
+                dbPayload = []
+
+            for device in dbPayload:
+                if self.leases.owns(device["id"]) is not True:
+                    continue
+                object_graph[device["id"]] = {
+                    obj: {
+                        "id": device["id"],
+                        "name": device["name"],
+                        "address": device["address"],
+                        "point": obj,
+                    }
+                    for obj in device.get("points", {})
+                }
+            await self.save_object_graph(object_graph)
+
+        self.logger.info(
+            f"warm start: object graph seeded with {len(object_graph)} device(s)..."
+        )
+
+    async def load_object_graph(self):
+        try:
+            return await self.offload.load_pickle(self.og_fp)
+        except Exception:
+            # A missing file, an empty placeholder or a truncated file has no usable snapshot.
+            return {}
+
+    async def save_object_graph(self, object_graph=None):
+        """
+        Replace the persisted object graph atomically so the poller never reads a partially
+        written or truncated snapshot while discovery is rebuilding it. Large graphs are
+        pickled off the event loop.
+        """
+        try:
+            await self.offload.dump_pickle(
+                self.object_graph if object_graph is None else object_graph, self.og_fp
+            )
+        except:  # noqa: E722
+            self.logger.critical("ERROR Unable to persist object graph to file...!")
+
     async def discover(self):
         """
         Discovers listed bacnet devices objects filtering for points, trends, alarms, and schedules.
         It then creates instance objects process them and sends output data specs to the database.
+        Devices stream through read, normalize and write stages joined by queues of queuesize
+        devices, so each point list is written as soon as its device is read, and only the
+        devices in flight are held in memory. The persisted object graph is updated one device
+        at a time, so the poller keeps polling the previous graph for devices that have not
+        been rebuilt yet.
         """
 
         self.logger.info("point discovery started...")
+        activity.set("point-discovery")
         try:
             docCount = await self.mongo.getDocumentCount(self.mongo.getDb(), "Devices")
         except:
             self.logger.error("Could not get a device doc count...")
         else:
             if docCount > 0:
-                dbPayload = await self.mongo.findDocuments(
+                # only the fields read() needs, one device at a time off the cursor
+                devices = self.mongo.streamDocuments(
                     self.mongo.getDb(),
                     "Devices",
                     query={},
-                    projection={"id": 1, "address": 1, "properties": 1, "_id": 0},
+                    projection={
+                        "id": 1,
+                        "address": 1,
+                        "properties.device-name.value": 1,
+                        "properties.object-list.value": 1,
+                        "_id": 0,
+                    },
                 )
+                deviceIds = set()
 
-                try:
-                    with open(self.og_fp, "wb") as object_graph:
-                        object_graph.flush()
-                except:  # noqa: E722
-                    self.logger.critical("ERROR Unable to persist object graph to file...!")
-
-                for device in dbPayload:
-                    try:
-                        deviceSpec = OrderedDict(
-                            {
-                                "name": device["properties"]["device-name"]["value"],
-                                "id": device["id"],
-                                "address": device["address"],
-                                "points": OrderedDict(),
-                            }
-                        )
-                        pointList = deviceSpec["points"]
-                        objListValue = device["properties"]["object-list"]["value"]
-
-                        # TODO - Add trend, schedule, and alarm objects to the object graph here.
-                        #        All object types filtered into 'objList' will be parsed into the
-                        #         object-graph for secondary services to derive data from.
-                        objList = list(
-                            filter(
-                                lambda kind: "analog-value" in kind
-                                or "analog-input" in kind  # noqa: W503
-                                or "analog-output" in kind  # noqa: W503
-                                or "binary-value" in kind  # noqa: W503
-                                or "binary-input" in kind  # noqa: W503
-                                or "binary-output" in kind  # noqa: W503
-                                or "multi-state-value" in kind  # noqa: W503
-                                or "multi-state-input" in kind  # noqa: W503
-                                or "multi-state-output" in kind,
-                                objListValue,  # noqa: W503
-                            )
-                        )
+                self.object_graph = await self.load_object_graph()
 
-                        self.object_graph[device["id"]] = {}
-
-                        for i, obj in enumerate(objList):
-                            self.object_graph[device["id"]][obj] = {
-                                "id": deviceSpec["id"],
-                                "name": deviceSpec["name"],
-                                "address": deviceSpec["address"],
-                                "point": obj,
-                            }
-                            if "analog" in str(obj):
-                                point = pt.AnalogPoint(
-                                    self.app,
-                                    self.localDevice,
-                                    self.object_graph[device["id"]][obj],
-                                    obj,
-                                )
-                                await point.build()
-                                pointList[str(point.obj)] = point.spec
-                            elif "binary" in str(obj):
-                                point = pt.BinaryPoint(
-                                    self.app,
-                                    self.localDevice,
-                                    self.object_graph[device["id"]][obj],
-                                    obj,
-                                )
-                                await point.build()
-                                pointList[str(point.obj)] = point.spec
-                            elif "multi-state" in str(obj):
-                                point = pt.MsvPoint(
-                                    self.app,
-                                    self.localDevice,
-                                    self.object_graph[device["id"]][obj],
-                                    obj,
-                                )
-                                await point.build()
-                                pointList[str(point.obj)] = point.spec
-                            else:
-                                point = pt.BacnetPoint(
-                                    self.app,
-                                    self.localDevice,
-                                    self.object_graph[device["id"]][obj],
-                                    obj,
-                                )
-                                await point.build()
-                                pointList[str(point.obj)] = point.spec
-
-                        with open(self.og_fp, "wb") as object_graph:
-                            try:
-                                pickle.dump(self.object_graph, object_graph)
-                            except:  # noqa: E722
-                                self.logger.critical(
-                                    f"ERROR Unable to append {deviceSpec['id']} object graph to file...!"
-                                )
-
-                    except:  # noqa: E722
-                        self.logger.critical(
-                            f"ERROR object-list is not available in \
-                                {device['properties']['device-name']['value']}"
-                        )
+                await self.store.prepare()
+                async with self.mongo.writer() as writer:
+                    pipeline = Pipeline("point-discovery", self.settings.get("queuesize"))
+                    pipeline.stage("normalize", self.normalize)
+                    pipeline.stage("write", partial(self.write, writer))
+                    committed = await pipeline.run(self.read(devices, deviceIds))
+                self.logger.info(f"point lists to database: {committed}")
 
-                    self.deviceSpecs.append(deviceSpec)
+                # Drop devices that are no longer listed in the Devices collection.
+                for id in list(self.object_graph):
+                    if id not in deviceIds:
+                        self.object_graph.pop(id)
+                await self.save_object_graph()
 
         self.logger.info("point discovery completed...")
 
-    async def commit(self):
-
-        self.logger.info("points commit to database has started...")
-
-        docCount = await self.mongo.getDocumentCount(self.mongo.getDb(), "Points")
-        self.logger.info(f"doc count: {docCount}")
-        self.logger.info(f"point lists to database: {len(list(self.deviceSpecs))}")
-
-        if docCount == 0:
-            await self.mongo.writeDocuments(
-                self.deviceSpecs, self.mongo.getDb(), "Points"
-            )
-            self.logger.debug(f"Document count {docCount}")
-        elif docCount == len(self.deviceSpecs):
-            self.logger.debug(
-                f"Documents ({docCount}) == Specs: {len(self.deviceSpecs)}"
-            )
-            for spec in self.deviceSpecs:
-                await self.mongo.replaceDocument(spec, self.mongo.getDb(), "Points")
-        elif docCount < len(self.deviceSpecs):
-            self.logger.debug(
-                f"Documents ({docCount}) < Specs: {len(self.deviceSpecs)}"
-            )
-            dbPayload = await self.mongo.findDocuments(
-                self.mongo.getDb(), "Points", query={}, projection={"id": 1, "_id": 0}
-            )
-            memSpecIds = set(
-                [int(str(spec["id"]).split(",")[1]) for spec in self.deviceSpecs]
-            )
-            dbSpecIds = set([int(str(spec["id"]).split(",")[1]) for spec in dbPayload])
-
-            self.logger.debug(f"device specs available in memory {memSpecIds}")
-            self.logger.debug(f"device specs pulled from db {dbSpecIds}")
-            newSpecIds = memSpecIds - dbSpecIds
-            foundSpecIds = memSpecIds & dbSpecIds
-
-            self.logger.debug(f"device specs available in memory: {memSpecIds}")
-            self.logger.debug(f"device specs pulled from db: {dbSpecIds}")
-            self.logger.debug(f"new specs to push to db: {newSpecIds}")
-            self.logger.debug(f"existing specs to be updated on db: {foundSpecIds}")
-
-            newSpecs = list(
-                filter(
-                    lambda spec: int(str(spec["id"]).split(",")[1]) in list(newSpecIds),
-                    sorted(list(self.deviceSpecs)),
+    async def read(self, devices, deviceIds: set):
+        """
+        Read the points of each device, yielding the device's point list once it is built.
+        The ids of the devices listed are added to deviceIds. With partitioning on, devices
+        outside this gateway's buckets are skipped, and dropped from the graph afterwards like
+        devices removed from the collection. A device whose object list or points cannot be
+        read is skipped as well, keeping its stored points and its previous graph.
+        """
+        async for device in devices:
+            if self.leases.owns(device["id"]) is not True:
+                continue
+            deviceIds.add(device["id"])
+            try:
+                deviceSpec = OrderedDict(
+                    {
+                        "name": device["properties"]["device-name"]["value"],
+                        "id": device["id"],
+                        "address": device["address"],
+                        "points": OrderedDict(),
+                    }
                 )
-            )
-            for ns in newSpecs:
-                await self.mongo.writeDocument(ns, self.mongo.getDb(), "Points")
-
-            foundSpecs = list(
-                filter(
-                    lambda spec: int(str(spec["id"]).split(",")[1])
-                    in list(foundSpecIds),
-                    sorted(list(self.deviceSpecs)),
+                pointList = deviceSpec["points"]
+                objListValue = device["properties"]["object-list"]["value"]
+
+                # TODO - Add trend, schedule, and alarm objects to the object graph here.
+                #        All object types filtered into 'objList' will be parsed into the
+                #         object-graph for secondary services to derive data from.
+                objList = list(
+                    filter(
+                        lambda kind: "analog-value" in kind
+                        or "analog-input" in kind  # noqa: W503
+                        or "analog-output" in kind  # noqa: W503
+                        or "binary-value" in kind  # noqa: W503
+                        or "binary-input" in kind  # noqa: W503
+                        or "binary-output" in kind  # noqa: W503
+                        or "multi-state-value" in kind  # noqa: W503
+                        or "multi-state-input" in kind  # noqa: W503
+                        or "multi-state-output" in kind,
+                        objListValue,  # noqa: W503
+                    )
                 )
-            )
-            for fs in foundSpecs:
-                await self.mongo.replaceDocument(fs, self.mongo.getDb(), "Points")
 
-        elif docCount > len(self.deviceSpecs):
-            self.logger.debug(
-                f"Documents ({docCount}) > Specs: {len(self.deviceSpecs)}"
-            )
-            dbPayload = await self.mongo.findDocuments(
-                self.mongo.getDb(), "Points", query={}, projection={"id": 1, "_id": 0}
-            )
-            memSpecIds = set(
-                [int(str(spec["id"]).split(",")[1]) for spec in self.deviceSpecs]
-            )
-            dbSpecIds = set([int(str(spec["id"]).split(",")[1]) for spec in dbPayload])
-            foundSpecIds = memSpecIds & dbSpecIds
-
-            self.logger.debug(f"device specs available in memory: {memSpecIds}")
-            self.logger.debug(f"device specs pulled from db: {dbSpecIds}")
-            self.logger.debug(f"existing specs to be updated on db: {foundSpecIds}")
-
-            foundSpecs = list(
-                filter(
-                    lambda spec: int(str(spec["id"]).split(",")[1])
-                    in list(foundSpecIds),
-                    sorted(list(self.deviceSpecs)),
+                graph = {}
+
+                for i, obj in enumerate(objList):
+                    graph[obj] = {
+                        "id": deviceSpec["id"],
+                        "name": deviceSpec["name"],
+                        "address": deviceSpec["address"],
+                        "point": obj,
+                    }
+                    if "analog" in str(obj):
+                        point = pt.AnalogPoint(
+                            self.app,
+                            self.localDevice,
+                            graph[obj],
+                            obj,
+                        )
+                        await point.build()
+                        pointList[str(point.obj)] = point.spec
+                    elif "binary" in str(obj):
+                        point = pt.BinaryPoint(
+                            self.app,
+                            self.localDevice,
+                            graph[obj],
+                            obj,
+                        )
+                        await point.build()
+                        pointList[str(point.obj)] = point.spec
+                    elif "multi-state" in str(obj):
+                        point = pt.MsvPoint(
+                            self.app,
+                            self.localDevice,
+                            graph[obj],
+                            obj,
+                        )
+                        await point.build()
+                        pointList[str(point.obj)] = point.spec
+                    else:
+                        point = pt.BacnetPoint(
+                            self.app,
+                            self.localDevice,
+                            graph[obj],
+                            obj,
+                        )
+                        await point.build()
+                        pointList[str(point.obj)] = point.spec
+
+                if len(pointList) > 0 and not any(
+                    "last synced" in spec for spec in pointList.values()
+                ):
+                    # every build failed, the device did not answer
+                    self.logger.error(f"no point of {device['id']} could be read, skipping it")
+                    continue
+                self.object_graph[device["id"]] = graph
+                await self.save_object_graph()
+
+            except:  # noqa: E722
+                self.logger.critical(
+                    f"ERROR object-list is not available in {device['id']}, skipping it"
                 )
-            )
-            for fs in foundSpecs:
-                await self.mongo.replaceDocument(fs, self.mongo.getDb(), "Points")
+                continue
 
-        else:
-            self.logger.error(
-                "could not commit devices to the database...!", stack_info=True
-            )
+            yield deviceSpec
 
-        self.deviceSpecs.clear()
-        self.object_graph.clear()
+    async def normalize(self, deviceSpec: dict):
+        """Turn a point list into the bulk write of the storage schema, off the loop if large."""
+        operations = await self.offload.call(
+            len(deviceSpec["points"]), "objects", self.store.operations, deviceSpec
+        )
+        return deviceSpec["id"], operations
+
+    async def write(self, writer, item):
+        deviceId, operations = item
+        await writer.submit(self.store.write(operations), key=deviceId)
+        return deviceId
 
+    async def commit(self):
+        """
+        Point lists are written while they are discovered, what is left is to release the
+        object graph of the cycle, which the poller reads back from its pickle.
+        """
+        self.object_graph.clear()
         self.logger.info("point commit completed...")
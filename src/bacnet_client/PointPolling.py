@@ -1,10 +1,32 @@
+import time
+import asyncio
 import logging
-import pickle
+import datetime as dt
+from functools import partial
 from .Device import LocalBacnetDevice
 from .Point import BacnetPoint
+from .PollSharding import PollSupervisor
+from .Partitioning import LeaseManager
+from .Backfill import BackfillService
+from .Networks import NetworkService, activity, network_of
+from .Cache import ValueCache
+from .Samples import SampleBuffer
+from .Rollups import Rollups, documents
+from .Offload import Offloader
+from .PointStore import PointStore
+from .Pipeline import Pipeline
+from .LocalApi import LocalApiService
+from .Metrics import registry, Histogram
 from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
 from bacpypes3.ipv4.app import NormalApplication
-from collections import OrderedDict
+from itertools import islice
+from collections import Counter, OrderedDict
+
+poll_seconds = registry.histogram(
+    "bacnet_poll_cycle_seconds", "Point polling cycle duration", buckets=Histogram.cycle
+)
+poll_devices = registry.gauge("bacnet_poll_devices", "Devices in the last polling cycle")
+sample_bytes = registry.gauge("bacnet_sample_buffer_bytes", "Memory of the recent samples buffer")
 
 
 class PollService(Subscriber):
@@ -14,6 +36,7 @@ class PollService(Subscriber):
     """
 
     __instance = None
+    __isBootup = False
 
     def __init__(self) -> None:
         self.localMgr: LocalManager = LocalManager()
@@ -22,10 +45,34 @@ class PollService(Subscriber):
         self.mongo = None
         self.localDevice = LocalBacnetDevice()
         self.object_graph: dict = {}
-        self.poll_lists = OrderedDict()
-        self.points_specs = OrderedDict()
+        self.pointsPolled = 0
+        self.supervisor: PollSupervisor = None
+        self.leases: LeaseManager = LeaseManager()
+        self.backfill: BackfillService = BackfillService()
+        self.networks: NetworkService = NetworkService()
+        self.cache: ValueCache = ValueCache()
+        self.samples: SampleBuffer = None
+        self.rollups: Rollups = None
+        self.offload: Offloader = Offloader()
+        self.store: PointStore = PointStore()
+        self.cachedDevices: set = set()
+        self.historyReady = False
+        self.rollupsReady = False
         self.logger = logging.getLogger("ClientLog")
-        self.settings = {"section": "point-polling", "enable": None, "interval": None}
+        self.settings = {
+            "section": "point-polling",
+            "enable": None,
+            "interval": None,
+            "workers": 1,
+            "workerport": 47809,
+            "history": False,
+            "status": True,
+            "queuesize": 4,
+            "inflight": 16,
+            "samples": 0,
+            "samplebits": 64,
+            "rollups": False,
+        }
         self.subscribed = False
 
     def __new__(cls):
@@ -42,6 +89,13 @@ class PollService(Subscriber):
                               from {oldvalue} to {self.settings.get(option)}"
             )
 
+    async def warm_start(self, bacapp):
+        """
+        Poll on the first run after startup instead of waiting a full interval, the object
+        graph has already been seeded from the last persisted snapshot.
+        """
+        self.__isBootup = True
+
     async def run(self, bacapp):
         if self.app is None:
             self.app = bacapp.app
@@ -51,6 +105,8 @@ class PollService(Subscriber):
                 self.mongo = bacapp.clients.get("mongodb")
             if self.subscribed is False:
                 bacapp.localMgr.subscribe(self.__instance)
+                LocalApiService().register("/points", self.query_points)
+                LocalApiService().register("/samples", self.query_samples)
                 self.subscribed = True
 
             self.settings["enable"] = self.localMgr.read_setting(
@@ -59,9 +115,40 @@ class PollService(Subscriber):
             self.settings["interval"] = self.localMgr.read_setting(
                 self.settings.get("section"), "interval"
             )
-            if self.scheduler.check_ticket(
-                self.settings.get("section"), interval=self.settings.get("interval")
+            self.settings["workers"] = self.localMgr.read_setting(
+                self.settings.get("section"), "workers", fallback=1
+            )
+            self.settings["workerport"] = self.localMgr.read_setting(
+                self.settings.get("section"), "workerport", fallback=47809
+            )
+            self.settings["history"] = self.localMgr.read_setting(
+                self.settings.get("section"), "history", fallback=False
+            )
+            self.settings["status"] = self.localMgr.read_setting(
+                self.settings.get("section"), "status", fallback=True
+            )
+            self.settings["queuesize"] = self.localMgr.read_setting(
+                self.settings.get("section"), "queuesize", fallback=4
+            )
+            self.settings["inflight"] = self.localMgr.read_setting(
+                self.settings.get("section"), "inflight", fallback=16
+            )
+            self.settings["samples"] = self.localMgr.read_setting(
+                self.settings.get("section"), "samples", fallback=0
+            )
+            self.settings["samplebits"] = self.localMgr.read_setting(
+                self.settings.get("section"), "samplebits", fallback=64
+            )
+            self.settings["rollups"] = self.localMgr.read_setting(
+                self.settings.get("section"), "rollups", fallback=False
+            )
+            if (
+                self.scheduler.check_ticket(
+                    self.settings.get("section"), interval=self.settings.get("interval")
+                )
+                or self.__isBootup
             ):
+                self.__isBootup = False
                 await self.poll()
 
     async def poll(self):
@@ -72,45 +159,277 @@ class PollService(Subscriber):
         database on a user defined time interval
         """
         self.logger.info("point polling started...")
+        activity.set("polling")
+        start = time.perf_counter()
+        backfill = self.backfill.enabled
 
-        await self.load_pointLists()
+        if self.settings.get("workers") > 1:
+            await self.poll_sharded(backfill)
+            if backfill is True:
+                self.backfill.save_state()
+            self.completed(start)
+            return
+        elif self.supervisor is not None:
+            await self.supervisor.stop()
+            self.supervisor = None
 
-        for k, v in self.object_graph.items():
-            self.logger.debug(f"committing poll to db {k}")
-            try:
-                await self.mongo.updateFields(
-                    self.mongo.getDb(),
-                    "Points",
-                    {"id": k},
-                    {"points": self.points_specs[k]},
-                )
-            except:
-                self.logger.error(f"error: {k} not found in {self.points_specs}")
+        try:
+            self.object_graph = await self.load_object_graph()
+        except Exception:
+            self.logger.critical("ERROR Unable to retrieve object graph from file...!")
+            self.object_graph = {}
+        await self.refresh_cache()
+        await self.stream(self.read(), backfill)
+        if backfill is True:
+            self.backfill.save_state()
+        self.completed(start)
+
+    def completed(self, start: float):
+        poll_seconds.observe(time.perf_counter() - start)
+        poll_devices.set(len(self.object_graph))
         self.logger.info("point polling completed...")
 
-    async def load_pointLists(self):
+    async def commit_history(self, deviceId, specs: dict, backfill: bool):
+        """
+        Append this cycle's samples of a device to the History time-series collection when
+        enabled, and report the points that were read to the backfill gap tracker.
+        """
+        if backfill is True:
+            self.backfill.record(deviceId, specs, self.settings.get("interval"))
+        if self.settings.get("history") is not True:
+            return
+        if self.historyReady is not True:
+            await self.mongo.createTimeSeries(
+                self.mongo.getDb(), "History", "timestamp", "meta"
+            )
+            self.historyReady = True
+        timestamp = dt.datetime.now(tz=dt.timezone.utc)
+        samples = [
+            {
+                "timestamp": timestamp,
+                "meta": {"device": deviceId, "point": str(point)},
+                "value": spec.get("value"),
+            }
+            for point, spec in specs.items()
+            if "last synced" in spec
+        ]
+        if len(samples) > 0:
+            await self.mongo.writeDocuments(samples, self.mongo.getDb(), "History")
+
+    async def poll_sharded(self, backfill=False):
+        """
+        Sharded mode: the object graph is split across worker processes, each polling its
+        devices on its own BACnet stack and port, and every device's results are committed
+        as soon as they are streamed back instead of after the whole cycle.
+        """
+        workers = self.settings.get("workers")
+        status = self.settings.get("status")
+        if (
+            self.supervisor is None
+            or self.supervisor.count != workers  # noqa: W503
+            or self.supervisor.status != status  # noqa: W503
+        ):
+            if self.supervisor is not None:
+                await self.supervisor.stop()
+            self.supervisor = PollSupervisor(
+                workers, self.settings.get("workerport"), self.localDevice, status=status
+            )
+
         try:
-            with open(f"{self.localMgr.respath}object-graph.pkl", "rb") as object_graph:
-                self.object_graph: dict = pickle.load(object_graph)
-            for k, v in self.object_graph.items():
-                self.logger.info(f"polling {k}")
-                self.poll_lists[k] = []
-                self.points_specs[k] = OrderedDict()
-
-                for key, value in self.object_graph[k].items():
-                    try:
-                        point: BacnetPoint = BacnetPoint(
-                            self.app, self.localDevice, value, value["point"]
-                        )
-                        await point.update()
+            self.object_graph = await self.load_object_graph()
+        except Exception:
+            self.logger.critical("ERROR Unable to retrieve object graph from file...!")
+            return
+        await self.refresh_cache()
 
-                        self.poll_lists[k].append(point)
-                        self.points_specs[k][point.obj] = point.spec
-                    except:
-                        self.logger.error(f"error: {k}")
+        await self.stream(
+            self.supervisor.poll(self.object_graph, self.settings.get("interval")), backfill
+        )
 
-        except Exception as e:  # noqa: E722
-            self.logger.critical(
-                f"ERROR Unable to retrieve object graph from file OR poll or commit poll...!"
-            )
+    async def stream(self, source, backfill: bool):
+        """
+        Commit each device's poll as soon as it comes out of the source, through a queue of
+        queuesize devices, so a cycle holds the points of the devices in flight instead of
+        a snapshot of every point.
+        """
+        self.pointsPolled = 0
+        now = time.time()
+        self.sample_cycle(now)
+        async with self.mongo.writer() as writer:
+            for snapshot in self.rollup_cycle(now):
+                await writer.submit(self.commit_rollups(snapshot))
+            pipeline = Pipeline("point-polling", self.settings.get("queuesize"))
+            pipeline.stage("write", partial(self.write, writer, backfill))
+            await pipeline.run(source)
+
+    async def write(self, writer, backfill: bool, item):
+        k, points = item
+        self.logger.debug(f"committing poll to db {k}")
+        self.cache.update(k, points)
+        if self.samples is not None:
+            self.samples.record(k, points)
+        if self.rollups is not None:
+            self.rollups.record(k, points)
+        self.pointsPolled += sum(1 for spec in points.values() if "last synced" in spec)
+        await writer.submit(
+            self.store.update_device(k, self.object_graph.get(k, {}), points), key=k
+        )
+        await writer.submit(self.commit_history(k, points, backfill))
+        return k
+
+    def sample_cycle(self, now: float):
+        """
+        Start a cycle of the recent samples buffer, allocated when samples is set and
+        allocated anew (dropping what it held) when samples or samplebits change.
+        """
+        size = self.settings.get("samples")
+        bits = 32 if self.settings.get("samplebits") == 32 else 64
+        if size <= 0:
+            self.samples = None
+            sample_bytes.set(0)
+            return
+        if self.samples is None or self.samples.size != size or self.samples.bits != bits:
+            self.samples = SampleBuffer(size, bits)
+            self.logger.info(f"keeping the last {size} samples of every point")
+        self.samples.advance(now)
+        sample_bytes.set(self.samples.nbytes)
+
+    def rollup_cycle(self, now: float) -> list:
+        """Start a cycle of the rollups when enabled, returning the windows it closed."""
+        if self.settings.get("rollups") is not True:
+            self.rollups = None
+            return []
+        if self.rollups is None:
+            self.rollups = Rollups()
+        return self.rollups.advance(now)
+
+    async def commit_rollups(self, snapshot: tuple):
+        """Write the rollups of a closed window to the Rollups time-series collection at once."""
+        if self.rollupsReady is not True:
+            await self.mongo.createTimeSeries(self.mongo.getDb(), "Rollups", "timestamp", "meta")
+            self.rollupsReady = True
+        rollups = await self.offload.call(len(snapshot[2][0]), "objects", documents, snapshot)
+        if len(rollups) > 0:
+            await self.mongo.writeDocuments(rollups, self.mongo.getDb(), "Rollups")
+
+    async def refresh_cache(self):
+        """
+        Keep the latest-value cache in step with the object graph: devices that left it are
+        dropped, and the point names of the devices that joined it are loaded from the
+        stored point lists.
+        """
+        devices = set(self.object_graph)
+        if devices == self.cachedDevices:
             return
+        for deviceId in self.cachedDevices - devices:
+            self.cache.remove(deviceId)
+            if self.samples is not None:
+                self.samples.remove(deviceId)
+            if self.rollups is not None:
+                self.rollups.remove(deviceId)
+        try:
+            dbPayload = await self.store.load({"id": {"$in": list(devices - self.cachedDevices)}})
+            for device in dbPayload:
+                self.cache.describe(device["id"], device.get("points", {}))
+        except Exception as e:
+            self.logger.warning(f"unable to load point names for the value cache: {e}")
+        self.cachedDevices = devices
+
+    def query_points(self, params: dict) -> dict:
+        """
+        The /points route of the local api. Parameters device, type and prefix may each be
+        given more than once.
+        """
+        points = self.cache.query(
+            devices=params.get("device"),
+            types=params.get("type"),
+            prefixes=params.get("prefix"),
+        )
+        return {"count": len(points), "points": points}
+
+    async def query_samples(self, params: dict) -> dict:
+        """
+        The /samples route of the local api: the count, min, max, avg and last sample of each
+        point over the last window seconds (the whole buffer when window is left out), or the
+        samples of the point given with device and object. Parameter device may be given more
+        than once. The aggregates are reduced on the offloader's pool above its objects
+        threshold, so a large buffer does not hold the event loop up.
+        """
+        if self.samples is None:
+            return {"count": 0, "points": []}
+        seconds = float(params["window"][0]) if "window" in params else None
+        devices = params.get("device")
+        if "object" in params and devices:
+            series = self.samples.series(devices[0], params["object"][0], seconds)
+            return {"count": len(series), "samples": series}
+        keys = None
+        if devices:
+            keys = [key for d in devices for key in sorted(self.samples.byDevice.get(d, ()))]
+        head, rows = self.samples.plan(seconds, keys)
+        aggregates = await self.offload.call(
+            len(rows), "objects", self.samples.summarize, head, rows
+        )
+        points = [
+            {"device": device, "object": obj, **aggregate}
+            for (device, obj), aggregate in sorted(aggregates.items())
+        ]
+        return {"count": len(points), "window": seconds, "points": points}
+
+    async def load_object_graph(self) -> dict:
+        """
+        Load the persisted object graph, keeping only the devices this gateway holds a lease
+        on; the graph may still list devices lost in a rebalance until discovery reruns.
+        """
+        object_graph = await self.offload.load_pickle(f"{self.localMgr.respath}object-graph.pkl")
+        return {k: v for k, v in object_graph.items() if self.leases.owns(k)}
+
+    async def poll_device(self, k) -> tuple:
+        self.logger.info(f"polling {k}")
+        points = OrderedDict()
+
+        for key, value in self.object_graph[k].items():
+            try:
+                point: BacnetPoint = BacnetPoint(
+                    self.app, self.localDevice, value, value["point"]
+                )
+                await point.update(withStatus=self.settings.get("status"))
+
+                points[point.obj] = point.spec
+            except:
+                self.logger.error(f"error: {k}")
+        return k, points
+
+    async def read(self):
+        """Poll the devices of the object graph, yielding each one's points once read."""
+        if self.networks.enabled is True:
+            # devices are polled side by side, each network admitting its own share of
+            # the reads, so the devices of a slow trunk only ever wait on each other; at
+            # most inflight of them, the next one starting once a poll has been handed on
+            devices = iter(list(self.object_graph))
+            tasks = {
+                asyncio.ensure_future(self.poll_device(k))
+                for k in islice(devices, max(1, self.settings.get("inflight")))
+            }
+            try:
+                while tasks:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                        tasks.update(
+                            asyncio.ensure_future(self.poll_device(k))
+                            for k in islice(devices, 1)
+                        )
+            finally:
+                for task in tasks:
+                    task.cancel()
+            self.networks.report(
+                "polling",
+                Counter(
+                    network_of(next(iter(v.values()))["address"])
+                    for v in self.object_graph.values()
+                    if len(v) > 0
+                ),
+            )
+        else:
+            for k in self.object_graph:
+                yield await self.poll_device(k)
@@ -0,0 +1,255 @@
+import sys
+import asyncio
+import logging
+import argparse
+from collections import OrderedDict
+from .MongoClient import Mongodb
+from .SelfManagement import LocalManager, Subscriber
+
+collections = {"device": "Points", "point": "PointRecords", "bucket": "PointBuckets"}
+
+
+def bucket_of(objects, size: int) -> dict:
+    """
+    The bucket of each of a device's objects: objects are sorted by identifier and cut into
+    runs of size, so discovery and polling agree on the layout without storing it.
+    """
+    return {obj: i // size for i, obj in enumerate(sorted(str(o) for o in objects))}
+
+
+def point_documents(deviceSpec: dict) -> list:
+    """One document per point, keyed by the device id and the point's object identifier."""
+    return [
+        {
+            "id": deviceSpec["id"],
+            "point": str(obj),
+            "device name": deviceSpec["name"],
+            "address": deviceSpec["address"],
+            "spec": spec,
+        }
+        for obj, spec in deviceSpec["points"].items()
+    ]
+
+
+def bucket_documents(deviceSpec: dict, size: int) -> list:
+    """The device's points split into buckets of at most size points each."""
+    buckets = bucket_of(deviceSpec["points"], size)
+    documents = [
+        {
+            "id": deviceSpec["id"],
+            "bucket": bucket,
+            "name": deviceSpec["name"],
+            "address": deviceSpec["address"],
+            "points": OrderedDict(),
+        }
+        for bucket in range(len(set(buckets.values())))
+    ]
+    for obj, spec in deviceSpec["points"].items():
+        documents[buckets[str(obj)]]["points"][str(obj)] = spec
+    return documents
+
+
+def device_specs(schema: str, documents: list) -> list:
+    """Reassemble one spec per device, as stored by the device schema, from any schema."""
+    if schema == "device":
+        return documents
+    specs = OrderedDict()
+    for document in documents:
+        spec = specs.setdefault(
+            document["id"],
+            {
+                "id": document["id"],
+                "name": document.get("device name", document.get("name")),
+                "address": document["address"],
+                "points": OrderedDict(),
+            },
+        )
+        if schema == "point":
+            spec["points"][document["point"]] = document.get("spec", {})
+        else:
+            spec["points"].update(document.get("points", {}))
+    return list(specs.values())
+
+
+class PointStore(Subscriber):
+    """
+    Storage of the point lists in MongoDB, in one of three schemas selected with the schema
+    setting. "device" keeps one Points document per device with every point embedded, which
+    big controllers push towards the 16 MB document limit, and every poll rewrites whole. The
+    "point" schema keeps one PointRecords document per point, and "bucket" keeps PointBuckets
+    documents of at most bucketsize points per device, so poll updates touch small documents
+    and single points are found through an index. The migrate entry point copies the point
+    lists from one schema to another.
+    """
+
+    __instance = None
+    __ini_section = "point-storage"
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.mongo: Mongodb = Mongodb()
+        self.settings = {
+            "section": PointStore.__ini_section,
+            "schema": self.localMgr.read_setting(
+                PointStore.__ini_section, "schema", fallback="device"
+            ),
+            "bucketsize": self.localMgr.read_setting(
+                PointStore.__ini_section, "bucketsize", fallback=200
+            ),
+        }
+        self.indexed: set = set()
+        self.logger = logging.getLogger("ClientLog")
+
+        if self.localMgr.initialized is True:
+            self.localMgr.subscribe(self.__instance)
+
+    def __new__(cls):
+        if PointStore.__instance is None:
+            PointStore.__instance = object.__new__(cls)
+        return PointStore.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(f"{section}: {oldvalue} > {self.settings.get(option)}")
+
+    @property
+    def schema(self) -> str:
+        return self.settings.get("schema")
+
+    @property
+    def collection(self) -> str:
+        return collections[self.schema]
+
+    async def ensure_indexes(self, schema: str = None):
+        schema = self.schema if schema is None else schema
+        if schema == "point":
+            keys = [("id", 1), ("point", 1)]
+            await self.mongo.createIndex(self.mongo.getDb(), collections[schema], keys, unique=True)
+        elif schema == "bucket":
+            keys = [("id", 1), ("bucket", 1)]
+            await self.mongo.createIndex(self.mongo.getDb(), collections[schema], keys, unique=True)
+        else:
+            await self.mongo.createIndex(self.mongo.getDb(), collections[schema], [("id", 1)])
+
+    async def prepare(self, schema: str = None):
+        schema = self.schema if schema is None else schema
+        if schema not in self.indexed:
+            await self.ensure_indexes(schema)
+            self.indexed.add(schema)
+
+    def operations(self, deviceSpec: dict, schema: str = None) -> list:
+        """
+        The bulk write that stores a device's discovered point list: the device document (or
+        every point or bucket of the device) is upserted, and under the point and bucket
+        schemas the ones the device no longer has are deleted.
+        """
+        schema = self.schema if schema is None else schema
+        if schema == "device":
+            return [
+                {
+                    "op": "replace",
+                    "filter": {"id": deviceSpec["id"]},
+                    "document": deviceSpec,
+                    "upsert": True,
+                }
+            ]
+        if schema == "point":
+            documents = point_documents(deviceSpec)
+            keys = ("id", "point")
+            points = [document["point"] for document in documents]
+            stale = {"id": deviceSpec["id"], "point": {"$nin": points}}
+        else:
+            documents = bucket_documents(deviceSpec, self.settings.get("bucketsize"))
+            keys = ("id", "bucket")
+            stale = {"id": deviceSpec["id"], "bucket": {"$gte": len(documents)}}
+        operations = [
+            {
+                "op": "replace",
+                "filter": {key: document[key] for key in keys},
+                "document": document,
+                "upsert": True,
+            }
+            for document in documents
+        ]
+        operations.append({"op": "delete", "filter": stale})
+        return operations
+
+    async def write(self, operations: list, schema: str = None):
+        schema = self.schema if schema is None else schema
+        return await self.mongo.bulkWrite(self.mongo.getDb(), collections[schema], operations)
+
+    async def commit(self, deviceSpecs: list, schema: str = None):
+        """Write the discovered point lists of every device."""
+        await self.prepare(schema)
+        for deviceSpec in deviceSpecs:
+            await self.write(self.operations(deviceSpec, schema), schema)
+
+    async def update_device(self, deviceId, objects, specs: dict):
+        """
+        Write one poll of a device. The device schema replaces the embedded points, the other
+        schemas only set the polled fields of each point.
+        """
+        if self.schema == "device":
+            return await self.mongo.updateFields(
+                self.mongo.getDb(), "Points", {"id": deviceId}, {"points": specs}
+            )
+        if self.schema == "point":
+            operations = [
+                {
+                    "op": "update",
+                    "filter": {"id": deviceId, "point": str(obj)},
+                    "update": {"$set": {f"spec.{k}": v for k, v in spec.items()}},
+                }
+                for obj, spec in specs.items()
+                if len(spec) > 0
+            ]
+        else:
+            buckets = bucket_of(objects, self.settings.get("bucketsize"))
+            fields = {}
+            for obj, spec in specs.items():
+                bucket = fields.setdefault(buckets.get(str(obj), 0), {})
+                bucket.update({f"points.{obj}.{k}": v for k, v in spec.items()})
+            operations = [
+                {
+                    "op": "update",
+                    "filter": {"id": deviceId, "bucket": bucket},
+                    "update": {"$set": bucketFields},
+                }
+                for bucket, bucketFields in fields.items()
+                if len(bucketFields) > 0
+            ]
+        return await self.mongo.bulkWrite(self.mongo.getDb(), self.collection, operations)
+
+    async def load(self, query: dict = None, schema: str = None) -> list:
+        """The stored point lists of the devices matching the query, one spec per device."""
+        schema = self.schema if schema is None else schema
+        documents = await self.mongo.findDocuments(
+            self.mongo.getDb(), collections[schema], query=query or {}, projection={"_id": 0}
+        )
+        return device_specs(schema, documents)
+
+    async def migrate(self, source: str, target: str) -> int:
+        """Copy every point list stored in the source schema to the target schema."""
+        deviceSpecs = await self.load(schema=source)
+        await self.commit(deviceSpecs, schema=target)
+        self.logger.info(f"migrated {len(deviceSpecs)} point list(s) from {source} to {target}")
+        return len(deviceSpecs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BACnet Client point storage migration")
+    parser.add_argument("--respath", type=str, help="app's resource directory")
+    parser.add_argument("--source", choices=list(collections), default="device")
+    parser.add_argument("--target", choices=list(collections), required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    migrated = asyncio.run(PointStore().migrate(args.source, args.target))
+    print(f"{migrated} point list(s) migrated to the {args.target} schema")
+    print(f"set schema = {args.target} in the [point-storage] section to use it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import queue
+import asyncio
+import logging
+import ipaddress
+import multiprocessing
+import bson
+import pytz
+from bacpypes3.pdu import IPv4Address
+from bacpypes3.basetypes import Segmentation
+from bacpypes3.ipv4.app import NormalApplication
+from bacpypes3.local.device import DeviceObject
+from .Point import BacnetPoint
+
+
+class ShardDevice:
+    """
+    Stands in for LocalBacnetDevice inside a worker process, where the LocalManager singleton
+    (and the ini watcher it starts) must not exist. Points only need the timezone setting.
+    """
+
+    def __init__(self, settings: dict) -> None:
+        self.settings = dict(settings)
+        self.settings["tz"] = pytz.timezone(settings.get("tz"))
+
+
+class ShardApplication(NormalApplication):
+    """
+    Worker stacks share the gateway's device identity, so only the main stack answers who-is;
+    the workers stay anonymous clients on their own UDP ports.
+    """
+
+    async def do_WhoIsRequest(self, apdu) -> None:
+        pass
+
+
+class PollWorker:
+    """
+    Runs in its own process with its own bacpypes3 stack. Each task is a slice of the object
+    graph; every device in it is polled and its point specs are sent back BSON encoded, so the
+    serialization cost stays in the worker and the supervisor can commit them as they arrive.
+    """
+
+    def __init__(self, shard: int, settings: dict, tasks, results) -> None:
+        self.shard = shard
+        self.settings = settings
+        self.tasks = tasks
+        self.results = results
+        self.app = None
+        self.localDevice = ShardDevice(settings)
+        self.logger = logging.getLogger("ClientLog")
+
+    def create_application(self):
+        deviceObject = DeviceObject(
+            objectIdentifier=("device", self.settings.get("objectIdentifier")),
+            objectName=f"{self.settings.get('objectName')}-shard-{self.shard}",
+            maxApduLengthAccepted=self.settings.get("maxApduLengthAccepted"),
+            segmentationSupported=Segmentation.segmentedBoth,
+            maxSegmentsAccepted=self.settings.get("maxSegmentsAccepted"),
+            vendorIdentifier=self.settings.get("vendorIdentifier"),
+        )
+        return ShardApplication(deviceObject, IPv4Address(self.settings.get("address")))
+
+    async def poll(self, object_graph: dict):
+        for deviceId, edges in object_graph.items():
+            points = {}
+            for edge in edges.values():
+                try:
+                    point = BacnetPoint(self.app, self.localDevice, edge, edge["point"])
+                    await point.update(withStatus=self.settings.get("status"))
+                    points[point.obj] = point.spec
+                except Exception as e:
+                    self.logger.error(f"shard {self.shard} error: {deviceId} {e}")
+            self.results.put(("device", self.shard, deviceId, bson.encode(points)))
+
+    async def run(self):
+        self.app = self.create_application()
+        loop = asyncio.get_running_loop()
+        while True:
+            object_graph = await loop.run_in_executor(None, self.tasks.get)
+            if object_graph is None:
+                break
+            try:
+                await self.poll(object_graph)
+            finally:
+                self.results.put(("done", self.shard, None, None))
+        self.app.close()
+
+
+def run_worker(shard: int, settings: dict, tasks, results):
+    asyncio.run(PollWorker(shard, settings, tasks, results).run())
+
+
+class PollSupervisor:
+    """
+    Partitions the devices of the object graph across worker processes and merges the results
+    they stream back over one shared queue. Devices are assigned largest-first to the least
+    loaded shard by point count, so shards stay balanced when device sizes differ a lot.
+    """
+
+    def __init__(self, workers: int, port: int, localDevice, status=True) -> None:
+        self.count = workers
+        self.port = port
+        self.status = status
+        self.localDevice = localDevice
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.workers = []
+        self.logger = logging.getLogger("ClientLog")
+
+    def worker_settings(self, shard: int) -> dict:
+        settings = self.localDevice.settings
+        interface = str(settings.get("interface")).split(":")[0]
+        network = ipaddress.IPv4Interface(interface)
+        return {
+            "objectIdentifier": settings.get("objectIdentifier"),
+            "objectName": settings.get("objectName"),
+            "vendorIdentifier": settings.get("vendorIdentifier"),
+            "maxApduLengthAccepted": settings.get("maxApduLengthAccepted"),
+            "maxSegmentsAccepted": settings.get("maxSegmentsAccepted"),
+            "tz": str(settings.get("tz")),
+            "address": f"{network.ip}/{network.network.prefixlen}:{self.port + shard}",
+            "status": self.status,
+        }
+
+    def start(self):
+        for shard in range(self.count):
+            if shard < len(self.workers) and self.workers[shard][0].is_alive():
+                continue
+            tasks = self.context.Queue()
+            process = self.context.Process(
+                target=run_worker,
+                args=(shard, self.worker_settings(shard), tasks, self.results),
+                name=f"poll-shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            if shard < len(self.workers):
+                self.logger.warning(f"restarted poll worker {shard}")
+                self.workers[shard] = (process, tasks)
+            else:
+                self.workers.append((process, tasks))
+
+    async def stop(self, stuck=()):
+        """
+        Stop every worker: the ones listed as stuck are terminated, the others finish their
+        task and exit on the sentinel. The processes are joined on a thread, off the loop.
+        """
+        for shard, (process, tasks) in enumerate(self.workers):
+            if shard not in stuck:
+                tasks.put(None)
+        await asyncio.to_thread(self.join, set(stuck))
+        self.workers.clear()
+
+    def join(self, stuck: set):
+        for shard, (process, tasks) in enumerate(self.workers):
+            if shard in stuck:
+                process.terminate()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def partition(self, object_graph: dict) -> list:
+        shards = [{} for _ in range(self.count)]
+        loads = [0] * self.count
+        for deviceId in sorted(object_graph, key=lambda k: len(object_graph[k]), reverse=True):
+            shard = loads.index(min(loads))
+            shards[shard][deviceId] = object_graph[deviceId]
+            loads[shard] += len(object_graph[deviceId])
+        return shards
+
+    async def poll(self, object_graph: dict, timeout: float):
+        """
+        Hand every worker its slice of the graph, then yield (device id, point specs) as the
+        results come back. A cycle ends when all workers are done, or when no result arrived
+        within the timeout, in which case the workers are replaced before the next one.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        pending = set()
+        for shard, graph in enumerate(self.partition(object_graph)):
+            self.workers[shard][1].put(graph)
+            pending.add(shard)
+
+        while len(pending) > 0:
+            try:
+                kind, shard, deviceId, payload = await loop.run_in_executor(
+                    None, self.results.get, True, timeout
+                )
+            except queue.Empty:
+                # A process stopped while writing to the shared results queue can leave it
+                # corrupted for the others, so every worker is stopped and the next cycle
+                # starts them again on a new queue.
+                self.logger.error(f"poll workers {pending} timed out, restarting them")
+                await self.stop(stuck=pending)
+                self.results = self.context.Queue()
+                break
+            if kind == "done":
+                pending.discard(shard)
+            else:
+                yield deviceId, bson.decode(payload)
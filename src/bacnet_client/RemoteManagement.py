@@ -1,11 +1,15 @@
+import io
 import logging
+import os
 import json
 import traceback
 import asyncio
 from collections import OrderedDict, deque
+from bson import json_util
 from .MongoClient import Mongodb
 from abc import ABC, abstractmethod
 from .SelfManagement import LocalManager, ServiceScheduler
+from .Offload import Offloader
 
 
 class Composite(ABC):
@@ -60,14 +64,25 @@ class Configuration(Composite):
 
 
 class EventManager:
-    """ " """
+    """
+    Buffers remote configuration change events and applies them in coalesced batches. Every
+    event that arrives within the coalescing window of the first one is merged into a single
+    ini write followed by a single targeted sync of only the options that changed. The resume
+    token of the last event in each applied batch is persisted so a restarted client picks the
+    change stream up where it left off.
+    """
 
     __instance = None
+    __window = 0.5  # seconds
 
     def __init__(self) -> None:
         self.store = deque()
         self.localMgr = None
         self.localConfig = None
+        self.window = EventManager.__window
+        self.pending = None
+        self.tokenPath = None
+        self.offload: Offloader = Offloader()
         self.logger = logging.getLogger("ClientLog")
 
     def __new__(cls):
@@ -85,29 +100,144 @@ class EventManager:
             )
         except:
             self.logger.error("error...")
-        asyncio.get_running_loop().call_soon(self.process)
+        if self.pending is None:
+            self.pending = asyncio.ensure_future(self.process())
 
-    def process(self):
+    async def process(self):
+        await asyncio.sleep(self.window)
+        self.pending = None
+        changes = OrderedDict()
+        token = None
         while len(self.store) > 0:
             try:
-                event = self.store.pop()
+                event = self.store.popleft()
+                token = event.get("_id", token)
                 update: dict = event["updateDescription"]["updatedFields"]
                 self.logger.debug(f"update-fields: {update}")
                 for k, v in update.items():
-                    section = k.split(".")[0]
-                    option = k.split(".")[1]
-                    self.localConfig[section][option] = v
-                    self.localMgr.config.set(section, option, v)
-                with open(
-                    f"{self.localMgr.respath}local-device.ini", "w"
-                ) as configFile:
-                    self.localMgr.config.write(configFile)
+                    change = self.validate(k, v)
+                    if change is not None:
+                        changes[change] = v
             except Exception as e:
                 self.logger.error({e})
                 traceback.print_exc()
             except:
                 self.logger.error("error...")
 
+        if len(changes) == 0:
+            if token is not None:
+                self.save_resume_token(token)
+            return
+
+        self.logger.debug(f"coalesced {len(changes)} configuration change(s)")
+        if await self.apply(changes) is True:
+            self.localMgr.sync_options(changes)
+            if token is not None:
+                self.save_resume_token(token)
+
+    async def apply(self, changes: dict) -> bool:
+        """Write the changes, keyed by (section, option), to the ini in a single write."""
+        try:
+            for (section, option), v in changes.items():
+                self.localConfig[section][option] = v
+                self.localMgr.config.set(section, option, str(v))
+            configFile = io.StringIO()
+            self.localMgr.config.write(configFile)
+            await self.offload.write_text(
+                configFile.getvalue(), f"{self.localMgr.respath}local-device.ini"
+            )
+            return True
+        except Exception as e:
+            self.logger.error({e})
+            traceback.print_exc()
+        except:
+            self.logger.error("error...")
+        return False
+
+    async def resync(self, mongo):
+        """
+        Catch up with the remote configuration after the change stream lost its place: the
+        Configuration document is fetched again, every option that differs from the ini is
+        written to it, and a full sync notifies the subscribers of whatever changed.
+        """
+        nukid = self.localConfig["device"]["nukid"]
+        try:
+            remoteConfig = await mongo.findDocument(
+                mongo.getDb(), "Configuration", {"device.nukid": nukid}
+            )
+        except Exception as e:
+            self.logger.error(f"unable to fetch the remote configuration: {e}")
+            return
+        if remoteConfig is None:
+            return
+        changes = OrderedDict()
+        for section, options in remoteConfig.items():
+            if not isinstance(options, dict):
+                continue
+            for option, value in options.items():
+                change = self.validate(f"{section}.{option}", value)
+                current = self.localMgr.config.get(section, option, fallback=None)
+                if change is not None and str(value) != current:
+                    changes[change] = value
+        if len(changes) > 0 and await self.apply(changes) is not True:
+            return
+        self.localMgr.sync()
+        self.logger.info(f"resynced {len(changes)} remote configuration change(s)")
+
+    def validate(self, field: str, value):
+        """
+        The (section, option) a changed field of the Configuration document maps to, or None
+        when the change can not be applied: a field that is not section.option, a section
+        missing from the ini, or a value that is not a scalar. Only that change is skipped.
+        """
+        keys = field.split(".")
+        if len(keys) != 2:
+            self.logger.warning(f"skipping configuration change of {field}: not section.option")
+            return None
+        if self.localMgr.config.has_section(keys[0]) is not True or keys[0] not in self.localConfig:
+            self.logger.warning(f"skipping configuration change of {field}: unknown section")
+            return None
+        if not isinstance(value, (str, int, float, bool)):
+            self.logger.warning(
+                f"skipping configuration change of {field}: {type(value).__name__} value"
+            )
+            return None
+        return keys[0], keys[1]
+
+    def load_resume_token(self):
+        """
+        Return the change stream resume token persisted by the last applied batch, or None
+        when there is no usable token on disk.
+        """
+        try:
+            with open(self.tokenPath, "r") as tokenFile:
+                return json_util.loads(tokenFile.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.error(f"unable to read resume token {self.tokenPath}: {e}")
+            return None
+
+    def save_resume_token(self, token):
+        """
+        Persist the resume token atomically so a crash mid-write never leaves a torn file.
+        """
+        try:
+            tmpPath = f"{self.tokenPath}.tmp"
+            with open(tmpPath, "w") as tokenFile:
+                tokenFile.write(json_util.dumps(token))
+            os.replace(tmpPath, self.tokenPath)
+        except Exception as e:
+            self.logger.error(f"unable to persist resume token {self.tokenPath}: {e}")
+
+    def clear_resume_token(self):
+        try:
+            os.remove(self.tokenPath)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.error(f"unable to remove resume token {self.tokenPath}: {e}")
+
 
 class ScheduledUpdateManager:
     """
@@ -147,26 +277,36 @@ class ScheduledUpdateManager:
                 self.eventMgr = EventManager()
                 self.eventMgr.localMgr = self.localMgr
                 self.eventMgr.localConfig = localConfig
+                self.eventMgr.tokenPath = f"{self.localMgr.respath}resume-token.json"
                 nukid = localConfig["device"]["nukid"]
                 pipeline = [{"$match": {"operationType": "update"}}]
 
-                try:
-                    remoteConfig = await self.mongo.findDocument(
-                        self.mongo.getDb(), "Configuration", {"device.nukid": nukid}
-                    )
-                except:
-                    remoteConfig = None
-                    self.logger.error(f"remote configuration not found: {remoteConfig}")
-
-                if remoteConfig is None:
-                    await self.mongo.writeDocument(
-                        localConfig, self.mongo.getDb(), "Configuration"
-                    )
-                    await self.mongo.watch_collection(
-                        self.mongo.getDb(), "Configuration", pipeline, self.eventMgr
-                    )
+                # A persisted resume token proves the remote document already exists, and
+                # resuming from it replays every change missed while the client was down.
+                resumeToken = self.eventMgr.load_resume_token()
+                if resumeToken is None:
+                    try:
+                        remoteConfig = await self.mongo.findDocument(
+                            self.mongo.getDb(), "Configuration", {"device.nukid": nukid}
+                        )
+                    except:
+                        remoteConfig = None
+                        self.logger.error(
+                            f"remote configuration not found: {remoteConfig}"
+                        )
+
+                    if remoteConfig is None:
+                        await self.mongo.writeDocument(
+                            localConfig, self.mongo.getDb(), "Configuration"
+                        )
+                    self.logger.debug(f"remote configuration: {remoteConfig}")
                 else:
-                    await self.mongo.watch_collection(
-                        self.mongo.getDb(), "Configuration", pipeline, self.eventMgr
-                    )
-                self.logger.debug(f"remote configuration: {remoteConfig}")
+                    self.logger.info("resuming remote configuration change stream...")
+
+                await self.mongo.watch_collection(
+                    self.mongo.getDb(),
+                    "Configuration",
+                    pipeline,
+                    self.eventMgr,
+                    resume_token=resumeToken,
+                )
@@ -0,0 +1,171 @@
+import math
+import datetime as dt
+from array import array
+from operator import add
+from .Samples import number
+
+# (name, seconds) of the rollup windows, each a multiple of the one before
+windows = (("1m", 60), ("15m", 900), ("1h", 3600))
+
+
+class Window:
+    """The running count, min, max and sum of every point over one rollup window."""
+
+    def __init__(self, name: str, seconds: int) -> None:
+        self.name = name
+        self.seconds = seconds
+        self.bucket = None
+        self.count = array("q")
+        self.min = array("d")
+        self.max = array("d")
+        self.sum = array("d")
+
+    def grow(self):
+        self.count.append(0)
+        self.min.append(math.inf)
+        self.max.append(-math.inf)
+        self.sum.append(0.0)
+
+    def clear(self, row: int = None):
+        if row is None:
+            rows = len(self.count)
+            self.count = array("q", bytes(8 * rows))
+            self.min = array("d", [math.inf]) * rows
+            self.max = array("d", [-math.inf]) * rows
+            self.sum = array("d", bytes(8 * rows))
+        else:
+            self.count[row], self.min[row], self.max[row], self.sum[row] = 0, math.inf, -math.inf, 0
+
+    def fold(self, count, low, high, total):
+        """Fold the aggregates of a cycle, or of a closed shorter window, into the window."""
+        self.count = array("q", map(add, self.count, count))
+        self.min = array("d", map(min, self.min, low))
+        self.max = array("d", map(max, self.max, high))
+        self.sum = array("d", map(add, self.sum, total))
+
+
+class Rollups:
+    """
+    Running rollups of every polled point over 1 minute, 15 minute and 1 hour windows,
+    aligned to the clock. A poll's samples are written to per-cycle arrays with one slot per
+    point (a value, or NaN when the point was not read), and when the next cycle starts the
+    whole cycle is folded into the minute window at once, array against array. A closed
+    window is folded the same way into the next longer one, so each sample is only handled
+    individually once. Samples count towards the windows of the time their cycle started,
+    and a window closes with the first cycle started past its end. Rows freed by devices
+    that left are reused by new points.
+    """
+
+    def __init__(self) -> None:
+        self.windows = [Window(name, seconds) for name, seconds in windows]
+        self.rows: dict = {}
+        self.keys: list = []
+        self.byDevice: dict = {}
+        self.free: list = []
+        self.values = array("d")
+        self.addends = array("d")
+        self.seen = bytearray()
+        self.latest = array("d")
+        self.timestamp = None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def row(self, deviceId, obj) -> int:
+        key = (str(deviceId), str(obj))
+        row = self.rows.get(key)
+        if row is None:
+            if len(self.free) > 0:
+                row = self.free.pop()
+                self.keys[row] = key
+                for window in self.windows:
+                    window.clear(row)
+            else:
+                row = len(self.keys)
+                self.keys.append(key)
+                for window in self.windows:
+                    window.grow()
+                self.values.append(math.nan)
+                self.addends.append(0.0)
+                self.seen.append(0)
+                self.latest.append(math.nan)
+            self.rows[key] = row
+            self.byDevice.setdefault(key[0], set()).add(key)
+        return row
+
+    def record(self, deviceId, specs: dict):
+        """Sample the points of a device that were read in the current cycle."""
+        if self.timestamp is None:
+            return
+        for obj, spec in specs.items():
+            if "last synced" not in spec:
+                continue
+            value = number(spec.get("value"))
+            if value is None:
+                continue
+            row = self.row(deviceId, obj)
+            self.values[row] = self.addends[row] = self.latest[row] = value
+            self.seen[row] = 1
+
+    def remove(self, deviceId):
+        for key in self.byDevice.pop(str(deviceId), set()):
+            row = self.rows.pop(key)
+            self.keys[row] = None
+            self.values[row], self.addends[row], self.seen[row] = math.nan, 0.0, 0
+            self.free.append(row)
+
+    def advance(self, timestamp: float) -> list:
+        """
+        Start a poll cycle: fold the last cycle into the minute window, and close every
+        window the new cycle falls past. Returns the (window, start, columns) snapshot of each
+        closed window, for documents() to turn into the rollup documents.
+        """
+        if self.timestamp is not None:
+            self.windows[0].fold(self.seen, self.values, self.values, self.addends)
+        closed = []
+        for i, window in enumerate(self.windows):
+            bucket = int(timestamp // window.seconds)
+            if window.bucket is not None and bucket != window.bucket:
+                closed.append(self.close(i))
+            window.bucket = bucket
+        rows = len(self.keys)
+        self.values = array("d", [math.nan]) * rows
+        self.addends = array("d", bytes(8 * rows))
+        self.seen = bytearray(rows)
+        self.timestamp = timestamp
+        return closed
+
+    def close(self, i: int) -> tuple:
+        window = self.windows[i]
+        if i + 1 < len(self.windows):
+            self.windows[i + 1].fold(window.count, window.min, window.max, window.sum)
+        columns = (
+            list(self.keys),
+            window.count,
+            window.min,
+            window.max,
+            window.sum,
+            array("d", self.latest),
+        )
+        window.clear()
+        return window.name, window.bucket * window.seconds, columns
+
+
+def documents(snapshot: tuple) -> list:
+    """The rollup documents of a closed window, one per point sampled in it."""
+    name, start, (keys, count, low, high, total, last) = snapshot
+    timestamp = dt.datetime.fromtimestamp(start, tz=dt.timezone.utc)
+    return [
+        {
+            "timestamp": timestamp,
+            "meta": {"device": key[0], "point": key[1], "window": name},
+            "count": n,
+            "min": lo,
+            "max": hi,
+            "sum": s,
+            "avg": s / n,
+            "last": la,
+        }
+        for key, n, lo, hi, s, la in zip(keys, count, low, high, total, last)
+        if n > 0 and key is not None
+    ]
@@ -0,0 +1,168 @@
+import math
+from array import array
+
+
+def number(value):
+    """The sample value of a present value: numbers as they are, binary states as 0 or 1."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if str(value) in ("active", "inactive"):
+        return float(str(value) == "active")
+    return None
+
+
+class SampleBuffer:
+    """
+    The last size samples of every polled point, for local trending and analytics without a
+    round trip to the database. Samples are not kept as Python objects but in preallocated
+    arrays: one row of size values per point, rows laid out one after the other, and one
+    row of sample times shared by every point, since a poll cycle samples all of them. Each
+    cycle advances the shared index, carrying every point's last value into the new slot in
+    a single strided copy, so a point that failed to read keeps its last value. Memory is
+    fixed at size values per point (8 bytes each, or 4 with 32 bit samples) plus the shared
+    times: 100k points of 1000 samples take 800 MB, or 400 MB. Rows freed by devices that
+    left are reused by new points.
+    """
+
+    def __init__(self, size: int, bits: int = 64) -> None:
+        self.size = max(1, size)
+        self.bits = 32 if bits == 32 else 64
+        self.typecode = "f" if self.bits == 32 else "d"
+        self.blank = array(self.typecode, [math.nan]) * self.size
+        self.values = array(self.typecode)
+        self.times = array("d", [math.nan]) * self.size
+        self.first = array("q")  # the cycle of each row's first sample
+        self.rows: dict = {}
+        self.byDevice: dict = {}
+        self.free: list = []
+        self.head = 0
+        self.cycles = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.itemsize * len(a) for a in (self.values, self.times, self.first))
+
+    def advance(self, timestamp: float):
+        """Start a poll cycle: the slot after the current one becomes the current slot."""
+        if self.cycles > 0:
+            following = (self.head + 1) % self.size
+            self.values[following :: self.size] = self.values[self.head :: self.size]
+            self.head = following
+        self.times[self.head] = timestamp
+        self.cycles += 1
+
+    def row(self, deviceId, obj) -> int:
+        key = (str(deviceId), str(obj))
+        row = self.rows.get(key)
+        if row is None:
+            if len(self.free) > 0:
+                row = self.free.pop()
+                self.values[row * self.size : (row + 1) * self.size] = self.blank
+            else:
+                row = len(self.first)
+                self.values.extend(self.blank)
+                self.first.append(0)
+            self.first[row] = self.cycles
+            self.rows[key] = row
+            self.byDevice.setdefault(key[0], set()).add(key)
+        return row
+
+    def record(self, deviceId, specs: dict):
+        """Sample the points of a device that were read in the current cycle."""
+        if self.cycles == 0:
+            return
+        for obj, spec in specs.items():
+            if "last synced" not in spec:
+                continue
+            value = number(spec.get("value"))
+            if value is not None:
+                self.values[self.row(deviceId, obj) * self.size + self.head] = value
+
+    def remove(self, deviceId):
+        for key in self.byDevice.pop(str(deviceId), set()):
+            self.free.append(self.rows.pop(key))
+
+    def window(self, seconds: float = None) -> int:
+        """The number of latest samples taken within seconds of the last one."""
+        count = min(self.cycles, self.size)
+        if seconds is None or count == 0:
+            return count
+        cutoff = self.times[self.head] - seconds
+        for n in range(count):
+            if self.times[(self.head - n) % self.size] < cutoff:
+                return n
+        return count
+
+    def segments(self, view, row: int, n: int, head: int = None) -> list:
+        """
+        The last n samples of a row up to the head slot (the current one by default), oldest
+        first, as one or two slices of the view, or copies when given the array itself.
+        """
+        head = self.head if head is None else head
+        base = row * self.size
+        start = (head - n + 1) % self.size
+        if start <= head:
+            return [view[base + start : base + head + 1]]
+        return [view[base + start : base + self.size], view[base : base + head + 1]]
+
+    def plan(self, seconds: float = None, keys=None) -> tuple:
+        """
+        What an aggregate reads: the head slot, and the (key, row, samples) of every point
+        (or of the given (device, object) keys) sampled within the window.
+        """
+        window = self.window(seconds)
+        rows = []
+        for key in self.rows if keys is None else keys:
+            row = self.rows.get(key)
+            if row is None:
+                continue
+            n = min(window, self.cycles - self.first[row] + 1)
+            if n > 0:
+                rows.append((key, row, n))
+        return self.head, rows
+
+    def aggregate(self, seconds: float = None, keys=None) -> dict:
+        """
+        The count, min, max, avg and last sample of every point (or of the given (device,
+        object) keys) over the window. Each row's window is reduced by the builtins straight
+        from the array's memory, without copying it into Python lists first.
+        """
+        head, rows = self.plan(seconds, keys)
+        with memoryview(self.values) as view:
+            return {key: self.reduce(self.segments(view, row, n, head), n) for key, row, n in rows}
+
+    def summarize(self, head: int, rows: list) -> dict:
+        """
+        The aggregates of a plan, safe to compute on another thread while polling goes on:
+        each row's window is sliced out of the array, as a memoryview held meanwhile would
+        keep the poller from growing the array for new points.
+        """
+        return {
+            key: self.reduce(self.segments(self.values, row, n, head), n) for key, row, n in rows
+        }
+
+    def reduce(self, segments: list, n: int) -> dict:
+        if len(segments) == 1:
+            low, high, total = min(segments[0]), max(segments[0]), sum(segments[0])
+        else:
+            low = min(map(min, segments))
+            high = max(map(max, segments))
+            total = sum(map(sum, segments))
+        return {"count": n, "min": low, "max": high, "avg": total / n, "last": segments[-1][-1]}
+
+    def series(self, deviceId, obj, seconds: float = None) -> list:
+        """The (time, value) samples of one point over the window, oldest first."""
+        row = self.rows.get((str(deviceId), str(obj)))
+        if row is None:
+            return []
+        n = min(self.window(seconds), self.cycles - self.first[row] + 1)
+        if n <= 0:
+            return []
+        with memoryview(self.values) as view:
+            values = [v for s in self.segments(view, row, n) for v in s]
+        with memoryview(self.times) as view:
+            times = [t for s in self.segments(view, 0, n) for t in s]
+        return list(zip(times, values))
@@ -1,3 +1,4 @@
+import os
 import asyncio
 import datetime
 import pytz
@@ -7,6 +8,19 @@ import argparse
 import configparser
 from abc import ABC, abstractmethod
 from enum import Enum
+from .Metrics import registry, Histogram
+
+ticket_lateness = registry.histogram(
+    "scheduler_ticket_lateness_seconds",
+    "How long after its ticket expired a service started its next cycle",
+    ("section",),
+    Histogram.latency,
+)
+scheduler_overruns = registry.counter(
+    "scheduler_overruns_total",
+    "Cycles started late because the previous cycle outlasted its interval",
+    ("section",),
+)
 
 
 class LogLevel(Enum):
@@ -34,8 +48,10 @@ class LocalManager(object):
 
         parser = argparse.ArgumentParser(description="BACnet Client")
         parser.add_argument("--respath", type=str, help="app's resource directory")
-        self.respath: str = parser.parse_args().respath
+        # other entry points (simulator, benchmark) bring their own arguments
+        self.respath: str = parser.parse_known_args()[0].respath
         self.config = configparser.ConfigParser()
+        self.configVersion = None
         self.initialized = False
         self.options = []
         self.subscribers = []
@@ -85,7 +101,7 @@ class LocalManager(object):
         Initialize the in-memory configuration state. Flatten the configuration tree, into a
         list of Option objects with their corresponding attributes.
         """
-        self.config.read(f"{self.respath}local-device.ini")
+        self.reload()
         sections = self.config.sections()
         for section in sections:
             options = self.config.options(section)
@@ -94,8 +110,29 @@ class LocalManager(object):
                 self.options.append(Option(section, option, value))
         self.initialized = True
 
-    def read_setting(self, section, prop):
-        self.config.read(f"{self.respath}local-device.ini")
+    def reload(self):
+        """
+        Re-read the ini file when it changed since the last read. Services read their
+        settings on every cycle, so the file is only parsed again when its modification
+        time or size moved, and otherwise costs a stat.
+        """
+        try:
+            stat = os.stat(f"{self.respath}local-device.ini")
+            version = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            version = None
+        if version is None or version != self.configVersion:
+            self.config.read(f"{self.respath}local-device.ini")
+            self.configVersion = version
+
+    def read_setting(self, section, prop, fallback=None):
+        """
+        Read a typed setting from the ini file. When a fallback is given it is returned for
+        settings that are not present, so optional settings do not require an ini migration.
+        """
+        self.reload()
+        if fallback is not None and not self.config.has_option(section, prop):
+            return fallback
         setting = self.set_type(self.config.get(section, prop))
         return setting
 
@@ -155,13 +192,37 @@ class LocalManager(object):
         """
         This function runs inside process_io_deltas'. It does the
         actual work of traversing the document tree and checking each option's mem/io delta
-        and notifying all the subscribers to options with active deltas.
+        and notifying all the subscribers to options with active deltas. Options whose value
+        did not change are skipped.
         """
         self.logger.info("Performing configuration sync")
-        self.config.read(f"{self.respath}local-device.ini")
+        self.reload()
         for option in self.options:
             self.logger.debug(f"{option.section} {option.option} {option.value}")
             update = self.set_type(self.config.get(option.section, option.option))
+            if update != option.value:
+                option.value = update
+                self.notify(option, update)
+
+    def sync_options(self, changes: dict):
+        """
+        Targeted sync for a known set of changed options keyed by (section, option). Only the
+        subscribers to those options are notified, and the in-memory option state is updated
+        first so the inotify event raised by the same ini write finds no deltas left to sync.
+        """
+        self.logger.info(f"Performing targeted configuration sync of {len(changes)} option(s)")
+        for (section, prop), value in changes.items():
+            prop = self.config.optionxform(prop)
+            update = self.set_type(str(value))
+            option = next(
+                (o for o in self.options if o.section == section and o.option == prop),
+                None,
+            )
+            if option is None:
+                option = Option(section, prop, update)
+                self.options.append(option)
+            elif option.value == update:
+                continue
             option.value = update
             self.notify(option, update)
 
@@ -249,6 +310,7 @@ class ServiceScheduler(Subscriber):
     __ISO8601 = "%Y-%m-%dT%H:%M:%S%z"
     __instance = None
     __ini_section = "device"
+    __overrun = 2  # seconds, the application loop checks tickets every second
 
     def __init__(self) -> None:
         self.localMgr: LocalManager = LocalManager()
@@ -295,6 +357,10 @@ class ServiceScheduler(Subscriber):
             self.create_ticket(section, interval)
         else:
             if ticket[1] <= now:
+                if interval is not None and ticket[2] == "active":
+                    ticket_lateness.observe(now - ticket[1], section=section)
+                    if now - ticket[1] > ServiceScheduler.__overrun:
+                        scheduler_overruns.inc(section=section)
                 ticket[2] = "expired"
                 self.expired_tickets.append(section)
                 valid = True
@@ -0,0 +1,499 @@
+import sys
+import copy
+import random
+import asyncio
+import logging
+import argparse
+import ipaddress
+import datetime as dt
+import multiprocessing
+from collections import defaultdict
+from bacpypes3.pdu import PDU, IPv4Address, LocalBroadcast
+from bacpypes3.ipv4.app import NormalApplication
+from bacpypes3.apdu import ReadRangeACK
+from bacpypes3.errors import ExecutionError
+from bacpypes3.object import TrendLogObject
+from bacpypes3.constructeddata import ListOf
+from bacpypes3.primitivedata import Date, Time
+from bacpypes3.basetypes import (
+    Segmentation,
+    DateTime,
+    DeviceObjectPropertyReference,
+    LogRecord,
+    LogRecordLogDatum,
+    ResultFlags,
+)
+from bacpypes3.local.device import DeviceObject
+from bacpypes3.local.analog import AnalogInputObject, AnalogValueObject
+from bacpypes3.local.binary import BinaryInputObject, BinaryValueObject
+from bacpypes3.local.multistate import MultiStateValueObject
+
+
+class SimulatedApplication(NormalApplication):
+    """
+    A bacpypes3 normal application that impairs the services the client relies on. Requests
+    are dropped with the configured loss probability (the client sees a timeout) and delayed
+    by the configured latency with +/- 50% jitter before being answered.
+    """
+
+    def __init__(self, device_object, local_address, latency=0.0, loss=0.0) -> None:
+        super().__init__(device_object, local_address)
+        self.latency = latency
+        self.loss = loss
+
+    async def impair(self) -> bool:
+        if self.loss > 0 and random.random() < self.loss:
+            return False
+        if self.latency > 0:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        return True
+
+    async def do_WhoIsRequest(self, apdu) -> None:
+        if await self.impair():
+            await super().do_WhoIsRequest(apdu)
+
+    async def do_ReadPropertyRequest(self, apdu) -> None:
+        if await self.impair():
+            await super().do_ReadPropertyRequest(apdu)
+
+    async def do_ReadPropertyMultipleRequest(self, apdu) -> None:
+        if await self.impair():
+            await super().do_ReadPropertyMultipleRequest(apdu)
+
+    @classmethod
+    def sortable(cls, timestamp) -> tuple:
+        return tuple(timestamp.date[:3]) + tuple(timestamp.time)
+
+    async def do_ReadRangeRequest(self, apdu) -> None:
+        """
+        bacpypes3 does not serve ReadRange, answer it for the simulated trend logs by position,
+        by sequence number and by time.
+        """
+        if not await self.impair():
+            return
+        obj = self.get_object_id(apdu.objectIdentifier)
+        if not isinstance(obj, TrendLogObject):
+            raise ExecutionError(errorClass="object", errorCode="unknownObject")
+        buffer = list(obj.logBuffer)
+        oldest = obj.totalRecordCount - len(buffer) + 1
+        if apdu.range is not None and apdu.range.bySequenceNumber is not None:
+            reference = apdu.range.bySequenceNumber.referenceSequenceNumber
+            count = apdu.range.bySequenceNumber.count
+            start = max(reference, oldest) - oldest
+        elif apdu.range is not None and apdu.range.byTime is not None:
+            reference = self.sortable(apdu.range.byTime.referenceTime)
+            count = apdu.range.byTime.count
+            start = len(buffer)
+            for i, record in enumerate(buffer):
+                if self.sortable(record.timestamp) >= reference:
+                    start = i
+                    break
+        elif apdu.range is not None and apdu.range.byPosition is not None:
+            count = apdu.range.byPosition.count
+            start = apdu.range.byPosition.referenceIndex - 1
+        else:
+            start, count = 0, len(buffer)
+        if count < 0:
+            start, count = max(0, start + count + 1), -count
+        items = buffer[start : start + count]
+        await self.response(
+            ReadRangeACK(
+                objectIdentifier=apdu.objectIdentifier,
+                propertyIdentifier=apdu.propertyIdentifier,
+                resultFlags=ResultFlags(
+                    [
+                        int(start == 0),
+                        int(start + len(items) >= len(buffer)),
+                        int(start + len(items) < len(buffer)),
+                    ]
+                ),
+                itemCount=len(items),
+                itemData=ListOf(LogRecord)(items),
+                firstSequenceNumber=oldest + start if len(items) > 0 else None,
+                context=apdu,
+            )
+        )
+
+
+class SimulatedDevice:
+    """
+    A virtual controller with a fixed set of analog, binary and multi-state objects carrying
+    every property the point builders read. The object kinds rotate through the list below so
+    any point count yields a realistic mix. Objects are shallow copies of one template per kind
+    since constructing bacpypes3 objects from keyword arguments dominates start-up time.
+    """
+
+    __kinds = (
+        "analog-value",
+        "analog-input",
+        "binary-value",
+        "binary-input",
+        "multi-state-value",
+    )
+    __states = ["off", "low", "medium", "high"]
+    __templates = {}
+
+    def __init__(
+        self,
+        instance: int,
+        address: str,
+        points: int,
+        segmentation=Segmentation.segmentedBoth,
+        maxApdu=1476,
+        latency=0.0,
+        loss=0.0,
+        trends=0,
+        bufferSize=1000,
+    ) -> None:
+        self.instance = instance
+        self.address = address
+        self.deviceObject = DeviceObject(
+            objectIdentifier=("device", instance),
+            objectName=f"sim-device-{instance}",
+            maxApduLengthAccepted=maxApdu,
+            segmentationSupported=segmentation,
+            maxSegmentsAccepted=64,
+            vendorIdentifier=999,
+            location="simulator",
+            description="simulated BACnet controller",
+        )
+        self.app = SimulatedApplication(
+            self.deviceObject, IPv4Address(address), latency=latency, loss=loss
+        )
+        self.objects = []
+        for i in range(points):
+            kind = SimulatedDevice.__kinds[i % len(SimulatedDevice.__kinds)]
+            obj = self.create_object(kind, i // len(SimulatedDevice.__kinds) + 1)
+            self.app.add_object(obj)
+            self.objects.append(obj)
+        self.trends = []
+        for i in range(min(trends, points)):
+            trend = self.create_trend(self.objects[i], i + 1, bufferSize)
+            self.app.add_object(trend)
+            self.trends.append(trend)
+
+    def create_object(self, kind: str, n: int):
+        template = SimulatedDevice.__templates.get(kind)
+        if template is None:
+            template = self.create_template(kind)
+            SimulatedDevice.__templates[kind] = template
+        obj = copy.copy(template)
+        # the copy must not share its property change monitors with the template
+        obj._property_monitors = defaultdict(list)
+        obj.objectIdentifier = (kind, n)
+        obj.objectName = f"{kind}-{n}"
+        obj.description = f"simulated {kind} {n}"
+        self.set_random_value(obj)
+        return obj
+
+    def create_template(self, kind: str):
+        common = {
+            "objectIdentifier": (kind, 0),
+            "objectName": kind,
+            "description": kind,
+            "statusFlags": [0, 0, 0, 0],
+            "reliability": "noFaultDetected",
+            "outOfService": False,
+            "eventState": "normal",
+        }
+        if kind.startswith("analog"):
+            cls = AnalogValueObject if kind == "analog-value" else AnalogInputObject
+            return cls(
+                presentValue=0.0,
+                units="percent",
+                minPresValue=0.0,
+                maxPresValue=100.0,
+                **common,
+            )
+        elif kind.startswith("binary"):
+            cls = BinaryValueObject if kind == "binary-value" else BinaryInputObject
+            return cls(
+                presentValue="inactive",
+                activeText="on",
+                inactiveText="off",
+                elapsedActiveTime=0,
+                **common,
+            )
+        else:
+            return MultiStateValueObject(
+                presentValue=1,
+                numberOfStates=len(SimulatedDevice.__states),
+                stateText=SimulatedDevice.__states,
+                **common,
+            )
+
+    def create_trend(self, obj, n: int, bufferSize: int):
+        return TrendLogObject(
+            objectIdentifier=("trend-log", n),
+            objectName=f"trend-log-{n}",
+            description=f"simulated trend of {obj.objectName}",
+            enable=True,
+            logDeviceObjectProperty=DeviceObjectPropertyReference(
+                objectIdentifier=obj.objectIdentifier, propertyIdentifier="presentValue"
+            ),
+            loggingType="polled",
+            logInterval=500,
+            bufferSize=bufferSize,
+            logBuffer=[],
+            recordCount=0,
+            totalRecordCount=0,
+            statusFlags=[0, 0, 0, 0],
+            eventState="normal",
+        )
+
+    def log_trends(self):
+        """
+        Append the present value of each trended object to its trend log, dropping the oldest
+        record once the buffer is full, like a controller would.
+        """
+        now = dt.datetime.now()
+        timestamp = DateTime(
+            date=Date(now.strftime("%Y-%m-%d")),
+            time=Time(now.strftime("%H:%M:%S.") + f"{now.microsecond // 10000:02d}"),
+        )
+        for trend in self.trends:
+            obj = self.app.get_object_id(trend.logDeviceObjectProperty.objectIdentifier)
+            value = obj.presentValue
+            if isinstance(value, float):
+                datum = LogRecordLogDatum(realValue=value)
+            else:
+                datum = LogRecordLogDatum(enumValue=int(value))
+            buffer = list(trend.logBuffer)
+            buffer.append(LogRecord(timestamp=timestamp, logDatum=datum))
+            if len(buffer) > trend.bufferSize:
+                buffer = buffer[-trend.bufferSize :]
+            trend.logBuffer = buffer
+            trend.recordCount = len(buffer)
+            trend.totalRecordCount = trend.totalRecordCount + 1
+
+    def set_random_value(self, obj):
+        kind = str(obj.objectIdentifier[0])
+        if kind.startswith("analog"):
+            obj.presentValue = random.uniform(0.0, 100.0)
+        elif kind.startswith("binary"):
+            obj.presentValue = random.choice(["active", "inactive"])
+        else:
+            obj.presentValue = random.randint(1, len(SimulatedDevice.__states))
+
+    def churn(self, ratio: float):
+        """
+        Change the present value of a random share of this device's objects.
+        """
+        for obj in self.objects:
+            if random.random() < ratio:
+                self.set_random_value(obj)
+
+    def close(self):
+        self.app.close()
+
+
+class BroadcastRelay(asyncio.DatagramProtocol):
+    """
+    Every virtual device listens on its own UDP port, so none of them can receive the client's
+    local broadcasts directly. The relay binds the broadcast address on the client's BACnet
+    port (sharing it through SO_REUSEPORT) and hands each broadcast it receives to the link
+    layer of every device, as if it had arrived on that device's own broadcast socket.
+    """
+
+    def __init__(self, site) -> None:
+        self.site = site
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        for device in self.site.devices:
+            pdu = PDU(data, source=IPv4Address(addr), destination=LocalBroadcast())
+            asyncio.ensure_future(device.app.normal.server.confirmation(pdu))
+
+
+class SimulatedSite:
+    """
+    A local BACnet site made of N virtual devices with M objects each, all hosted on one event
+    loop. Device i binds port + i on the given address, and a broadcast relay on the client's
+    port fans who-is broadcasts out to all of them, so discovery works unchanged on loopback.
+    """
+
+    def __init__(
+        self,
+        devices: int,
+        points: int,
+        address="127.0.0.1/8",
+        port=47809,
+        relayPort=47808,
+        firstInstance=100000,
+        offset=0,
+        segmentation=Segmentation.segmentedBoth,
+        maxApdu=1476,
+        latency=0.0,
+        loss=0.0,
+        churn=0.0,
+        churnInterval=5,
+        trends=0,
+    ) -> None:
+        self.count = devices
+        self.points = points
+        self.interface = ipaddress.IPv4Interface(address)
+        self.port = port
+        self.relayPort = relayPort
+        self.relay = None
+        self.firstInstance = firstInstance
+        self.offset = offset
+        self.segmentation = segmentation
+        self.maxApdu = maxApdu
+        self.latency = latency
+        self.loss = loss
+        self.churnRatio = churn
+        self.churnInterval = churnInterval
+        self.trends = trends
+        self.devices = []
+        self.logger = logging.getLogger("SimulatorLog")
+
+    def device_address(self, i: int) -> str:
+        # a /32 mask makes the broadcast address equal the unicast one, which tells bacpypes3
+        # not to open a broadcast socket for the device; the relay takes care of broadcasts.
+        return f"{self.interface.ip}/32:{self.port + self.offset + i}"
+
+    async def start(self):
+        for i in range(self.count):
+            self.devices.append(
+                SimulatedDevice(
+                    self.firstInstance + self.offset + i,
+                    self.device_address(i),
+                    self.points,
+                    segmentation=self.segmentation,
+                    maxApdu=self.maxApdu,
+                    latency=self.latency,
+                    loss=self.loss,
+                    trends=self.trends,
+                )
+            )
+            # yield so the datagram endpoints of large sites get created as we go
+            if i % 50 == 49:
+                await asyncio.sleep(0)
+
+        if self.relayPort is not None:
+            self.relay, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: BroadcastRelay(self),
+                local_addr=(str(self.interface.network.broadcast_address), self.relayPort),
+                allow_broadcast=True,
+                reuse_port=True,
+            )
+        self.logger.info(
+            f"simulating {self.count} devices x {self.points} objects on "
+            f"{self.interface.ip} ports {self.device_address(0).split(':')[1]}-"
+            f"{self.device_address(self.count - 1).split(':')[1]}"
+        )
+
+    async def run(self):
+        await self.start()
+        try:
+            while True:
+                await asyncio.sleep(self.churnInterval)
+                for device in self.devices:
+                    if self.churnRatio > 0:
+                        device.churn(self.churnRatio)
+                    device.log_trends()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.relay is not None:
+            self.relay.close()
+            self.relay = None
+        for device in self.devices:
+            device.close()
+        self.devices.clear()
+
+
+def run_site(kwargs: dict):
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    try:
+        asyncio.run(SimulatedSite(**kwargs).run())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BACnet Client site simulator")
+    parser.add_argument("--devices", type=int, default=10, help="number of devices")
+    parser.add_argument("--points", type=int, default=50, help="objects per device")
+    parser.add_argument(
+        "--address",
+        type=str,
+        default="127.0.0.1/8",
+        help="interface the devices bind to, its broadcast address is relayed",
+    )
+    parser.add_argument(
+        "--port", type=int, default=47809, help="port of the first device"
+    )
+    parser.add_argument(
+        "--relay-port",
+        type=int,
+        default=47808,
+        help="BACnet port of the client whose broadcasts are relayed",
+    )
+    parser.add_argument("--instance", type=int, default=100000, help="first device id")
+    parser.add_argument(
+        "--segmentation",
+        type=str,
+        default="segmentedBoth",
+        choices=["segmentedBoth", "segmentedTransmit", "segmentedReceive", "noSegmentation"],
+    )
+    parser.add_argument("--max-apdu", type=int, default=1476, help="max APDU accepted")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--loss", type=float, default=0.0, help="drop probability 0-1")
+    parser.add_argument(
+        "--churn", type=float, default=0.1, help="share of values changed per interval"
+    )
+    parser.add_argument("--churn-interval", type=float, default=5, help="seconds")
+    parser.add_argument(
+        "--trends",
+        type=int,
+        default=0,
+        help="trend logs per device, logging one object each every churn interval",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="split the devices across this many processes, each with its own relay",
+    )
+    args = parser.parse_args()
+
+    processes = max(1, min(args.processes, args.devices))
+    share, remainder = divmod(args.devices, processes)
+    workers = []
+    offset = 0
+    for p in range(processes):
+        count = share + (1 if p < remainder else 0)
+        kwargs = {
+            "devices": count,
+            "points": args.points,
+            "address": args.address,
+            "port": args.port,
+            "relayPort": args.relay_port,
+            "firstInstance": args.instance,
+            "offset": offset,
+            "segmentation": getattr(Segmentation, args.segmentation),
+            "maxApdu": args.max_apdu,
+            "latency": args.latency,
+            "loss": args.loss,
+            "churn": args.churn,
+            "churnInterval": args.churn_interval,
+            "trends": args.trends,
+        }
+        offset += count
+        if processes == 1:
+            run_site(kwargs)
+            return
+        worker = multiprocessing.Process(target=run_site, args=(kwargs,), daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
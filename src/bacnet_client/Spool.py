@@ -0,0 +1,153 @@
+import bson
+import sqlite3
+import asyncio
+import logging
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WriteSpool:
+    """
+    Durable store-and-forward buffer for database writes made while the server is unreachable.
+    Writes are appended to a SQLite table in arrival order, one row per write, with its
+    arguments BSON encoded so ObjectIds and datetimes survive the round trip. The spool is
+    capped in bytes and evicts its oldest writes first once the cap is reached, since recent
+    values are worth more than stale ones after a long outage. The SQLite statements run on
+    a thread of the spool's own, off the event loop; a single one, so they apply in the
+    order they were issued, while the counts are kept on the loop.
+    """
+
+    def __init__(self, path: str, maxBytes: int, batchSize: int = 500) -> None:
+        self.path = path
+        self.maxBytes = maxBytes
+        self.batchSize = batchSize
+        self.size = 0
+        self.count = 0
+        self.evicted = 0
+        self.evicting = False
+        self.connection = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool")
+        self.logger = logging.getLogger("ClientLog")
+
+    def open(self):
+        if self.connection is not None:
+            return
+        self.connection = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS writes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "dbname TEXT NOT NULL, "
+            "collection TEXT NOT NULL, "
+            "op TEXT NOT NULL, "
+            "payload BLOB NOT NULL)"
+        )
+        self.count, self.size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM writes"
+        ).fetchone()
+
+    @property
+    def pending(self) -> bool:
+        return self.count > 0
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(func, *args)
+        )
+
+    async def append(self, dbname: str, collection: str, op: str, args: dict):
+        self.open()
+        payload = bson.encode(args)
+        # counted before the insert is done, so the writes that follow queue behind it
+        self.count += 1
+        self.size += len(payload)
+        try:
+            await self.call(self.insert, dbname, collection, op, payload)
+        except Exception:
+            self.count -= 1
+            self.size -= len(payload)
+            raise
+        if self.size > self.maxBytes and self.evicting is False:
+            await self.evict()
+
+    def insert(self, dbname: str, collection: str, op: str, payload: bytes):
+        self.connection.execute(
+            "INSERT INTO writes (dbname, collection, op, payload) VALUES (?, ?, ?, ?)",
+            (dbname, collection, op, payload),
+        )
+
+    async def evict(self):
+        """
+        Drop the oldest writes until the spool is back under 90% of its cap, so a full spool
+        does not evict on every append.
+        """
+        target = self.maxBytes * 0.9
+        evicted = 0
+        self.evicting = True
+        try:
+            while self.size > target and self.count > 0:
+                rows = await self.call(self.oldest)
+                if len(rows) == 0:
+                    break
+                size = self.size
+                for seq, length in rows:
+                    size -= length
+                    if size <= target:
+                        break
+                count, size = await self.call(self.delete, seq)
+                self.count -= count
+                self.size -= size
+                evicted += count
+        finally:
+            self.evicting = False
+        self.evicted += evicted
+        self.logger.warning(
+            f"write spool over {self.maxBytes} bytes, evicted the {evicted} oldest writes"
+        )
+
+    def oldest(self) -> list:
+        return self.connection.execute(
+            "SELECT seq, LENGTH(payload) FROM writes ORDER BY seq LIMIT ?",
+            (self.batchSize,),
+        ).fetchall()
+
+    async def peek(self) -> list:
+        """
+        The oldest batch of spooled writes as (seq, dbname, collection, op, args) tuples.
+        """
+        self.open()
+        rows = await self.call(self.batch)
+        return [(seq, db, col, op, bson.decode(payload)) for seq, db, col, op, payload in rows]
+
+    def batch(self) -> list:
+        return self.connection.execute(
+            "SELECT seq, dbname, collection, op, payload FROM writes ORDER BY seq LIMIT ?",
+            (self.batchSize,),
+        ).fetchall()
+
+    async def remove(self, seq: int):
+        """
+        Forget every write up to and including seq, once it has been replayed.
+        """
+        count, size = await self.call(self.delete, seq)
+        self.count -= count
+        self.size -= size
+        if self.count == 0:
+            # reclaim the file space left by a long outage
+            await self.call(self.connection.execute, "VACUUM")
+
+    def delete(self, seq: int) -> tuple:
+        """Delete every write up to and including seq, returning their count and size."""
+        count, size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM writes WHERE seq <= ?",
+            (seq,),
+        ).fetchone()
+        self.connection.execute("DELETE FROM writes WHERE seq <= ?", (seq,))
+        return count, size
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
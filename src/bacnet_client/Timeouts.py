@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import logging
+from bacpypes3.apdu import AbortPDU, AbortReason, ErrorRejectAbortNack
+from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
+
+
+class RttEstimator:
+    """
+    Smoothed round trip time and variance of one device, estimated the way TCP estimates
+    its retransmission timeout (RFC 6298). Every request that goes unanswered doubles the
+    timeout until the device answers again.
+    """
+
+    alpha = 1 / 8
+    beta = 1 / 4
+
+    def __init__(self, srtt: float = None, rttvar: float = None, failures: int = 0) -> None:
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.failures = failures
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+
+    def timeout(self, floor: float, ceiling: float, initial: float) -> float:
+        rto = initial if self.srtt is None else self.srtt + 4 * self.rttvar
+        return min(ceiling, max(floor, rto * 2 ** min(self.failures, 16)))
+
+    def retries(self, retries: int) -> int:
+        """
+        Devices that stopped answering get fewer retries with every request they miss, so a
+        dead device costs a single timeout per request instead of the whole retry budget.
+        """
+        return max(0, retries - self.failures)
+
+
+class TimeoutService(Subscriber):
+    """
+    Adaptive per-device APDU timeouts and retries. The round trip of every confirmed request
+    is measured and fed to the device's estimator, and the timeout and retry count of the
+    next transaction with that device are derived from it, within the floor and ceiling
+    settings. Estimates are saved to the resource folder every interval, so they start warm
+    after a restart. Devices without an estimate get the stack's defaults.
+    """
+
+    __instance = None
+
+    def __init__(self) -> None:
+        self.localMgr: LocalManager = LocalManager()
+        self.scheduler: ServiceScheduler = ServiceScheduler()
+        self.estimators: dict = {}
+        self.rt_fp = None
+        self.initialized = False
+        self.settings = {
+            "section": "adaptive-timeouts",
+            "enable": False,
+            "interval": 60,
+            "floor": 200,
+            "ceiling": 10000,
+            "initial": 3000,
+            "retries": 3,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if TimeoutService.__instance is None:
+            TimeoutService.__instance = object.__new__(cls)
+        return TimeoutService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    @property
+    def enabled(self) -> bool:
+        return self.settings.get("enable") is True
+
+    async def run(self, bacapp):
+        if self.subscribed is False:
+            bacapp.localMgr.subscribe(self.__instance)
+            self.subscribed = True
+
+        section = self.settings.get("section")
+        for option in ("enable", "interval", "floor", "ceiling", "initial", "retries"):
+            self.settings[option] = self.localMgr.read_setting(
+                section, option, fallback=self.settings.get(option)
+            )
+        if self.initialized is not True:
+            self.rt_fp = f"{self.localMgr.respath}rtt-estimates.json"
+            self.load_estimates()
+            self.initialized = True
+        if self.scheduler.check_ticket(section, interval=self.settings.get("interval")):
+            self.save_estimates()
+
+    def estimator(self, address) -> RttEstimator:
+        key = str(address)
+        if key not in self.estimators:
+            self.estimators[key] = RttEstimator()
+        return self.estimators[key]
+
+    def timeout(self, address) -> float:
+        """The timeout of the next transaction with the device, in seconds."""
+        return self.estimator(address).timeout(
+            self.settings.get("floor") / 1000,
+            self.settings.get("ceiling") / 1000,
+            self.settings.get("initial") / 1000,
+        )
+
+    def configure(self, transaction):
+        """
+        Set the timeout (in milliseconds, like the stack) and retry count of a client
+        transaction from the estimate of the device it talks to.
+        """
+        if self.enabled is not True:
+            return
+        transaction.apduTimeout = int(self.timeout(transaction.pdu_address) * 1000)
+        transaction.numberOfApduRetries = self.estimator(transaction.pdu_address).retries(
+            self.settings.get("retries")
+        )
+
+    async def measure(self, address, request):
+        """
+        Time the request coroutine function. Any answer, errors and rejects included, is a
+        round trip sample unless it took longer than the timeout, in which case the request
+        was retried and the sample is ambiguous. No answer at all counts as a failure.
+        """
+        estimator = self.estimator(address)
+        timeout = self.timeout(address)
+        start = time.monotonic()
+        try:
+            response = await request()
+        except AbortPDU as e:
+            if e.apduAbortRejectReason == AbortReason.noResponse:
+                estimator.failure()
+            raise
+        except ErrorRejectAbortNack:
+            self.sample(estimator, time.monotonic() - start, timeout)
+            raise
+        self.sample(estimator, time.monotonic() - start, timeout)
+        return response
+
+    def sample(self, estimator: RttEstimator, rtt: float, timeout: float):
+        if rtt < timeout:
+            estimator.sample(rtt)
+
+    def load_estimates(self):
+        try:
+            with open(self.rt_fp) as estimates:
+                estimates = json.load(estimates)
+            self.estimators = {
+                address: RttEstimator(**estimate) for address, estimate in estimates.items()
+            }
+        except Exception:
+            pass
+
+    def save_estimates(self):
+        try:
+            tmp_fp = f"{self.rt_fp}.tmp"
+            with open(tmp_fp, "w") as estimates:
+                json.dump(
+                    {address: vars(e) for address, e in self.estimators.items()}, estimates
+                )
+            os.replace(tmp_fp, self.rt_fp)
+        except Exception as e:
+            self.logger.error(f"unable to persist round trip estimates: {e}")
@@ -0,0 +1,28 @@
+import datetime as dt
+from bacpypes3.basetypes import DateTime, TimeStamp
+
+
+def to_datetime(timestamp: DateTime, tz):
+    """A BACnet date and time as an aware datetime in tz, or None when any field is unset."""
+    year, month, day, _ = timestamp.date
+    hour, minute, second, hundredth = timestamp.time
+    if 255 in (year, month, day, hour, minute, second):
+        return None
+    naive = dt.datetime(year + 1900, month, day, hour, minute, second, (hundredth % 255) * 10000)
+    if hasattr(tz, "localize"):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+def to_timestamp(timeStamp: TimeStamp, tz):
+    """
+    A BACnet time stamp by its choice: a datetime for a date and time, the sequence number
+    as an int, or the bare time as a string.
+    """
+    if timeStamp is None:
+        return None
+    if timeStamp.dateTime is not None:
+        return to_datetime(timeStamp.dateTime, tz)
+    if timeStamp.sequenceNumber is not None:
+        return int(timeStamp.sequenceNumber)
+    return str(timeStamp.time)
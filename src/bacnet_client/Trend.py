@@ -0,0 +1,196 @@
+import datetime as dt
+import logging
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier
+from bacpypes3.constructeddata import ListOf
+from bacpypes3.apdu import ReadRangeRequest, ErrorRejectAbortNack
+from bacpypes3.basetypes import (
+    PropertyIdentifier,
+    LogRecord,
+    LogMultipleRecord,
+    ResultFlags,
+    Range,
+    RangeBySequenceNumber,
+    RangeByTime,
+    DateTime,
+)
+from bacpypes3.primitivedata import Date, Time
+from bacpypes3.ipv4.app import NormalApplication
+from .Device import LocalBacnetDevice
+from .Timestamps import to_datetime
+
+
+class TrendLog:
+    """
+    A trend-log or trend-log-multiple object on a remote device. Like the point objects, it
+    receives its edge from the object graph and fetches its own data: the log buffer is read
+    with ReadRange, by sequence number for incremental collection, or by time to fill a gap.
+    An optional throttle coroutine is awaited before every request. Records come back as
+    plain dicts ready to be written to the time-series collection.
+    """
+
+    __datum_choices = (
+        "realValue",
+        "enumValue",
+        "unsignedValue",
+        "signedValue",
+        "booleanValue",
+        "bitstringValue",
+        "nullValue",
+        "logStatus",
+        "failure",
+        "timeChange",
+        "anyValue",
+    )
+
+    def __init__(
+        self, app: NormalApplication, localDevice: LocalBacnetDevice, edge, obj
+    ) -> None:
+        self.app: NormalApplication = app
+        self.localDevice: LocalBacnetDevice = localDevice
+        self.device: dict = edge
+        self.obj = obj
+        self.multiple = str(obj).startswith("trend-log-multiple")
+        self.throttle = None
+        self.logger = logging.getLogger("ClientLog")
+
+    async def read(self, prop):
+        if self.throttle is not None:
+            await self.throttle()
+        return await self.app.read_property(
+            Address(self.device["address"]), ObjectIdentifier(self.obj), prop
+        )
+
+    async def sequence_window(self):
+        """
+        The sequence numbers of the oldest and newest records still in the buffer. Sequence
+        numbers count every record ever logged, so the buffer holds the last recordCount of
+        totalRecordCount.
+        """
+        recordCount = await self.read("recordCount")
+        totalRecordCount = await self.read("totalRecordCount")
+        return totalRecordCount - recordCount + 1, totalRecordCount
+
+    async def read_range(self, range: Range):
+        """
+        bacpypes3's read_range only returns the items, the first sequence number and result
+        flags are needed to page through the buffer, so the request is made directly.
+        """
+        request = ReadRangeRequest(
+            objectIdentifier=ObjectIdentifier(self.obj),
+            propertyIdentifier=PropertyIdentifier.logBuffer,
+            destination=Address(self.device["address"]),
+        )
+        request.range = range
+        if self.throttle is not None:
+            await self.throttle()
+        response = await self.app.request(request)
+        if isinstance(response, ErrorRejectAbortNack):
+            raise RuntimeError(f"read range {self.obj}: {response}")
+        items = response.itemData.cast_out(
+            ListOf(LogMultipleRecord if self.multiple else LogRecord)
+        )
+        more = response.resultFlags[ResultFlags.moreItems] == 1
+        return list(items), response.firstSequenceNumber, more
+
+    async def fetch_since(self, lastSequence, chunk: int):
+        """
+        Fetch the records logged after lastSequence (None for everything in the buffer) in
+        pages of chunk records. Returns the records and the last sequence number read.
+        """
+        oldest, newest = await self.sequence_window()
+        if lastSequence is not None and lastSequence > newest:
+            self.logger.warning(f"{self.device['id']} {self.obj} buffer was reset")
+            lastSequence = None
+        start = oldest if lastSequence is None else lastSequence + 1
+        if start < oldest:
+            self.logger.warning(
+                f"{self.device['id']} {self.obj} records {start}-{oldest - 1} were "
+                "overwritten before they could be collected"
+            )
+            start = oldest
+
+        records = []
+        last = lastSequence
+        while start <= newest:
+            items, first, more = await self.read_range(
+                Range(
+                    bySequenceNumber=RangeBySequenceNumber(
+                        referenceSequenceNumber=start, count=chunk
+                    )
+                )
+            )
+            if len(items) == 0:
+                break
+            first = start if first is None else first
+            records.extend(self.to_records(items, first))
+            start = first + len(items)
+            last = start - 1
+            if more is not True:
+                break
+        return records, last
+
+    async def fetch_between(self, begin: dt.datetime, end: dt.datetime, chunk: int):
+        """
+        Fetch the records logged after begin and up to end, in pages of chunk records.
+        """
+        tz = self.localDevice.settings.get("tz")
+        records = []
+        while True:
+            reference = begin.astimezone(tz)
+            items, first, more = await self.read_range(
+                Range(
+                    byTime=RangeByTime(
+                        referenceTime=DateTime(
+                            date=Date(reference.strftime("%Y-%m-%d")),
+                            time=Time(reference.strftime("%H:%M:%S")),
+                        ),
+                        count=chunk,
+                    )
+                )
+            )
+            page = [r for r in self.to_records(items, first) if r["timestamp"] > begin]
+            records.extend(r for r in page if r["timestamp"] <= end)
+            if len(page) == 0 or more is not True or page[-1]["timestamp"] >= end:
+                break
+            begin = page[-1]["timestamp"]
+        return records
+
+    def to_records(self, items: list, first) -> list:
+        records = []
+        for i, item in enumerate(items):
+            timestamp = to_datetime(item.timestamp, self.localDevice.settings.get("tz"))
+            if timestamp is None:
+                continue
+            if self.multiple:
+                value = [self.to_value(datum) for datum in (item.logData.logData or [])]
+            else:
+                value = self.to_value(item.logDatum)
+            records.append(
+                {
+                    "timestamp": timestamp,
+                    "meta": {"device": self.device["id"], "log": str(self.obj)},
+                    "sequence": None if first is None else first + i,
+                    "value": value,
+                }
+            )
+        return records
+
+    @classmethod
+    def to_value(cls, datum):
+        for choice in TrendLog.__datum_choices:
+            value = getattr(datum, choice, None)
+            if value is None:
+                continue
+            if choice in ("realValue", "timeChange"):
+                return float(value)
+            elif choice in ("enumValue", "unsignedValue", "signedValue"):
+                return int(value)
+            elif choice == "booleanValue":
+                return bool(value)
+            elif choice == "bitstringValue":
+                return list(value)
+            elif choice == "nullValue":
+                return None
+            return {choice: str(value)}
+        return None
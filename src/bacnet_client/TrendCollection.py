@@ -0,0 +1,162 @@
+import os
+import json
+import logging
+from .Device import LocalBacnetDevice
+from .Trend import TrendLog
+from .Partitioning import LeaseManager
+from .SelfManagement import LocalManager, Subscriber, ServiceScheduler
+from bacpypes3.ipv4.app import NormalApplication
+
+
+class TrendService(Subscriber):
+    """
+    Bacnet Trend Collection Service: harvests the trend-log and trend-log-multiple objects
+    listed by the devices on the database. Each log is read incrementally from the last
+    sequence number collected, and the new records are written in bulk to the Trends
+    time-series collection.
+    """
+
+    __instance = None
+    __isBootup = True
+    __collection = "Trends"
+
+    def __init__(self) -> None:
+        self.app: NormalApplication = None
+        self.localMgr: LocalManager = None
+        self.mongo = None
+        self.scheduler: ServiceScheduler = ServiceScheduler()
+        self.leases: LeaseManager = LeaseManager()
+        self.localDevice = LocalBacnetDevice()
+        self.sequences: dict = {}
+        self.sq_fp = None
+        self.initialized = False
+        self.settings: dict = {
+            "section": "trend-collection",
+            "enable": None,
+            "interval": None,
+            "chunk": 100,
+        }
+        self.subscribed = False
+        self.logger = logging.getLogger("ClientLog")
+
+    def __new__(cls):
+        if TrendService.__instance is None:
+            TrendService.__instance = object.__new__(cls)
+        return TrendService.__instance
+
+    def update(self, section, option, value):
+        if section in self.settings.get("section"):
+            oldvalue = self.settings.get(option)
+            self.settings[option] = value
+            self.logger.debug(
+                f"{section} > {option} updated from {oldvalue} to {self.settings.get(option)}"
+            )
+
+    async def run(self, bacapp):
+        if self.app is None:
+            self.app = bacapp.app
+        if self.mongo is None:
+            self.mongo = bacapp.clients.get("mongodb")
+
+        if bacapp.localMgr.initialized is True:
+            if self.localMgr is None:
+                self.localMgr = bacapp.localMgr
+            if self.subscribed is False:
+                bacapp.localMgr.subscribe(self.__instance)
+                self.subscribed = True
+
+            section = self.settings.get("section")
+            self.settings["enable"] = self.localMgr.read_setting(section, "enable")
+            self.settings["interval"] = self.localMgr.read_setting(section, "interval")
+            self.settings["chunk"] = self.localMgr.read_setting(section, "chunk", fallback=100)
+
+            if self.initialized is not True:
+                self.sq_fp = f"{self.localMgr.respath}trend-sequences.json"
+                self.sequences = self.load_sequences()
+                await self.mongo.createTimeSeries(
+                    self.mongo.getDb(), TrendService.__collection, "timestamp", "meta"
+                )
+                self.initialized = True
+
+            if (
+                self.scheduler.check_ticket(section, interval=self.settings.get("interval"))
+                or self.__isBootup
+            ):
+                self.__isBootup = False
+                await self.collect()
+
+    async def discover(self) -> list:
+        """
+        Build a trend log object for every trend-log and trend-log-multiple object listed in
+        the object-list of the devices this gateway serves.
+        """
+        dbPayload = await self.mongo.findDocuments(
+            self.mongo.getDb(),
+            "Devices",
+            query={},
+            projection={"id": 1, "address": 1, "properties": 1, "_id": 0},
+        )
+        logs = []
+        for device in dbPayload:
+            if self.leases.owns(device["id"]) is not True:
+                continue
+            try:
+                edge = {
+                    "id": device["id"],
+                    "name": device["properties"]["device-name"]["value"],
+                    "address": device["address"],
+                }
+                objListValue = device["properties"]["object-list"]["value"]
+            except (KeyError, TypeError):
+                continue
+            for obj in objListValue:
+                if str(obj).startswith("trend-log"):
+                    logs.append(TrendLog(self.app, self.localDevice, edge, obj))
+        return logs
+
+    async def collect(self):
+        self.logger.info("trend collection started...")
+        try:
+            logs = await self.discover()
+        except Exception as e:
+            self.logger.error(f"trend collection: unable to list trend logs: {e}")
+            return
+
+        collected = 0
+        for log in logs:
+            key = f"{log.device['id']}/{log.obj}"
+            try:
+                records, last = await log.fetch_since(
+                    self.sequences.get(key), self.settings.get("chunk")
+                )
+            except Exception as e:
+                self.logger.error(f"trend collection: {key} {e}")
+                continue
+            if len(records) > 0:
+                await self.mongo.writeDocuments(
+                    records, self.mongo.getDb(), TrendService.__collection
+                )
+                collected += len(records)
+            if last is not None and last != self.sequences.get(key):
+                self.sequences[key] = last
+                self.save_sequences()
+
+        self.logger.info(
+            f"trend collection completed, {collected} records from {len(logs)} logs..."
+        )
+
+    def load_sequences(self) -> dict:
+        try:
+            with open(self.sq_fp) as sequences:
+                return json.load(sequences)
+        except Exception:
+            return {}
+
+    def save_sequences(self):
+        try:
+            tmp_fp = f"{self.sq_fp}.tmp"
+            with open(tmp_fp, "w") as sequences:
+                json.dump(self.sequences, sequences)
+            os.replace(tmp_fp, self.sq_fp)
+        except Exception as e:
+            self.logger.error(f"unable to persist trend sequence numbers: {e}")
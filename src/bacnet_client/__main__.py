@@ -7,4 +7,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    app.install_event_loop()
     asyncio.run(main())
@@ -5,15 +5,28 @@ import json
 import re
 from logging.handlers import QueueHandler
 import time
-from bacpypes3.ipv4.app import NormalApplication
+import datetime as dt
+from .Application import ClientApplication
 from .Device import LocalBacnetDevice
 from .MongoClient import Mongodb
 from .RemoteManagement import ScheduledUpdateManager
+from .Partitioning import LeaseManager
+from .Indexes import IndexManager
+from .Metrics import registry
+from .Monitoring import install_event_loop
 
 # import services
 import bacnet_client.DeviceManagement as dm
 import bacnet_client.PointManagement as pm
 import bacnet_client.PointPolling as pp
+import bacnet_client.TrendCollection as tc
+import bacnet_client.Backfill as bf
+import bacnet_client.EventNotification as en
+import bacnet_client.Networks as nw
+import bacnet_client.Timeouts as to
+import bacnet_client.LocalApi as la
+import bacnet_client.Monitoring as mon
+import bacnet_client.Diagnostics as dg
 from .SelfManagement import LocalManager, ServiceScheduler
 
 
@@ -31,14 +44,23 @@ class Bacapp:
             time.sleep(1)
 
         self.localDevice = LocalBacnetDevice()
-        self.app = NormalApplication(
+        self.app = ClientApplication(
             self.localDevice.deviceObject, self.localDevice.deviceAddress
         )
         self.clients = {"mongodb": Mongodb()}
         self.services = {
+            "networkSrv": nw.NetworkService(),
+            "timeoutSrv": to.TimeoutService(),
+            "apiSrv": la.LocalApiService(),
+            "metricsSrv": mon.MetricsService(),
+            "loopMonitor": mon.LoopMonitor(),
+            "diagSrv": dg.DiagnosticsService(),
             "deviceMgr": dm.DeviceManager(),
             "pointMgr": pm.PointManager(),
             "pollSrv": pp.PollService(),
+            "trendSrv": tc.TrendService(),
+            "backfillSrv": bf.BackfillService(),
+            "eventSrv": en.EventService(),
         }
         self.logger = logging.getLogger("ClientLog")
 
@@ -48,15 +70,35 @@ class Bacapp:
         return Bacapp.__instance
 
     async def run(self):
+        if self.localMgr.read_setting("device", "warmstart", fallback=False) is True:
+            for service, object in self.services.items():
+                if hasattr(object, "warm_start"):
+                    await object.warm_start(self)
+
+        # Each service runs in its own task so a long discovery cycle never holds back
+        # polling; a service is only rescheduled once its previous run has finished.
+        tasks = {}
+        diagnostics = self.services.get("diagSrv")
         while True:
-            tasks = []
             for service, object in self.services.items():
+                task = tasks.get(service)
+                if task is not None and task.done() is not True:
+                    continue
+                if task is not None:
+                    tasks.pop(service)
+                    if task.cancelled() is not True and task.exception() is not None:
+                        self.logger.error(f"{service} run failed: {task.exception()}")
                 enable = bool(
-                    self.localMgr.read_setting(object.settings.get("section"), "enable")
+                    self.localMgr.read_setting(
+                        object.settings.get("section"), "enable", fallback=False
+                    )
                 )
                 if enable is True:
-                    tasks.append(self.loop.create_task(object.run(self), name=service))
-            await asyncio.gather(*tasks)
+                    cycle = object.run(self)
+                    if diagnostics.tracing is True:
+                        cycle = diagnostics.span(service, cycle)
+                    tasks[service] = self.loop.create_task(cycle, name=service)
+            await asyncio.sleep(1)
 
 
 class JsonFormatter(logging.Formatter):
@@ -77,13 +119,19 @@ def do_log_exit(bacapp):
     bacapp.logger.info(None)
 
 
+log_queue_depth = registry.gauge("client_log_queue_depth", "Log records waiting for MongoDB")
+
+
 async def log(q, mongo):
     while True:
+        log_queue_depth.set(q.qsize())
         try:
             if q.empty() is not True:
                 record = q.get()
                 m = re.search("\\{.+\\}", str(record))
                 mongo_record: dict = json.loads(m.group(0))
+                # a date for the Logs TTL index, the formatted timestamp is a string
+                mongo_record["createdAt"] = dt.datetime.now(tz=dt.timezone.utc)
 
                 if record is None:
                     break
@@ -111,18 +159,24 @@ async def main():
         logger = logging.getLogger("ClientLog")
         logger.addHandler(logProducer)
         logger.setLevel(logging.DEBUG)
+        logger.info(f"running on the {type(loop).__module__} event loop")
 
         bacapp = Bacapp()
         bacapp.loop = loop
 
         scheduler = ServiceScheduler()
         remoteMgr = ScheduledUpdateManager()
+        leaseMgr = LeaseManager()
+        indexMgr = IndexManager()
 
         await asyncio.gather(
             log(logQ, bacapp.clients.get("mongodb")),
             bacapp.localMgr.proces_io_deltas(),
             bacapp.run(),
             remoteMgr.run(bacapp),
+            leaseMgr.run(bacapp),
+            indexMgr.run(bacapp),
+            bacapp.clients.get("mongodb").run_spool(),
             scheduler.run(),
         )
 
@@ -132,4 +186,5 @@ async def main():
 
 
 if __name__ == "__main__":
+    install_event_loop()
     asyncio.run(main())
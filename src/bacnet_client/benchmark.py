@@ -0,0 +1,296 @@
+"""
+Reproducible benchmark of the discovery, point build, poll and commit cycles against a local
+simulated BACnet site and the in-process MongoDB stand-in. Results are printed as JSON so
+they can be compared across releases:
+
+    python -m bacnet_client.benchmark --devices 50 --points 100 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+from importlib import metadata
+from bacpypes3.pdu import Address
+from bacpypes3.ipv4.app import NormalApplication
+from .Simulator import SimulatedSite
+
+BENCH_INI = """[device]
+objectidentifier = 599
+objectname = bacnet-client-benchmark
+vendoridentifier = 999
+tz = UTC
+loglevel = WARNING
+nukid = benchmark
+
+[network]
+interface = {interface}
+maxapdulengthaccepted = 1476
+maxsegmentsaccepted = 64
+
+[mongodb]
+connectionstring = memory://
+certpath =
+dbname = benchmark
+
+[device-discovery]
+enable = True
+interval = 3600
+timeout = {timeout}
+
+[point-discovery]
+enable = True
+interval = 3600
+
+[point-polling]
+enable = True
+interval = 60
+"""
+
+
+class TimedApplication:
+    """
+    Wraps the client's bacpypes3 application and records the latency of every read_property
+    call made by the services, everything else is delegated untouched.
+    """
+
+    def __init__(self, app: NormalApplication) -> None:
+        self.app = app
+        self.latencies = []
+        self.errors = 0
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+    async def read_property(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await self.app.read_property(*args, **kwargs)
+        except BaseException:
+            self.errors += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+
+class Stage:
+    """
+    Context manager measuring one benchmark stage: wall time, reads issued through the timed
+    application, and documents written to the in-process database.
+    """
+
+    def __init__(self, name: str, app: TimedApplication, db, results: dict) -> None:
+        self.name = name
+        self.app = app
+        self.db = db
+        self.results = results
+
+    async def __aenter__(self):
+        self.reads = len(self.app.latencies)
+        self.errors = self.app.errors
+        self.writes = self.db.writes
+        self.start = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc_details):
+        seconds = time.perf_counter() - self.start
+        latencies = sorted(self.app.latencies[self.reads :])
+        writes = self.db.writes - self.writes
+        self.results[self.name] = {
+            "seconds": round(seconds, 4),
+            "reads": len(latencies),
+            "read_errors": self.app.errors - self.errors,
+            "reads_per_s": round(len(latencies) / seconds, 2) if seconds else 0,
+            "read_latency_p50_ms": percentile(latencies, 50),
+            "read_latency_p99_ms": percentile(latencies, 99),
+            "writes": writes,
+            "writes_per_s": round(writes / seconds, 2) if seconds else 0,
+        }
+
+
+def percentile(latencies: list, p: int):
+    if len(latencies) == 0:
+        return None
+    index = min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))
+    return round(latencies[index] * 1000, 3)
+
+
+def prepare_respath(args) -> str:
+    """
+    Create a throwaway resource directory with a benchmark configuration. The ini watcher is
+    replaced with a no-op script since nothing edits the configuration during a run.
+    """
+    respath = tempfile.mkdtemp(prefix="bacnet-bench-") + os.sep
+    with open(f"{respath}local-device.ini", "w") as ini:
+        ini.write(BENCH_INI.format(interface=args.interface, timeout=args.timeout))
+    with open(f"{respath}ini_eventmgr.sh", "w") as script:
+        script.write("#!/bin/sh\nexit 0\n")
+    os.chmod(f"{respath}ini_eventmgr.sh", 0o755)
+    return respath
+
+
+async def bench_normalize(app, iams, repeat: int, results: dict):
+    """
+    Read the raw property set of the discovered devices once, then time BacnetDevice
+    construction (which normalizes every property) over it.
+    """
+    from .Device import BacnetDevice
+
+    samples = []
+    for iam in iams:
+        deviceId = iam.iAmDeviceIdentifier
+        props = {"device-name": await app.read_property(iam.pduSource, deviceId, "objectName")}
+        for prop in await app.read_property(iam.pduSource, deviceId, "propertyList"):
+            try:
+                props[str(prop)] = await app.read_property(iam.pduSource, deviceId, str(prop))
+            except Exception:
+                pass
+        samples.append((deviceId, str(iam.pduSource), props))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for deviceId, address, props in samples:
+            BacnetDevice(deviceId, address, props)
+    seconds = time.perf_counter() - start
+    count = repeat * len(samples)
+    results["normalize"] = {
+        "seconds": round(seconds, 4),
+        "devices": count,
+        "per_device_ms": round(seconds / count * 1000, 3) if count else None,
+    }
+
+
+async def run(args) -> dict:
+    # the services are singletons configured from LocalManager, which reads --respath
+    sys.argv = [sys.argv[0], "--respath", prepare_respath(args)]
+
+    from .Device import LocalBacnetDevice
+    from .MongoClient import Mongodb
+    from .SelfManagement import LocalManager
+    import bacnet_client.DeviceManagement as dm
+    import bacnet_client.PointManagement as pm
+    import bacnet_client.PointPolling as pp
+
+    site = None
+    if args.external is not True:
+        site = SimulatedSite(
+            args.devices,
+            args.points,
+            latency=args.latency,
+            loss=args.loss,
+        )
+        await site.start()
+
+    localMgr = LocalManager()
+    localDevice = LocalBacnetDevice()
+    app = TimedApplication(
+        NormalApplication(localDevice.deviceObject, localDevice.deviceAddress)
+    )
+    mongo = Mongodb()
+    db = mongo.getDb()
+
+    deviceMgr = dm.DeviceManager()
+    pointMgr = pm.PointManager()
+    pollSrv = pp.PollService()
+    for service in (deviceMgr, pointMgr, pollSrv):
+        service.app = app
+        service.mongo = mongo
+        service.localMgr = localMgr
+        service.settings["timeout"] = args.timeout
+    pointMgr.og_fp = localMgr.respath + "object-graph.pkl"
+
+    results = {}
+    cycle = time.perf_counter()
+    async with Stage("device-discover", app, db, results):
+        await deviceMgr.discover()
+    discovered = len(deviceMgr.devices)
+    async with Stage("device-commit", app, db, results):
+        await deviceMgr.commit()
+    async with Stage("point-discover", app, db, results):
+        await pointMgr.discover()
+    async with Stage("point-commit", app, db, results):
+        await pointMgr.commit()
+    for i in range(args.polls):
+        async with Stage(f"poll-{i + 1}", app, db, results):
+            await pollSrv.poll()
+    cycleSeconds = time.perf_counter() - cycle
+
+    iams = await app.who_is(0, 4194303, Address("*"), args.timeout)
+    await bench_normalize(app, iams[: args.normalize_devices], args.normalize_repeat, results)
+
+    latencies = sorted(app.latencies)
+    report = {
+        "version": version(),
+        "devices": args.devices,
+        "points_per_device": args.points,
+        "devices_discovered": discovered,
+        "points_polled": pollSrv.pointsPolled,
+        "cycle_seconds": round(cycleSeconds, 4),
+        "reads": len(latencies),
+        "reads_per_s": round(len(latencies) / cycleSeconds, 2),
+        "writes": db.writes,
+        "writes_per_s": round(db.writes / cycleSeconds, 2),
+        "read_latency_p50_ms": percentile(latencies, 50),
+        "read_latency_p99_ms": percentile(latencies, 99),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        "stages": results,
+        # stages where every read failed measured nothing but timeouts and errors
+        "failed_stages": [
+            name
+            for name, stage in results.items()
+            if stage.get("reads", 0) > 0 and stage["read_errors"] == stage["reads"]
+        ],
+    }
+
+    app.close()
+    if site is not None:
+        site.close()
+    return report
+
+
+def version():
+    try:
+        return metadata.version("bacnet-client")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BACnet Client benchmark")
+    parser.add_argument("--devices", type=int, default=20, help="simulated devices")
+    parser.add_argument("--points", type=int, default=50, help="objects per device")
+    parser.add_argument("--polls", type=int, default=3, help="poll cycles to time")
+    parser.add_argument("--latency", type=float, default=0.005, help="device latency (s)")
+    parser.add_argument("--loss", type=float, default=0.0, help="device packet loss 0-1")
+    parser.add_argument("--timeout", type=int, default=3, help="who-is timeout (s)")
+    parser.add_argument(
+        "--interface", type=str, default="127.0.0.1/8", help="client BACnet interface"
+    )
+    parser.add_argument(
+        "--external",
+        action="store_true",
+        help="benchmark against an already running simulator instead of an in-process one",
+    )
+    parser.add_argument("--normalize-devices", type=int, default=10)
+    parser.add_argument("--normalize-repeat", type=int, default=100)
+    parser.add_argument("--output", type=str, default=None, help="write the JSON here")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as outfile:
+            outfile.write(output)
+    print(output)
+    if len(report["failed_stages"]) > 0:
+        print(f"every read failed in: {', '.join(report['failed_stages'])}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+from src.bacnet_client.Backfill import GapTracker
+
+
+def test_gap_reported_after_silence():
+    tracker = GapTracker(threshold=30)
+    assert tracker.observe("device,1", ["analog-value,1"], 0) == []
+    assert tracker.observe("device,1", ["analog-value,1"], 10) == []
+    assert tracker.observe("device,1", ["analog-value,1"], 100) == [
+        ("device,1", "analog-value,1", 10, 100)
+    ]
+
+
+def test_restart_gap_uses_last_device_poll():
+    tracker = GapTracker(threshold=30)
+    tracker.devices = {"device,1": 50}
+    gaps = tracker.observe("device,1", ["analog-value,1", "binary-value,1"], 500)
+    assert [gap[1] for gap in gaps] == ["analog-value,1", "binary-value,1"]
+    assert all(gap[2:] == (50, 500) for gap in gaps)
+
+
+def test_failed_points_keep_their_last_sample():
+    tracker = GapTracker(threshold=30)
+    tracker.observe("device,1", ["analog-value,1", "analog-value,2"], 0)
+    tracker.observe("device,1", ["analog-value,1"], 20)
+    assert tracker.observe("device,1", ["analog-value,1", "analog-value,2"], 40) == [
+        ("device,1", "analog-value,2", 0, 40)
+    ]
@@ -0,0 +1,43 @@
+from src.bacnet_client.Cache import ValueCache
+
+
+def build_cache():
+    cache = ValueCache()
+    cache.describe(
+        "device,1",
+        {"analog-input,1": {"name": "AHU1-SAT"}, "binary-output,2": {"name": "AHU1-FAN"}},
+    )
+    cache.describe("device,2", {"analog-input,1": {"name": "VAV2-ZNT"}})
+    cache.update("device,1", {"analog-input,1": {"value": 55.0, "last synced": "t"}}, timestamp=100)
+    cache.update("device,1", {"binary-output,2": {"value": 1, "last synced": "t"}}, timestamp=100)
+    cache.update("device,2", {"analog-input,1": {"value": 72.5, "last synced": "t"}}, timestamp=90)
+    return cache
+
+
+def test_query_by_indexes():
+    cache = build_cache()
+    assert len(cache.query()) == 3
+    assert [p["object"] for p in cache.query(devices=["device,1"])] == [
+        "analog-input,1",
+        "binary-output,2",
+    ]
+    assert [p["device"] for p in cache.query(types=["analog-input"])] == ["device,1", "device,2"]
+    assert [p["name"] for p in cache.query(prefixes=["AHU1"], types=["analog-input"])] == [
+        "AHU1-SAT"
+    ]
+    assert cache.query(devices=["device,2"], now=100)[0]["staleness"] == 10
+
+
+def test_failed_reads_keep_the_last_value():
+    cache = build_cache()
+    cache.update("device,2", {"analog-input,1": {"value": None}}, timestamp=120)
+    point = cache.query(devices=["device,2"], now=120)[0]
+    assert point["value"] == 72.5 and point["staleness"] == 30
+
+
+def test_rename_and_remove():
+    cache = build_cache()
+    cache.describe("device,1", {"analog-input,1": {"name": "RTU1-SAT"}})
+    assert cache.query(prefixes=["AHU1"])[0]["name"] == "AHU1-FAN"
+    cache.remove("device,1")
+    assert len(cache) == 1 and cache.query(prefixes=["RTU"]) == []
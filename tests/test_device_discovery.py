@@ -0,0 +1,128 @@
+import time
+import asyncio
+import logging
+from types import SimpleNamespace
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier
+from src.bacnet_client.Device import BacnetDevice
+from src.bacnet_client.DeviceManagement import DeviceManager
+from src.bacnet_client.MemoryClient import MemoryDatabase
+from src.bacnet_client.MongoClient import WriteExecutor
+
+
+class Store:
+    """The few Mongodb client calls device discovery makes, over an in-memory database."""
+
+    def __init__(self) -> None:
+        self.db = MemoryDatabase("test")
+
+    def getDb(self):
+        return self.db
+
+    def writer(self):
+        return WriteExecutor(4, logging.getLogger("test"))
+
+    async def replaceDocument(self, document, db, collectionName, upsert=False):
+        await db[collectionName].find_one_and_replace(
+            {"id": document["id"]}, document, upsert=upsert
+        )
+
+
+def passive_manager(store, answering=()):
+    async def who_is(low, high, address, timeout):
+        return [object()] if low == high and low in answering else []
+
+    manager = object.__new__(DeviceManager)
+    manager.settings = {"mode": "passive", "timeout": 1, "window": 4096, "confirmations": 32}
+    manager.leases = SimpleNamespace(
+        enabled=False, generation=0, owns=lambda id: True, ranges=lambda b=None: [(0, 4194303)]
+    )
+    manager.networks = SimpleNamespace(enabled=False)
+    manager.app = SimpleNamespace(who_is=who_is)
+    manager.mongo = store
+    manager.address = Address("*")
+    manager.highLimit = 4194303
+    manager.devices, manager.registry, manager.pending = set(), {}, set()
+    manager.sweepCursor, manager.lastCycle, manager.seedGeneration = 0, 0, 0
+    manager.logger = logging.getLogger("test")
+    return manager
+
+
+def device(instance: int):
+    return BacnetDevice(f"device,{instance}", "10.0.0.1", {}, doNormalize=False)
+
+
+def test_passive_cycle_inserts_a_new_device_into_a_populated_collection():
+    store = Store()
+    for instance in (1, 2, 3):
+        store.db["Devices"].store(dict(device(instance).spec))
+    manager = passive_manager(store)
+
+    async def cycle():
+        iam = SimpleNamespace(
+            iAmDeviceIdentifier=ObjectIdentifier("device,4"), pduSource=Address("10.0.0.4")
+        )
+        await manager.i_am(iam)
+        heard = await manager.passive_discovery()
+        assert list(heard) == [ObjectIdentifier("device,4")]
+        manager.devices.add(device(4))
+        await manager.commit()
+
+    asyncio.run(cycle())
+    stored = [d["id"] for d in store.db["Devices"].find({}).documents]
+    assert sorted(stored) == ["device,1", "device,2", "device,3", "device,4"]
+
+
+def test_quiet_devices_are_confirmed_concurrently_within_the_bound():
+    running, peak = [0], [0]
+
+    async def who_is(low, high, address, timeout):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return [object()] if low == high and low % 2 == 0 else []
+
+    manager = passive_manager(Store())
+    manager.app = SimpleNamespace(who_is=who_is)
+    manager.settings["confirmations"] = 4
+    manager.lastCycle = time.time()
+    for instance in range(20):
+        manager.registry[ObjectIdentifier(f"device,{instance}")] = {
+            "address": "10.0.0.1",
+            "lastSeen": 0,
+        }
+
+    asyncio.run(manager.passive_discovery())
+    assert peak[0] == 4
+    assert sorted(id[1] for id in manager.registry) == list(range(0, 20, 2))
+
+
+def test_a_device_that_fails_to_read_stays_pending_without_stopping_the_others():
+    manager = passive_manager(Store(), answering=(4, 5))
+    failing, read = {4}, []
+
+    async def read_device(id, address):
+        if id[1] in failing:
+            raise asyncio.TimeoutError("no response")
+        read.append(id[1])
+
+    manager.read_device = read_device
+
+    async def cycle():
+        for instance in (4, 5):
+            await manager.i_am(
+                SimpleNamespace(
+                    iAmDeviceIdentifier=ObjectIdentifier(f"device,{instance}"),
+                    pduSource=Address(f"10.0.0.{instance}"),
+                )
+            )
+        await manager.discover()
+
+    asyncio.run(cycle())
+    assert read == [5]
+    assert manager.pending == {ObjectIdentifier("device,4")}
+    # the next cycle reads it again, though its I-Ams still come from the same address
+    failing.clear()
+    asyncio.run(cycle())
+    assert read == [5, 4] and manager.pending == set()
@@ -0,0 +1,84 @@
+import json
+import asyncio
+import logging
+import tracemalloc
+from types import SimpleNamespace
+from collections import deque
+from src.bacnet_client.Diagnostics import DiagnosticsService
+
+
+def diagnostics(tmp_path, **settings):
+    service = object.__new__(DiagnosticsService)
+    service.localMgr = SimpleNamespace(respath=f"{tmp_path}/")
+    service.spans = deque(maxlen=100)
+    service.snapshot = None
+    service.flushing = None
+    service.settings = {
+        "section": "diagnostics",
+        "enable": True,
+        "output": "file",
+        "tracemalloc": 0,
+        "top": 5,
+        "spans": True,
+        **settings,
+    }
+    service.logger = logging.getLogger("test")
+    return service
+
+
+def spans_written(tmp_path) -> list:
+    lines = []
+    for path in (tmp_path / "Diagnostics").glob("spans-*.jsonl"):
+        lines.extend(json.loads(line) for line in path.read_text().splitlines())
+    return lines
+
+
+def test_spans_are_recorded_and_flushed(tmp_path):
+    service = diagnostics(tmp_path)
+
+    async def cycle(fail: bool):
+        await asyncio.sleep(0)
+        if fail:
+            raise ValueError("cycle failed")
+        return "done"
+
+    async def run():
+        assert await service.span("pollSrv", cycle(False)) == "done"
+        try:
+            await service.span("pollSrv", cycle(True))
+        except ValueError:
+            pass
+        await service.flush_spans()
+
+    asyncio.run(run())
+    spans = spans_written(tmp_path)
+    assert [span["error"] for span in spans] == [None, "ValueError('cycle failed')"]
+    assert all(span["service"] == "pollSrv" and span["seconds"] >= 0 for span in spans)
+    assert len(service.spans) == 0
+
+
+def test_spans_are_flushed_when_diagnostics_are_turned_off(tmp_path):
+    service = diagnostics(tmp_path)
+
+    async def run():
+        await service.span("devSrv", asyncio.sleep(0))
+        service.update("diagnostics", "enable", False)
+        await service.flushing
+
+    asyncio.run(run())
+    assert [span["service"] for span in spans_written(tmp_path)] == ["devSrv"]
+
+
+def test_tracemalloc_follows_the_settings(tmp_path):
+    service = diagnostics(tmp_path)
+    assert tracemalloc.is_tracing() is False
+    try:
+        service.update("diagnostics", "tracemalloc", 1)
+        assert tracemalloc.is_tracing() is True
+        report = service.allocations()
+        assert report["current"] > 0 and len(report["top"]) > 0
+        service.update("diagnostics", "enable", False)
+        assert tracemalloc.is_tracing() is False
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
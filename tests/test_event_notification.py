@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import pytz
+import pytest
+from types import SimpleNamespace
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier
+from bacpypes3.apdu import (
+    AcknowledgeAlarmRequest,
+    GetAlarmSummaryACK,
+    GetAlarmSummaryRequest,
+    GetEventInformationACK,
+    RejectPDU,
+)
+from bacpypes3.basetypes import (
+    EventState,
+    EventTransitionBits,
+    EventType,
+    GetAlarmSummaryAlarmSummary,
+    GetEventInformationEventSummary,
+    NotifyType,
+    TimeStamp,
+)
+from src.bacnet_client.EventNotification import EventService
+
+
+def event_service(responses: list, **settings):
+    """An event service whose app answers each request with the next of responses."""
+    requests, written = [], []
+
+    async def request(apdu):
+        requests.append(apdu)
+        response = responses.pop(0)
+        if isinstance(response, BaseException):
+            raise response
+        return response
+
+    async def writeDocument(document, db, collectionName):
+        written.append((collectionName, document))
+
+    service = object.__new__(EventService)
+    service.settings = {"processid": 1, "acknowledge": False, **settings}
+    service.app = SimpleNamespace(request=request)
+    service.mongo = SimpleNamespace(writeDocument=writeDocument, getDb=lambda: None)
+    service.localDevice = SimpleNamespace(settings={"tz": pytz.utc, "objectName": "gateway"})
+    service.logger = logging.getLogger("test")
+    return service, requests, written
+
+
+def page(*instances: int, more: bool = False):
+    return GetEventInformationACK(
+        listOfEventSummaries=[
+            GetEventInformationEventSummary(
+                objectIdentifier=ObjectIdentifier(f"analog-input,{i}"),
+                eventState=EventState.highLimit,
+                acknowledgedTransitions=EventTransitionBits([0, 1, 1]),
+                eventTimeStamps=[TimeStamp(sequenceNumber=i)] * 3,
+                notifyType=NotifyType.alarm,
+                eventEnable=EventTransitionBits([1, 1, 1]),
+                eventPriorities=[1, 1, 1],
+            )
+            for i in instances
+        ],
+        moreEvents=more,
+    )
+
+
+def events(service, deviceId="device,1"):
+    found = asyncio.run(service.event_information(deviceId, Address("10.0.0.1")))
+    return [(event["source"], event["object"]) for event in found]
+
+
+def test_event_information_pages_after_the_last_object():
+    service, requests, _ = event_service([page(1, 2, more=True), page(3)])
+    assert events(service) == [("event-information", f"analog-input,{i}") for i in (1, 2, 3)]
+    assert [r.lastReceivedObjectIdentifier for r in requests] == [
+        None, ObjectIdentifier("analog-input,2")
+    ]
+
+
+def test_a_rejected_first_page_falls_back_to_the_alarm_summary():
+    summary = GetAlarmSummaryACK(
+        listOfAlarmSummaries=[
+            GetAlarmSummaryAlarmSummary(
+                objectIdentifier=ObjectIdentifier("binary-input,7"),
+                alarmState=EventState.offnormal,
+                acknowledgedTransitions=EventTransitionBits([0, 1, 1]),
+            )
+        ]
+    )
+    service, requests, _ = event_service([RejectPDU(reason=9), summary])
+    assert events(service) == [("alarm-summary", "binary-input,7")]
+    assert isinstance(requests[-1], GetAlarmSummaryRequest)
+
+
+def test_a_failed_later_page_keeps_the_events_already_read():
+    service, requests, _ = event_service([page(1, 2, more=True), RejectPDU(reason=9)])
+    assert events(service) == [("event-information", f"analog-input,{i}") for i in (1, 2)]
+    # the alarm summary is only asked for when the first page fails
+    assert len(requests) == 2
+
+
+def notification(ackRequired: bool):
+    return SimpleNamespace(
+        pduSource=Address("10.0.0.1"),
+        initiatingDeviceIdentifier=ObjectIdentifier("device,1"),
+        eventObjectIdentifier=ObjectIdentifier("analog-input,1"),
+        timeStamp=TimeStamp(sequenceNumber=42),
+        processIdentifier=1,
+        notificationClass=3,
+        priority=100,
+        eventType=EventType.outOfRange,
+        messageText=None,
+        notifyType=NotifyType.alarm,
+        ackRequired=ackRequired,
+        fromState=EventState.normal,
+        toState=EventState.highLimit,
+    )
+
+
+@pytest.mark.parametrize(
+    "ackRequired, acknowledge, acknowledged",
+    [(True, True, True), (True, False, False), (False, True, False)],
+)
+def test_notifications_are_recorded_and_acknowledged_when_asked_and_allowed(
+    ackRequired, acknowledge, acknowledged
+):
+    service, requests, written = event_service([None], acknowledge=acknowledge)
+    asyncio.run(service.notification(notification(ackRequired)))
+    assert len(written) == 1
+    collection, event = written[0]
+    assert collection == "Events" and event["source"] == "notification"
+    assert event["object"] == "analog-input,1" and event["eventTimestamp"] == 42
+    assert event["ackRequired"] is ackRequired
+    assert [type(r) for r in requests] == ([AcknowledgeAlarmRequest] if acknowledged else [])
@@ -0,0 +1,10 @@
+from src.bacnet_client.Indexes import stages
+
+
+def test_stages_finds_nested_collection_scans():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]},
+    }
+    assert stages(plan) == {"FETCH", "OR", "IXSCAN", "COLLSCAN"}
+    assert "COLLSCAN" not in stages({"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}})
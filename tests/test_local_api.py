@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from src.bacnet_client.LocalApi import LocalApiService
+
+
+def local_api(**settings):
+    api = object.__new__(LocalApiService)
+    api.settings = {"timeout": 5, "maxheaders": 100, "linelimit": 8192, **settings}
+    api.routes = {"/ping": lambda query: {"pong": query.get("n", [""])[0]}}
+    api.logger = logging.getLogger("test")
+    return api
+
+
+def exchange(api, request: bytes, wait: float = 0) -> bytes:
+    async def run():
+        server = await asyncio.start_server(
+            api.handle, "127.0.0.1", 0, limit=api.settings.get("linelimit")
+        )
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            await writer.drain()
+            await asyncio.sleep(wait)
+            response = await reader.read()
+            writer.close()
+            return response
+
+    return asyncio.run(run())
+
+
+def test_routes_answer_with_json():
+    response = exchange(local_api(), b"GET /ping?n=1 HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 200 OK") and response.endswith(b'{"pong": "1"}')
+
+
+def test_a_failing_route_answers_with_an_error(caplog):
+    api = local_api()
+    api.routes["/fail"] = lambda query: 1 / 0
+    response = exchange(api, b"GET /fail HTTP/1.1\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 500 Internal Server Error")
+    assert any(r.levelname == "ERROR" and "/fail" in r.getMessage() for r in caplog.records)
+
+
+def test_a_client_that_stalls_is_timed_out():
+    response = exchange(local_api(timeout=0.1), b"GET /ping HTTP/1.1\r\n")
+    assert response.startswith(b"HTTP/1.1 408")
+
+
+def test_too_many_or_too_long_headers_are_refused():
+    headers = b"".join(b"X-%d: y\r\n" % n for n in range(20))
+    response = exchange(local_api(maxheaders=10), b"GET /ping HTTP/1.1\r\n" + headers + b"\r\n")
+    assert response.startswith(b"HTTP/1.1 431")
+    response = exchange(local_api(linelimit=256), b"GET /ping HTTP/1.1\r\nX: " + b"y" * 1024)
+    assert response.startswith(b"HTTP/1.1 431")
+
+
+def test_coroutine_routes_are_awaited():
+    api = local_api()
+
+    async def later(query):
+        await asyncio.sleep(0)
+        return "text/plain", "later"
+
+    api.routes["/later"] = later
+    response = exchange(api, b"GET /later HTTP/1.1\r\n\r\n")
+    assert response.startswith(b"HTTP/1.1 200 OK") and response.endswith(b"later")
@@ -0,0 +1,32 @@
+from src.bacnet_client.Metrics import MetricsRegistry
+
+
+def test_counter_and_gauge_exposition():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests", ("device",))
+    requests.inc(device="1.2.3.4")
+    requests.inc(2, device="1.2.3.4")
+    assert registry.counter("requests_total", "Requests", ("device",)) is requests
+    registry.gauge("in_flight", "In flight").set(3)
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{device="1.2.3.4"} 3' in text
+    assert "in_flight 3" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    latency = registry.histogram("latency_seconds", "Latency", ("op",), buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 5):
+        latency.observe(value, op="read")
+    text = registry.render()
+    assert 'latency_seconds_bucket{op="read",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{op="read",le="1"} 3' in text
+    assert 'latency_seconds_bucket{op="read",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{op="read"} 4' in text
+
+
+def test_label_values_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors", ("message",)).inc(message='say "hi"\n')
+    assert 'errors_total{message="say \\"hi\\"\\n"} 1' in registry.render()
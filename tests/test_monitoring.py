@@ -0,0 +1,81 @@
+import sys
+import time
+import types
+import asyncio
+import logging
+import threading
+from src.bacnet_client.Monitoring import LoopMonitor, install_event_loop
+
+
+def loop_monitor(threshold: int):
+    monitor = object.__new__(LoopMonitor)
+    monitor.beat = (0, time.monotonic(), 0)
+    monitor.sampled = (0, None)
+    monitor.worst, monitor.stalls = [], []
+    monitor.settings = {"threshold": threshold, "interval": 300, "top": 5}
+    monitor.logger = logging.getLogger("test")
+    return monitor
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+def test_stalls_are_recorded_with_the_blocking_stack():
+    # the watchdog starts with a threshold that would miss the stall, and must pick up the
+    # lower one set while it runs
+    monitor = loop_monitor(threshold=1000)
+
+    async def run():
+        monitor.loopThread = threading.get_ident()
+        stopped = threading.Event()
+        watchdog = threading.Thread(target=monitor.watch, args=(stopped,), daemon=True)
+        watchdog.start()
+        monitor.settings["threshold"] = 50
+        await asyncio.sleep(0.3)
+
+        async def block():
+            await asyncio.sleep(0.05)
+            blocking_call()
+
+        blocker = asyncio.ensure_future(block())
+        for _ in range(10):
+            await monitor.heartbeat()
+        await blocker
+        stopped.set()
+        watchdog.join()
+
+    asyncio.run(run())
+    seconds, _, stack = max(monitor.worst)
+    assert seconds >= 0.2
+    assert "blocking_call" in stack
+    monitor.report()
+    assert monitor.query_stalls({})[0]["seconds"] == seconds
+
+
+def test_worst_stalls_are_kept():
+    monitor = loop_monitor(threshold=50)
+    for seconds in (0.1, 0.5, 0.2, 0.9, 0.3, 0.4, 0.05):
+        monitor.record(seconds)
+    assert sorted(s for s, _, _ in monitor.worst) == [0.2, 0.3, 0.4, 0.5, 0.9]
+
+
+def test_install_event_loop(capsys):
+    policy = asyncio.get_event_loop_policy()
+    try:
+        install_event_loop("asyncio")
+        assert asyncio.get_event_loop_policy() is policy
+
+        sys.modules["uvloop"] = None  # not installed
+        install_event_loop("uvloop")
+        assert asyncio.get_event_loop_policy() is policy
+        assert "uvloop is not installed" in capsys.readouterr().out
+
+        uvloop = types.ModuleType("uvloop")
+        uvloop.EventLoopPolicy = type("EventLoopPolicy", (asyncio.DefaultEventLoopPolicy,), {})
+        sys.modules["uvloop"] = uvloop
+        install_event_loop("uvloop")
+        assert isinstance(asyncio.get_event_loop_policy(), uvloop.EventLoopPolicy)
+    finally:
+        sys.modules.pop("uvloop", None)
+        asyncio.set_event_loop_policy(policy)
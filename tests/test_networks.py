@@ -0,0 +1,41 @@
+import asyncio
+import time
+from src.bacnet_client.Networks import NetworkLimiter, network_of
+
+
+def test_network_of_addresses():
+    assert network_of("192.168.1.20") == 0
+    assert network_of("2:5") == 2
+    assert network_of(None) == 0
+
+
+def test_limiter_bounds_concurrency():
+    limiter = NetworkLimiter(2, 0)
+    running = []
+    peak = []
+
+    async def request():
+        async with limiter:
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def main():
+        await asyncio.gather(*(request() for _ in range(6)))
+
+    asyncio.run(main())
+    assert max(peak) == 2
+
+
+def test_limiter_rate():
+    limiter = NetworkLimiter(10, 50)
+
+    async def main():
+        for _ in range(6):
+            async with limiter:
+                pass
+
+    start = time.monotonic()
+    asyncio.run(main())
+    assert time.monotonic() - start >= 0.09
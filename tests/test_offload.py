@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import threading
+import pytest
+from src.bacnet_client.Offload import Offloader
+
+
+def offloader(**settings):
+    offload = object.__new__(Offloader)
+    offload.settings = {"section": "offload", "workers": 2, "bytes": 64, "objects": 10, **settings}
+    offload.executor = None
+    offload.logger = logging.getLogger("test")
+    return offload
+
+
+def thread_name():
+    return threading.current_thread().name
+
+
+def test_work_under_the_threshold_runs_inline():
+    offload = offloader()
+
+    async def run():
+        return await offload.call(9, "objects", thread_name), threading.current_thread().name
+
+    name, loop = asyncio.run(run())
+    assert name == loop and offload.executor is None
+
+
+def test_work_at_the_threshold_runs_on_the_pool():
+    offload = offloader()
+    assert asyncio.run(offload.call(10, "objects", thread_name)).startswith("offload")
+    assert asyncio.run(offload.call(64, "bytes", thread_name)).startswith("offload")
+    offload.executor.shutdown()
+
+
+def test_pickles_are_replaced_atomically(tmp_path):
+    offload = offloader(bytes=0)
+    path = str(tmp_path / "object-graph.pkl")
+    asyncio.run(offload.dump_pickle({"device,1": {}}, path))
+    asyncio.run(offload.dump_pickle({"device,2": {}}, path))
+    assert asyncio.run(offload.load_pickle(path)) == {"device,2": {}}
+    # a dump that fails leaves the last complete pickle in place
+    with pytest.raises(Exception):
+        asyncio.run(offload.dump_pickle({"device,3": lambda: None}, path))
+    assert asyncio.run(offload.load_pickle(path)) == {"device,2": {}}
+    offload.executor.shutdown()
+
+
+def test_changing_workers_recreates_the_pool():
+    offload = offloader()
+    asyncio.run(offload.call(10, "objects", thread_name))
+    executor = offload.executor
+    offload.update("offload", "workers", 4)
+    assert offload.executor is None
+    asyncio.run(offload.call(10, "objects", thread_name))
+    assert offload.executor is not executor and offload.executor._max_workers == 4
+    offload.executor.shutdown()
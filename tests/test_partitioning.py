@@ -0,0 +1,70 @@
+import asyncio
+import datetime as dt
+from src.bacnet_client.MemoryClient import MemoryDatabase
+from src.bacnet_client.Partitioning import LeaseTable
+
+
+def renew_all(tables, now):
+    for table in tables:
+        table.db.clock = lambda: dt.datetime.fromtimestamp(now, tz=dt.timezone.utc)
+        asyncio.run(table.renew())
+
+
+def test_leases_are_exclusive_and_balanced():
+    db = MemoryDatabase("test")
+    tables = [LeaseTable(db, f"gw-{i}", buckets=16, ttl=30) for i in range(3)]
+    for now in (0, 10, 20):
+        renew_all(tables, now)
+    owned = [table.owned for table in tables]
+    assert set().union(*owned) == set(range(16))
+    assert sum(len(o) for o in owned) == 16
+    assert all(4 <= len(o) <= 6 for o in owned)
+
+
+def test_rebalance_on_join_and_expiry():
+    db = MemoryDatabase("test")
+    first = LeaseTable(db, "gw-0", buckets=8, ttl=30)
+    renew_all([first], 0)
+    assert first.owned == set(range(8))
+
+    second = LeaseTable(db, "gw-1", buckets=8, ttl=30)
+    renew_all([second, first, second], 10)
+    assert len(first.owned) == 4 and len(second.owned) == 4
+    assert first.owned.isdisjoint(second.owned)
+
+    # gw-0 stops renewing, gw-1 takes its buckets over once the leases expire
+    renew_all([second], 20)
+    assert len(second.owned) == 4
+    renew_all([second], 45)
+    assert second.owned == set(range(8))
+
+
+def test_leases_expire_by_the_server_clock():
+    db = MemoryDatabase("test")
+    table = LeaseTable(db, "gw-0", buckets=4, ttl=30)
+    renew_all([table], 1000)
+    # the gateway's own clock plays no part: expiry is counted from the heartbeat's time
+    leases = db["Leases"].find({}).documents
+    assert {lease["expires"] for lease in leases} == {1030}
+
+
+def test_device_ownership_follows_buckets():
+    db = MemoryDatabase("test")
+    table = LeaseTable(db, "gw-0", buckets=8, ttl=30)
+    renew_all([table], 0)
+    assert table.owns("device,100001")
+    table.owned = set()
+    assert not table.owns("device,100001")
+    assert table.bucket_of("device,100001") == table.bucket_of("device, 100001")
+
+
+def test_buckets_are_contiguous_instance_ranges():
+    table = LeaseTable(MemoryDatabase("test"), "gw-0", buckets=4, low=1000, high=1999)
+    assert [table.bucket_of(f"device,{i}") for i in (1000, 1249, 1250, 1999)] == [0, 0, 1, 3]
+    # instances outside the partitioned range go to the first and last buckets
+    assert table.bucket_of("device,5") == 0 and table.bucket_of("device,4000000") == 3
+    assert table.ranges({0, 1, 3}) == [(0, 1499), (1750, 4194303)]
+    assert table.ranges(set(range(4))) == [(0, 4194303)]
+    for bucket in range(4):
+        for low, high in table.ranges({bucket}):
+            assert {table.bucket_of(f"device,{i}") for i in (low, high)} == {bucket}
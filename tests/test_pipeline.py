@@ -0,0 +1,41 @@
+import asyncio
+from src.bacnet_client.Pipeline import Pipeline
+
+
+def test_items_stream_through_with_a_bounded_read_ahead():
+    read, written, ahead = [0], [], [0]
+
+    async def source():
+        for n in range(50):
+            read[0] += 1
+            ahead[0] = max(ahead[0], read[0] - len(written))
+            yield n
+
+    async def double(n):
+        return n * 2
+
+    async def write(n):
+        await asyncio.sleep(0.001)
+        written.append(n)
+        return n
+
+    pipeline = Pipeline("test", maxsize=2).stage("double", double).stage("write", write)
+    count = asyncio.run(pipeline.run(source()))
+    assert count == 50 and written == [n * 2 for n in range(50)]
+    # two queues of two items, plus the item each stage is working on
+    assert ahead[0] <= 2 * 2 + 2 + 1
+
+
+def test_failed_and_dropped_items_do_not_stop_the_others():
+    async def source():
+        for n in range(6):
+            yield n
+
+    async def check(n):
+        if n == 2:
+            raise ValueError("bad item")
+        return None if n == 4 else n
+
+    pipeline = Pipeline("test").stage("check", check)
+    assert asyncio.run(pipeline.run(source())) == 4
+    assert pipeline.errors == 1
@@ -0,0 +1,34 @@
+import asyncio
+from types import SimpleNamespace
+from src.bacnet_client.Pipeline import Pipeline
+from src.bacnet_client.PointPolling import PollService
+
+
+def test_networked_polls_are_bounded_by_inflight():
+    running, peak, held, peakHeld = [0], [0], [0], [0]
+
+    async def poll_device(k):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.001 * (k % 3))
+        running[0] -= 1
+        held[0] += 1
+        peakHeld[0] = max(peakHeld[0], held[0])
+        return k, {}
+
+    async def write(item):
+        await asyncio.sleep(0.002)
+        held[0] -= 1
+        return item
+
+    service = object.__new__(PollService)
+    service.settings = {"inflight": 3}
+    service.object_graph = {k: {} for k in range(40)}
+    service.networks = SimpleNamespace(enabled=True, report=lambda name, devices: None)
+    service.poll_device = poll_device
+
+    pipeline = Pipeline("test", maxsize=2).stage("write", write)
+    assert asyncio.run(pipeline.run(service.read())) == 40
+    assert peak[0] == 3
+    # polls done but not written: the queue, the one being written, and the ones in flight
+    assert peakHeld[0] <= 2 + 1 + 3
@@ -0,0 +1,47 @@
+import asyncio
+from src.bacnet_client.PointStore import bucket_of, bucket_documents, device_specs
+from src.bacnet_client.MemoryClient import MemoryCollection
+from src.bacnet_client.MongoClient import Mongodb
+
+
+def device_spec(points: int) -> dict:
+    return {
+        "id": "device,1",
+        "name": "AHU1",
+        "address": "10.0.0.5",
+        "points": {f"analog-value,{i}": {"value": i} for i in range(points)},
+    }
+
+
+def test_buckets_are_stable_and_bounded():
+    spec = device_spec(450)
+    buckets = bucket_of(spec["points"], 200)
+    assert sorted(set(buckets.values())) == [0, 1, 2]
+    assert bucket_of(reversed(list(spec["points"])), 200) == buckets
+    documents = bucket_documents(spec, 200)
+    assert [len(d["points"]) for d in documents] == [200, 200, 50]
+
+
+def test_bucket_documents_reassemble_into_device_spec():
+    spec = device_spec(5)
+    (reassembled,) = device_specs("bucket", bucket_documents(spec, 2))
+    assert reassembled["points"] == spec["points"]
+    assert reassembled["name"] == "AHU1" and reassembled["address"] == "10.0.0.5"
+
+
+def test_memory_bulk_write_upserts_updates_and_deletes():
+    collection = MemoryCollection("PointRecords")
+    operations = [
+        {"op": "replace", "filter": {"id": "d", "point": p}, "document": {"id": "d", "point": p}}
+        for p in ("a", "b", "c")
+    ]
+    for operation in operations:
+        operation["upsert"] = True
+    operations.append({"op": "delete", "filter": {"id": "d", "point": {"$nin": ["a", "b"]}}})
+    operations.append(
+        {"op": "update", "filter": {"id": "d", "point": "a"}, "update": {"$set": {"spec.value": 1}}}
+    )
+    result = asyncio.run(collection.bulk_write(Mongodb.requests(operations)))
+    assert result.upserted_count == 3 and result.deleted_count == 1
+    points = {d["point"]: d for _, d in collection.scan()}
+    assert set(points) == {"a", "b"} and points["a"]["spec"]["value"] == 1
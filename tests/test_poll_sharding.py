@@ -0,0 +1,78 @@
+import queue
+import asyncio
+import logging
+import bson
+from types import SimpleNamespace
+from src.bacnet_client.PollSharding import PollSupervisor
+
+
+def supervisor(count: int):
+    supervisor = object.__new__(PollSupervisor)
+    supervisor.count = count
+    supervisor.context = SimpleNamespace(Queue=queue.Queue)
+    supervisor.results = queue.Queue()
+    supervisor.workers = []
+    supervisor.logger = logging.getLogger("test")
+    return supervisor
+
+
+def graph(sizes: dict) -> dict:
+    return {k: {f"analog-input,{i}": {} for i in range(n)} for k, n in sizes.items()}
+
+
+def test_devices_are_partitioned_largest_first():
+    shards = supervisor(3).partition(
+        graph({"device,1": 10, "device,2": 7, "device,3": 6, "device,4": 4, "device,5": 3})
+    )
+    assert [list(shard) for shard in shards] == [
+        ["device,1"], ["device,2", "device,5"], ["device,3", "device,4"]
+    ]
+    assert [sum(len(v) for v in shard.values()) for shard in shards] == [10, 10, 10]
+
+
+def test_every_device_lands_in_one_shard():
+    object_graph = graph({f"device,{i}": i % 7 for i in range(50)})
+    shards = supervisor(4).partition(object_graph)
+    devices = [k for shard in shards for k in shard]
+    assert sorted(devices) == sorted(object_graph)
+    # largest-first keeps the loads within one device of each other
+    loads = [sum(len(v) for v in shard.values()) for shard in shards]
+    assert max(loads) - min(loads) <= 6
+
+
+def test_more_workers_than_devices_leaves_shards_empty():
+    shards = supervisor(4).partition(graph({"device,1": 2, "device,2": 1}))
+    assert [list(shard) for shard in shards] == [["device,1"], ["device,2"], [], []]
+
+
+class Process:
+    def __init__(self) -> None:
+        self.alive, self.terminated = True, False
+
+    def is_alive(self):
+        return self.alive
+
+    def terminate(self):
+        self.terminated = True
+
+    def join(self, timeout=None):
+        self.alive = False
+
+
+def test_stuck_workers_are_stopped_and_the_results_queue_replaced():
+    poller = supervisor(2)
+    processes = [Process(), Process()]
+    poller.workers = [(process, queue.Queue()) for process in processes]
+    poller.start = lambda: None
+    stale = poller.results
+    # worker 0 polls its device and finishes, worker 1 never answers
+    stale.put(("device", 0, "device,1", bson.encode({"analog-input,0": {"value": 1}})))
+    stale.put(("done", 0, None, None))
+
+    async def run():
+        return [item async for item in poller.poll(graph({"device,1": 1, "device,2": 1}), 0.1)]
+
+    assert asyncio.run(run()) == [("device,1", {"analog-input,0": {"value": 1}})]
+    assert [p.terminated for p in processes] == [False, True]
+    assert not any(p.is_alive() for p in processes) and poller.workers == []
+    assert poller.results is not stale
@@ -0,0 +1,135 @@
+import asyncio
+import pymongo
+import pytest
+import logging
+import configparser
+from collections import deque
+from types import SimpleNamespace
+from src.bacnet_client.MongoClient import Mongodb
+from src.bacnet_client.RemoteManagement import EventManager
+
+
+def event_manager(tmp_path, writes, syncs):
+    config = configparser.ConfigParser()
+    config.read_dict({"device": {"nukid": "1"}, "point-polling": {"interval": "60"}})
+
+    async def write_text(text, path):
+        writes.append((text, path))
+
+    manager = object.__new__(EventManager)
+    manager.store, manager.pending, manager.window = deque(), None, 0
+    manager.localMgr = SimpleNamespace(
+        config=config, respath=f"{tmp_path}/", sync_options=syncs.append
+    )
+    manager.localConfig = {section: dict(config[section]) for section in config.sections()}
+    manager.offload = SimpleNamespace(write_text=write_text)
+    manager.tokenPath = str(tmp_path / "resume-token.json")
+    manager.logger = logging.getLogger("test")
+    return manager
+
+
+def change(n: int, fields: dict) -> dict:
+    return {"_id": {"_data": str(n)}, "updateDescription": {"updatedFields": fields}}
+
+
+def test_a_burst_of_changes_is_written_and_synced_once(tmp_path):
+    writes, syncs = [], []
+    manager = event_manager(tmp_path, writes, syncs)
+
+    async def burst():
+        for n in range(30):
+            await manager.ingest(change(n, {"point-polling.interval": 60 + n}))
+        await manager.ingest(change(30, {"point-polling.enable": True}))
+        await manager.pending
+
+    asyncio.run(burst())
+    assert len(writes) == 1 and "interval = 89" in writes[0][0]
+    assert syncs == [{("point-polling", "interval"): 89, ("point-polling", "enable"): True}]
+    assert manager.load_resume_token() == {"_data": "30"}
+
+
+def test_an_invalid_field_is_skipped_without_dropping_the_batch(tmp_path):
+    writes, syncs = [], []
+    manager = event_manager(tmp_path, writes, syncs)
+
+    async def burst():
+        await manager.ingest(change(0, {"missing.option": 1, "point-polling.interval": 30}))
+        await manager.ingest(change(1, {"toplevel": 1, "point-polling.enable": {"a": 1}}))
+        await manager.ingest({"_id": {"_data": "2"}})  # no updateDescription
+        await manager.ingest(change(3, {"device.nukid": "2"}))
+        await manager.pending
+
+    asyncio.run(burst())
+    assert len(writes) == 1
+    assert syncs == [{("point-polling", "interval"): 30, ("device", "nukid"): "2"}]
+    assert manager.localMgr.config.get("point-polling", "interval") == "30"
+
+
+def test_the_resume_token_round_trips_through_an_atomic_replace(tmp_path):
+    manager = event_manager(tmp_path, [], [])
+    assert manager.load_resume_token() is None
+    manager.save_resume_token({"_data": "8263"})
+    manager.save_resume_token({"_data": "8264"})
+    assert manager.load_resume_token() == {"_data": "8264"}
+    assert [p.name for p in tmp_path.iterdir()] == ["resume-token.json"]
+    manager.clear_resume_token()
+    assert manager.load_resume_token() is None
+
+
+def test_a_corrupt_resume_token_is_ignored(tmp_path):
+    manager = event_manager(tmp_path, [], [])
+    (tmp_path / "resume-token.json").write_text('{"_data": ')
+    assert manager.load_resume_token() is None
+
+
+class Stream:
+    def __init__(self, error, events) -> None:
+        self.error, self.events, self.resume_token = error, events, None
+
+    async def __aenter__(self):
+        if self.error is not None:
+            raise self.error
+        return self
+
+    async def __aexit__(self, *exc_details):
+        return False
+
+    async def __aiter__(self):
+        for event in self.events:
+            self.resume_token = event["_id"]
+            yield event
+
+
+@pytest.mark.parametrize("code", [260, 280, 286])
+def test_an_unresumable_stream_clears_the_token_and_resyncs(tmp_path, monkeypatch, code):
+    monkeypatch.setattr(Mongodb, "_Mongodb__watch_backoff", (0, 0))
+    manager = event_manager(tmp_path, [], [])
+    manager.save_resume_token({"_data": "1"})
+    calls, resumed = [], []
+    streams = [
+        Stream(pymongo.errors.OperationFailure("lost", code=code), []),
+        Stream(None, [change(2, {})]),
+    ]
+
+    def watch(pipeline, resume_after=None):
+        resumed.append(resume_after)
+        return streams.pop(0)
+
+    async def resync(mongo):
+        calls.append("resync")
+
+    async def ingest(event):
+        calls.append("ingest")
+        raise asyncio.CancelledError
+
+    manager.resync, manager.ingest = resync, ingest
+    mongo = object.__new__(Mongodb)
+    mongo.logger = logging.getLogger("test")
+    db = {"Configuration": SimpleNamespace(watch=watch)}
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(
+            mongo.watch_collection(db, "Configuration", [], manager, {"_data": "1"})
+        )
+    assert resumed == [{"_data": "1"}, None]
+    assert calls == ["resync", "ingest"]
+    assert manager.load_resume_token() is None
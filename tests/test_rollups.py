@@ -0,0 +1,27 @@
+from src.bacnet_client.Rollups import Rollups, documents
+
+
+def test_windows_close_on_the_clock_and_cascade():
+    rollups = Rollups()
+    closed = []
+    # a poll every 20 seconds for 20 minutes, the analog input reading the cycle number
+    for cycle in range(61):
+        closed.extend(rollups.advance(cycle * 20.0))
+        specs = {"analog-input,1": {"value": float(cycle), "last synced": "t"}}
+        if cycle % 2 == 0:
+            specs["binary-value,1"] = {"value": "active", "last synced": "t"}
+        specs["character-string-value,1"] = {"value": "text", "last synced": "t"}
+        rollups.record("device,1", specs)
+
+    minutes = [documents(s) for s in closed if s[0] == "1m"]
+    assert len(minutes) == 20 and [s[0] for s in closed].count("15m") == 1
+    first = {d["meta"]["point"]: d for d in minutes[0]}
+    assert set(first) == {"analog-input,1", "binary-value,1"}
+    assert first["analog-input,1"]["count"] == 3
+    assert (first["analog-input,1"]["min"], first["analog-input,1"]["max"]) == (0.0, 2.0)
+    assert first["analog-input,1"]["last"] == 2.0 and first["binary-value,1"]["count"] == 2
+
+    quarter = documents(next(s for s in closed if s[0] == "15m"))
+    analog = next(d for d in quarter if d["meta"]["point"] == "analog-input,1")
+    assert analog["count"] == 45 and analog["sum"] == sum(range(45))
+    assert analog["avg"] == 22.0 and analog["timestamp"].timestamp() == 0
@@ -0,0 +1,47 @@
+from src.bacnet_client.Samples import SampleBuffer
+
+
+def poll(buffer, timestamp, device, values: dict):
+    buffer.advance(timestamp)
+    buffer.record(device, {obj: {"value": v, "last synced": "t"} for obj, v in values.items()})
+
+
+def test_windows_wrap_around_and_carry_missed_reads():
+    buffer = SampleBuffer(4)
+    for t in range(6):
+        values = {"analog-input,1": float(t)}
+        if t != 4:
+            values["binary-output,2"] = "active" if t % 2 else "inactive"
+        poll(buffer, 100 + t * 10, "device,1", values)
+
+    aggregates = buffer.aggregate()
+    assert aggregates[("device,1", "analog-input,1")] == {
+        "count": 4, "min": 2.0, "max": 5.0, "avg": 3.5, "last": 5.0
+    }
+    # the binary output was not read at t=4, and kept its value of t=3 for that sample
+    assert buffer.series("device,1", "binary-output,2") == [
+        (120.0, 0.0), (130.0, 1.0), (140.0, 1.0), (150.0, 1.0)
+    ]
+    assert buffer.aggregate(seconds=10)[("device,1", "analog-input,1")]["count"] == 2
+
+
+def test_memory_stays_fixed_as_devices_come_and_go():
+    buffer = SampleBuffer(8, bits=32)
+    poll(buffer, 0, "device,1", {f"analog-value,{i}": i for i in range(10)})
+    nbytes = buffer.nbytes
+    buffer.remove("device,1")
+    poll(buffer, 1, "device,2", {f"analog-value,{i}": i for i in range(10)})
+    assert buffer.nbytes == nbytes and len(buffer) == 10
+    # a new point only counts the samples taken since it appeared
+    assert buffer.aggregate()[("device,2", "analog-value,3")]["count"] == 1
+
+
+def test_a_plan_summarizes_like_the_aggregate():
+    buffer = SampleBuffer(4)
+    for t in range(7):
+        poll(buffer, t, "device,1", {f"analog-value,{i}": float(t * i) for i in range(3)})
+    head, rows = buffer.plan(seconds=2)
+    # the plan is taken on the loop: polling on meanwhile does not change what it reduces
+    expected = buffer.aggregate(seconds=2)
+    poll(buffer, 7, "device,1", {"analog-value,3": 1.0})
+    assert buffer.summarize(head, rows) == expected
@@ -0,0 +1,69 @@
+import asyncio
+import threading
+from src.bacnet_client.Spool import WriteSpool
+
+
+def test_spool_replays_in_order(tmp_path):
+    async def run():
+        spool = WriteSpool(str(tmp_path / "spool.sqlite3"), 1024 * 1024, batchSize=2)
+        for i in range(3):
+            await spool.append("db", "Logs", "insert", {"documents": [{"n": i}]})
+        assert spool.pending
+        batch = await spool.peek()
+        assert [args["documents"][0]["n"] for _, _, _, _, args in batch] == [0, 1]
+        await spool.remove(batch[-1][0])
+        assert spool.count == 1
+        assert (await spool.peek())[0][4]["documents"][0]["n"] == 2
+
+    asyncio.run(run())
+
+
+def test_spool_survives_restart(tmp_path):
+    path = str(tmp_path / "spool.sqlite3")
+    spool = WriteSpool(path, 1024 * 1024)
+    asyncio.run(
+        spool.append("db", "Points", "update", {"query": {"id": "device,1"}, "update": {}})
+    )
+    spool.close()
+    reopened = WriteSpool(path, 1024 * 1024)
+    reopened.open()
+    assert reopened.count == 1 and reopened.size == spool.size
+
+
+def test_spool_evicts_oldest_writes(tmp_path):
+    async def run():
+        spool = WriteSpool(str(tmp_path / "spool.sqlite3"), 2000)
+        for i in range(100):
+            await spool.append(
+                "db", "Logs", "insert", {"documents": [{"n": i, "pad": "x" * 50}]}
+            )
+        assert spool.size <= 2000
+        assert spool.evicted > 0
+        assert (await spool.peek())[-1][4]["documents"][0]["n"] == 99
+
+    asyncio.run(run())
+
+
+def test_spool_writes_run_off_the_loop_in_order(tmp_path):
+    threads = set()
+
+    async def run():
+        spool = WriteSpool(str(tmp_path / "spool.sqlite3"), 1024 * 1024)
+        insert = spool.insert
+
+        def recording(*args):
+            threads.add(threading.current_thread().name)
+            insert(*args)
+
+        spool.insert = recording
+        await asyncio.gather(
+            *(spool.append("db", "Logs", "insert", {"documents": [{"n": i}]}) for i in range(20))
+        )
+        assert spool.count == 20
+        batch = await spool.peek()
+        assert [args["documents"][0]["n"] for _, _, _, _, args in batch] == list(range(20))
+        await spool.remove(batch[-1][0])
+        assert spool.count == 0 and spool.size == 0
+
+    asyncio.run(run())
+    assert threads == {"spool_0"}
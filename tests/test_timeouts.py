@@ -0,0 +1,28 @@
+from src.bacnet_client.Timeouts import RttEstimator
+
+
+def test_estimator_converges_on_round_trip():
+    estimator = RttEstimator()
+    assert estimator.timeout(0.1, 10, 3) == 3
+    for _ in range(50):
+        estimator.sample(0.5)
+    assert abs(estimator.srtt - 0.5) < 0.01
+    assert 0.5 <= estimator.timeout(0.1, 10, 3) < 0.6
+
+
+def test_estimator_is_clamped():
+    estimator = RttEstimator(srtt=0.01, rttvar=0.001)
+    assert estimator.timeout(0.2, 10, 3) == 0.2
+    estimator = RttEstimator(srtt=8, rttvar=2)
+    assert estimator.timeout(0.2, 10, 3) == 10
+
+
+def test_failures_back_off_and_cut_retries():
+    estimator = RttEstimator(srtt=0.5, rttvar=0.1)
+    base = estimator.timeout(0.1, 60, 3)
+    estimator.failure()
+    estimator.failure()
+    assert estimator.timeout(0.1, 60, 3) == base * 4
+    assert estimator.retries(3) == 1
+    estimator.sample(0.5)
+    assert estimator.failures == 0 and estimator.retries(3) == 3
@@ -0,0 +1,17 @@
+import datetime as dt
+from bacpypes3.primitivedata import Date, Time, Unsigned
+from bacpypes3.basetypes import DateTime, TimeStamp
+from src.bacnet_client.Timestamps import to_datetime, to_timestamp
+
+
+def test_date_time_converts_to_an_aware_datetime():
+    stamp = DateTime(date=Date("2024-03-05"), time=Time("06:07:08.09"))
+    assert to_datetime(stamp, dt.timezone.utc) == dt.datetime(
+        2024, 3, 5, 6, 7, 8, 90000, tzinfo=dt.timezone.utc
+    )
+    assert to_timestamp(TimeStamp(dateTime=stamp), dt.timezone.utc).year == 2024
+
+
+def test_other_time_stamp_choices():
+    assert to_timestamp(TimeStamp(sequenceNumber=Unsigned(42)), dt.timezone.utc) == 42
+    assert to_timestamp(None, dt.timezone.utc) is None
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import pytz
+from types import SimpleNamespace
+from bacpypes3.basetypes import DateTime
+from bacpypes3.primitivedata import Date, Time
+from src.bacnet_client.Trend import TrendLog
+from src.bacnet_client.TrendCollection import TrendService
+
+
+class Buffer:
+    """A trend log buffer holding records oldest to newest, read in pages of at most page."""
+
+    def __init__(self, oldest: int, newest: int, page: int = 1000) -> None:
+        self.oldest, self.newest, self.page = oldest, newest, page
+        self.requests = []
+
+    def record(self, sequence: int):
+        minute, second = divmod(sequence % 3600, 60)
+        return SimpleNamespace(
+            timestamp=DateTime(date=Date("2026-10-19"), time=Time(f"12:{minute:02}:{second:02}")),
+            logDatum=SimpleNamespace(realValue=float(sequence)),
+        )
+
+    async def read(self, prop):
+        if prop == "recordCount":
+            return self.newest - self.oldest + 1
+        return self.newest
+
+    async def read_range(self, request):
+        start = request.bySequenceNumber.referenceSequenceNumber
+        self.requests.append(start)
+        if self.page == 0:
+            return [], None, True
+        end = min(start + min(request.bySequenceNumber.count, self.page) - 1, self.newest)
+        items = [self.record(n) for n in range(start, end + 1)]
+        return items, start, end < self.newest
+
+
+def trend_log(buffer: Buffer, id: str = "device,1", obj: str = "trend-log,1"):
+    log = TrendLog(
+        None, SimpleNamespace(settings={"tz": pytz.utc}), {"id": id, "address": "10.0.0.1"}, obj
+    )
+    log.read, log.read_range = buffer.read, buffer.read_range
+    return log
+
+
+def fetch(log, lastSequence, chunk: int):
+    records, last = asyncio.run(log.fetch_since(lastSequence, chunk))
+    return [record["sequence"] for record in records], last
+
+
+def test_new_records_are_paged_while_more_items_are_flagged():
+    buffer = Buffer(1, 25, page=4)
+    sequences, last = fetch(trend_log(buffer), 10, 10)
+    assert sequences == list(range(11, 26)) and last == 25
+    # pages come back shorter than asked for, each request follows the last record read
+    assert buffer.requests == [11, 15, 19, 23]
+
+
+def test_an_empty_page_ends_the_fetch():
+    buffer = Buffer(1, 25, page=0)
+    assert fetch(trend_log(buffer), 10, 10) == ([], 10) and buffer.requests == [11]
+
+
+def test_nothing_new_reads_no_page():
+    buffer = Buffer(1, 25)
+    assert fetch(trend_log(buffer), 25, 10) == ([], 25) and buffer.requests == []
+
+
+def test_a_reset_buffer_is_read_from_its_oldest_record():
+    buffer = Buffer(1, 5)
+    assert fetch(trend_log(buffer), 900, 10) == ([1, 2, 3, 4, 5], 5)
+
+
+def test_overwritten_records_are_skipped():
+    buffer = Buffer(51, 60)
+    sequences, last = fetch(trend_log(buffer), 20, 100)
+    assert sequences == list(range(51, 61)) and last == 60
+    assert buffer.requests == [51]
+
+
+def test_collection_persists_the_last_sequence_of_each_log(tmp_path):
+    buffers = {"trend-log,1": Buffer(1, 3), "trend-log,2": Buffer(1, 5)}
+    written = []
+
+    async def writeDocuments(documents, db, collectionName):
+        written.extend((collectionName, d["meta"]["log"], d["sequence"]) for d in documents)
+
+    service = object.__new__(TrendService)
+    service.settings = {"chunk": 100}
+    service.sequences = {"device,1/trend-log,2": 3}
+    service.sq_fp = str(tmp_path / "trend-sequences.json")
+    service.mongo = SimpleNamespace(writeDocuments=writeDocuments, getDb=lambda: None)
+    service.logger = logging.getLogger("test")
+
+    async def discover():
+        return [trend_log(buffer, obj=obj) for obj, buffer in buffers.items()]
+
+    service.discover = discover
+    asyncio.run(service.collect())
+    assert written == [("Trends", "trend-log,1", n) for n in (1, 2, 3)] + [
+        ("Trends", "trend-log,2", n) for n in (4, 5)
+    ]
+    expected = {"device,1/trend-log,1": 3, "device,1/trend-log,2": 5}
+    with open(service.sq_fp) as sequences:
+        assert json.load(sequences) == expected
+    assert service.load_sequences() == expected
+
+    # the next cycle finds nothing new, and writes nothing
+    written.clear()
+    asyncio.run(service.collect())
+    assert written == []
@@ -0,0 +1,44 @@
+import asyncio
+import logging
+from src.bacnet_client.MongoClient import WriteExecutor
+
+
+def test_writes_overlap_within_the_concurrency_bound():
+    running, peak = [0], [0]
+
+    async def write(seconds):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(seconds)
+        running[0] -= 1
+
+    async def main():
+        async with WriteExecutor(3, logging.getLogger("test")) as writer:
+            for _ in range(10):
+                await writer.submit(write(0.01))
+        return writer
+
+    writer = asyncio.run(main())
+    assert peak[0] == 3 and writer.count == 10
+
+
+def test_writes_to_a_key_keep_their_order_and_errors_are_collected():
+    applied = []
+
+    async def write(key, n, seconds):
+        await asyncio.sleep(seconds)
+        if n == 1 and key == "b":
+            raise ValueError("rejected")
+        applied.append((key, n))
+
+    async def main():
+        writer = WriteExecutor(8, logging.getLogger("test"))
+        for n, seconds in enumerate((0.03, 0.0, 0.01)):
+            await writer.submit(write("a", n, seconds), key="a")
+            await writer.submit(write("b", n, seconds), key="b")
+        return await writer.drain()
+
+    errors = asyncio.run(main())
+    assert [n for key, n in applied if key == "a"] == [0, 1, 2]
+    assert [n for key, n in applied if key == "b"] == [0, 2]
+    assert [(key, str(e)) for key, e in errors] == [("b", "rejected")]